@@ -0,0 +1,153 @@
+import os
+import random
+from pandas import DataFrame, read_excel
+from typing import List, Tuple
+
+SAMPLE_FILE_CONFIGS = [
+    os.path.join('configs', 'files', 'publication_params_training.xlsx'),
+    os.path.join('configs', 'files', 'publication_params_validation.xlsx')
+]
+
+BODY_SENTENCES = [
+    'The {variant} variant was expressed in HEK293 cells and its activity was measured with a luciferase assay.',
+    'Western blot analysis showed reduced protein expression of {gene} compared with the wild type.',
+    'Patients carrying the variant presented with an early onset of the disease.',
+    'Immunofluorescence revealed an abnormal localization of the mutant protein in the cytoplasm.',
+    'Statistical significance was assessed with a two-tailed t-test (p < 0.05).',
+]
+REFERENCE_LINE = '{n}. Smith J, Doe A, et al. Functional study of {gene} variants. J Med Genet. 20{year:02d};{n}:{n}-{m}. doi:10.1136/{n}'
+ANSWERS = [
+    'Assay information not present in the publication.',
+    'Assays indicate the variant is pathogenic: the luciferase activity was reduced to 20% of the wild type.',
+    'Assays indicate the variant is benign, with a normal localization of the protein.',
+    'The variant has intermediate function according to the splicing assay.',
+    'Assays are inconclusive for this variant.',
+]
+
+
+def read_sample_publications() -> DataFrame:
+    """
+    :return: publication params of the sample configuration files (variants, genes and aliases of real papers)
+    """
+    return read_excel(SAMPLE_FILE_CONFIGS[0])
+
+
+def make_alias_list(size: int, seed: int = 0) -> List[str]:
+    """
+    Generates a list of variant aliases, starting with the aliases of the sample publications
+    and completed with synthetic ones
+
+    :param size: # of aliases
+    :return: aliases
+    """
+    aliases: List[str] = []
+    for cell in read_sample_publications()['variant_aliases'].dropna():
+        aliases.extend(s.strip() for s in str(cell).split(','))
+    rng = random.Random(seed)
+    while len(aliases) < size:
+        position = rng.randint(1, 9999)
+        aliases.append(f'c.{position}{rng.choice("ACGT")}>{rng.choice("ACGT")}')
+        aliases.append(f'p.{rng.choice(["Arg", "Cys", "Gly", "Ser"])}{position // 3}{rng.choice(["Trp", "Tyr", "Leu", "Ter"])}')
+    return list(dict.fromkeys(aliases))[:size]
+
+
+def make_page_texts(body_pages: int, reference_pages: int, lines_per_page: int = 50) -> List[str]:
+    """
+    Generates the text of the pages of a paper: body pages, then a references heading and reference pages
+
+    :return: text of each page
+    """
+    pages = []
+    for page in range(body_pages):
+        lines = [BODY_SENTENCES[(page + i) % len(BODY_SENTENCES)].format(variant='c.70T>C', gene='BRCA1')
+                 for i in range(lines_per_page)]
+        if page == body_pages - 1 and reference_pages:
+            lines.append('References')
+        pages.append('\n'.join(lines) + '\n')
+    for page in range(reference_pages):
+        lines = [REFERENCE_LINE.format(n=page * lines_per_page + i + 1, m=i + 9, gene='BRCA1', year=i % 24)
+                 for i in range(lines_per_page)]
+        pages.append('\n'.join(lines) + '\n')
+    return pages
+
+
+def add_page_noise(pages: List[str]) -> List[str]:
+    """
+    Adds the noise of the text extracted from PDF files to the pages of a paper: running header and footer,
+    page number, figure text, and words broken across lines
+
+    :return: text of each page
+    """
+    return [
+        f'J Med Genet 2019;56:{100 + page}-{130}. doi:10.1136/jmedgenet-2018-105\nOriginal article\n'
+        + text.replace('luciferase assay', 'lucif-\nerase  assay').replace('expression of', 'expres-\nsion   of')
+        + f'0 20 40 60 80 100\nA\nSmith J, et al. J Med Genet 2019;56:100-130.\n{page + 1}\n'
+        for page, text in enumerate(pages)
+    ]
+
+
+def make_pdf(path: str, pages: List[str]) -> None:
+    """
+    Writes a minimal PDF file (Helvetica text, one line per text line) with the given pages
+    """
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in pages:
+        lines = [line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in text.splitlines()]
+        content = 'BT /F1 8 Tf 36 770 Td 10 TL ' + ' '.join(f"({line}) '" for line in lines) + ' ET'
+        objects.append(f'<< /Length {len(content)} >>\nstream\n{content}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R '
+                       f'/Resources << /Font << /F1 3 0 R >> >> >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    content = '%PDF-1.4\n'
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += f'{number} 0 obj\n{obj}\nendobj\n'
+    xref = len(content)
+    content += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n' + ''.join(f'{offset:010d} 00000 n \n' for offset in offsets)
+    content += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'
+    with open(path, 'w', encoding='latin-1') as fd:
+        fd.write(content)
+
+
+def make_results(rows: int, seed: int = 0) -> DataFrame:
+    """
+    Generates result rows as written by execute_prompts.py
+
+    :param rows: # of rows
+    :return: results
+    """
+    rng = random.Random(seed)
+    return DataFrame({
+        'id': [f'pub-{i // 5}' for i in range(rows)],
+        'file_name': [f'paper-{i // 5}.pdf' for i in range(rows)],
+        'prompt_id': [i % 5 + 1 for i in range(rows)],
+        'prompt': ['In the publication, check if the variant was tested using functional assays.'] * rows,
+        # Answers are mostly the same few phrases, with some free text
+        'answer': [rng.choice(ANSWERS) if rng.random() < 0.8 else f'The variant {i} showed {rng.random():.3f} activity.'
+                   for i in range(rows)],
+        'variant': ['BRCA1 c.70T>C'] * rows,
+        'gene': ['BRCA1'] * rows,
+        'prompt_tokens': [rng.randint(1000, 30000) for _ in range(rows)],
+        'completion_tokens': [rng.randint(5, 200) for _ in range(rows)],
+    })
+
+
+def make_variants(size: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generates (gene, variant) pairs written like the variants of the sample publications
+
+    :param size: # of variants
+    :return: variants
+    """
+    samples = read_sample_publications()[['gene', 'variant']].astype(str).values.tolist()
+    rng = random.Random(seed)
+    variants = [tuple(sample) for sample in samples]
+    while len(variants) < size:
+        position = rng.randint(1, 9999)
+        variants.append((rng.choice(['BRCA1', 'LDLR', 'VWF']),
+                         f'c.{position}{rng.choice("ACGT")}>{rng.choice("ACGT")} (p.{rng.choice("ACDEFGHIKLMNPQRSTVWY")}{position // 3}{rng.choice("ACDEFGHIKLMNPQRSTVWY")})'))
+    return variants[:size]
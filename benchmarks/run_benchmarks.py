@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from string import Template
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks import inputs
+from outcome_post_process import classify_answers, process_answer
+from utils import file_utils, variant_utils
+from utils.context_window import reduce_context
+from utils.text_normalization import normalize_text
+from utils.nomenclature import get_nomenclature_variations_notation
+from utils.question_utils import KEY_QUESTION, KEY_QUESTIONS, KEY_SYSMSG
+from utils.result_sink import iter_results
+
+DEFAULT_BASELINE_FILE = os.path.join('benchmarks', 'baseline.json')
+DEFAULT_RESULT_DIR = os.path.join('benchmarks', 'results')
+DEFAULT_REPEAT = 5
+# A benchmark regresses when its best time is this much slower than the baseline (0.25 = 25% slower)
+DEFAULT_THRESHOLD = 0.25
+QUESTIONS_FILE = os.path.join('configs', 'questions', 'genetics_questions-variants.json')
+PACKAGES = ['pandas', 'PyPDF2', 'pdfminer.six', 'pyarrow', 'tiktoken', 'openai']
+
+
+class Benchmark(NamedTuple):
+    name: str
+    description: str
+    # Builds the inputs of the benchmark (untimed) in a scratch folder, at a size multiplier,
+    # and returns the function to time
+    setup: Callable[[str, float], Callable[[], Any]]
+    # # of calls per timed repeat (for stages too fast to time a single call)
+    number: int = 1
+
+
+def __scaled(size: int, scale: float) -> int:
+    return max(int(size * scale), 1)
+
+
+def setup_pdf_extraction(workdir: str, scale: float) -> Callable[[], Any]:
+    path = os.path.join(workdir, 'paper.pdf')
+    inputs.make_pdf(path, inputs.make_page_texts(__scaled(30, scale), __scaled(10, scale)))
+    extractor = file_utils.PdfExtractor([file_utils.BACKEND_PYPDF2])
+    return lambda: extractor.extract(path)
+
+
+def setup_reference_removal(workdir: str, scale: float) -> Callable[[], Any]:
+    pages = inputs.make_page_texts(__scaled(60, scale), __scaled(20, scale))
+    return lambda: file_utils.collect_pdf_text(iter(pages), len(pages), 'benchmark', early_stop=False)
+
+
+def setup_text_normalization(workdir: str, scale: float) -> Callable[[], Any]:
+    text = ''.join(inputs.add_page_noise(inputs.make_page_texts(__scaled(60, scale), 0)))
+    return lambda: normalize_text(text)
+
+
+def setup_alias_matcher_build(workdir: str, scale: float) -> Callable[[], Any]:
+    aliases = inputs.make_alias_list(__scaled(2000, scale))
+    return lambda: variant_utils.AliasMatcher(aliases)
+
+
+def setup_alias_scan(workdir: str, scale: float) -> Callable[[], Any]:
+    aliases = inputs.make_alias_list(__scaled(2000, scale))
+    text = ''.join(inputs.make_page_texts(__scaled(60, scale), 0))
+    matcher = variant_utils.AliasMatcher(aliases)
+    return lambda: matcher.scan(text)
+
+
+def setup_context_reduction(workdir: str, scale: float) -> Callable[[], Any]:
+    aliases = inputs.make_alias_list(__scaled(200, scale))
+    text = '\n\n'.join(inputs.make_page_texts(__scaled(60, scale), 0))
+    return lambda: reduce_context(text, aliases)
+
+
+def setup_prompt_templating(workdir: str, scale: float) -> Callable[[], Any]:
+    with open(QUESTIONS_FILE, 'r') as fd:
+        questions_parameters = json.load(fd)
+    aliases = inputs.make_alias_list(__scaled(200, scale))
+    content = ''.join(inputs.make_page_texts(__scaled(60, scale), 0))
+
+    def render() -> List[str]:
+        # Same substitutions as execute_prompts.py, for the system message and every question
+        messages = [Template(questions_parameters[KEY_SYSMSG]).substitute(
+            param_variant='c.70T>C', param_gene='BRCA1', param_variant_aliases=', '.join(aliases))]
+        for question in questions_parameters[KEY_QUESTIONS]:
+            messages.append(Template(question[KEY_QUESTION]).substitute(
+                param_variant='c.70T>C', param_gene='BRCA1', content=content))
+        return messages
+    return render
+
+
+def setup_variant_aliases(workdir: str, scale: float) -> Callable[[], Any]:
+    variants = inputs.make_variants(__scaled(2000, scale))
+
+    def generate() -> int:
+        count = 0
+        for gene, variant in variants:
+            try:
+                count += len(get_nomenclature_variations_notation(gene, variant))
+            except ValueError:
+                pass
+        return count
+    return generate
+
+
+def setup_result_reading(workdir: str, scale: float) -> Callable[[], Any]:
+    path = os.path.join(workdir, 'results.csv')
+    inputs.make_results(__scaled(100000, scale)).to_csv(path, index=False)
+    return lambda: sum(len(chunk) for chunk in iter_results(path))
+
+
+def setup_outcome_classification(workdir: str, scale: float) -> Callable[[], Any]:
+    answers = inputs.make_results(__scaled(100000, scale))['answer']
+    return lambda: classify_answers(answers)
+
+
+def setup_process_answer(workdir: str, scale: float) -> Callable[[], Any]:
+    rows = inputs.make_results(__scaled(20000, scale))[['answer']].to_dict('records')
+    return lambda: [process_answer(row) for row in rows]
+
+
+BENCHMARKS: List[Benchmark] = [
+    Benchmark('pdf_extraction', 'PyPDF2 extraction of a 40-page PDF file, stopping at its references', setup_pdf_extraction),
+    Benchmark('reference_removal', 'Collection of 80 pages of text and removal of their reference section', setup_reference_removal, 5),
+    Benchmark('text_normalization', 'Normalization of 60 pages of text with running headers, footers and broken words', setup_text_normalization, 5),
+    Benchmark('alias_matcher_build', 'Compilation of a matcher of 2000 variant aliases', setup_alias_matcher_build, 5),
+    Benchmark('alias_scan', 'Scan of 60 pages of text for 2000 variant aliases', setup_alias_scan, 5),
+    Benchmark('context_reduction', 'Reduction of 60 pages of text to the paragraphs relevant to a variant', setup_context_reduction),
+    Benchmark('prompt_templating', 'Substitution of the system message and questions, with 60 pages of content', setup_prompt_templating, 1000),
+    Benchmark('variant_aliases', 'Nomenclature aliases of 2000 variants', setup_variant_aliases),
+    Benchmark('result_reading', 'Chunked reading of a 100000-row result CSV file', setup_result_reading),
+    Benchmark('outcome_classification', 'Classification of 100000 answers (outcome_post_process.classify_answers)', setup_outcome_classification),
+    Benchmark('process_answer', 'Classification of 20000 answers row by row (outcome_post_process.process_answer)', setup_process_answer),
+]
+
+
+def time_benchmark(benchmark: Benchmark, workdir: str, scale: float, repeat: int) -> Dict[str, Any]:
+    """
+    Times a benchmark: its function is called once to warm up, then `repeat` times `number` calls are timed
+
+    :return: timings, in seconds per call
+    """
+    function = benchmark.setup(workdir, scale)
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(benchmark.number):
+            function()
+        timings.append((time.perf_counter() - start) / benchmark.number)
+    return {
+        'description': benchmark.description,
+        'repeat': repeat,
+        'number': benchmark.number,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def __package_version(name: str) -> Optional[str]:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def __git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> Dict[str, Any]:
+    """
+    :return: metadata of the machine and software the benchmarks ran on
+    """
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'packages': {name: __package_version(name) for name in PACKAGES},
+        'git_commit': __git_commit(),
+    }
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compares the best time of each benchmark to the baseline
+
+    :param results: benchmark results
+    :param baseline: baseline results
+    :param threshold: relative slowdown beyond which a benchmark regresses
+    :return: names of the regressed benchmarks
+    """
+    if baseline.get('scale') != results['scale']:
+        logging.warning(f"Baseline ran at scale {baseline.get('scale')}, not {results['scale']}: timings are not comparable")
+    regressions = []
+    for name, timing in results['benchmarks'].items():
+        baseline_timing = baseline['benchmarks'].get(name)
+        if baseline_timing is None:
+            logging.info(f'{name:<24} {timing["min"] * 1000:10.2f} ms (not in the baseline)')
+            continue
+        ratio = timing['min'] / baseline_timing['min']
+        regressed = ratio > 1 + threshold
+        logging.log(logging.WARNING if regressed else logging.INFO,
+                    f'{name:<24} {timing["min"] * 1000:10.2f} ms, baseline {baseline_timing["min"] * 1000:10.2f} ms '
+                    f'({ratio - 1:+.1%}){" REGRESSION" if regressed else ""}')
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def __write_json(data: Dict[str, Any], path: str) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fd:
+        json.dump(data, fd, indent=2)
+        fd.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the CPU stages of the pipeline on synthetic inputs, and compare them to a baseline')
+    parser.add_argument(
+        '--benchmarks', help='Benchmarks to run (all by default)', nargs='+', required=False,
+        choices=[benchmark.name for benchmark in BENCHMARKS])
+    parser.add_argument(
+        '--repeat', help='# of timed repeats of each benchmark', required=False, type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        '--scale', help='Multiplier of the size of the synthetic inputs', required=False, type=float, default=1.0)
+    parser.add_argument(
+        '--outputFile', help='JSON file to write the results to (by default, a timestamped file in benchmarks/results)',
+        required=False)
+    parser.add_argument(
+        '--baseline', help='Baseline JSON file to compare the results to', required=False, default=DEFAULT_BASELINE_FILE)
+    parser.add_argument(
+        '--saveBaseline', help='Writes the results as the new baseline instead of comparing them', action='store_true')
+    parser.add_argument(
+        '--threshold', help='Relative slowdown of a benchmark failing the comparison (0.25 = 25%% slower)', required=False,
+        type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        handlers=[logging.StreamHandler()])
+    # Extraction logs every PDF file, once per call
+    logging.getLogger().handlers[0].addFilter(lambda record: record.levelno > logging.INFO or record.module == 'run_benchmarks')
+
+    selected = [benchmark for benchmark in BENCHMARKS if not args.benchmarks or benchmark.name in args.benchmarks]
+    results = {'environment': get_environment(), 'scale': args.scale, 'benchmarks': {}}
+    with tempfile.TemporaryDirectory(prefix='benchmarks-') as workdir:
+        for benchmark in selected:
+            timing = time_benchmark(benchmark, workdir, args.scale, args.repeat)
+            results['benchmarks'][benchmark.name] = timing
+            logging.info(f'{benchmark.name:<24} min {timing["min"] * 1000:10.2f} ms, median {timing["median"] * 1000:10.2f} ms')
+
+    output_file = args.outputFile or os.path.join(DEFAULT_RESULT_DIR, f'benchmark-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+    __write_json(results, output_file)
+    logging.info(f'Wrote the results to {os.path.abspath(output_file)}')
+
+    if args.saveBaseline:
+        __write_json(results, args.baseline)
+        logging.info(f'Wrote the baseline to {os.path.abspath(args.baseline)}')
+        return
+    if not os.path.exists(args.baseline):
+        logging.warning(f'No baseline at {args.baseline}: run with --saveBaseline to record one')
+        return
+    with open(args.baseline, 'r') as fd:
+        baseline = json.load(fd)
+    regressions = compare_to_baseline(results, baseline, args.threshold)
+    if regressions:
+        logging.error(f'{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}: {regressions}')
+        sys.exit(1)
+    logging.info(f'No benchmark regressed by more than {args.threshold:.0%}')
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,38 @@ import logging
 from logging.handlers import TimedRotatingFileHandler
 from logging import DEBUG, INFO
 import argparse
-import csv
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
 from string import Template
 from utils import file_utils, variant_utils
-from pandas import read_excel
+from utils.extraction_cache import ExtractionCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+from utils.pdf_prefetcher import PdfPrefetcher, DEFAULT_LOOKAHEAD
+from utils.rate_limiter import RateLimiter, call_with_retries
+from utils.context_window import reduce_context, DEFAULT_ASSAY_KEYWORDS, DEFAULT_WINDOW, DEFAULT_TOKEN_BUDGET
+from utils.text_normalization import normalize_text, STEPS as NORMALIZATION_STEPS, DEFAULT_STEPS as DEFAULT_NORMALIZATION_STEPS, DEFAULT_MIN_REPEATS
+from utils.question_graph import QuestionGraph, GraphNode, VARIANT_LONGEST, VARIANT_GENE, VARIANT_INHERIT, DEFAULT_MAX_PARALLEL_NODES
+from utils.variant_index import VariantIndex, DEFAULT_INDEX_FILE as DEFAULT_VARIANT_INDEX_FILE
+from utils.question_utils import (
+    KEY_SYSMSG, KEY_QUESTIONS, KEY_QUESTION_GRAPH, KEY_QUESTION, KEY_QUESTION_ID, KEY_STOP_CONDITION, KEY_RESP_REGEX,
+    KEY_SHARED_CONTENT_MESSAGE, KEY_SHARED_CONTENT_REFERENCE, DEFAULT_SHARED_CONTENT_MESSAGE, DEFAULT_SHARED_CONTENT_REFERENCE,
+    NO_EVIDENCE_ANSWER, has_no_evidence, get_no_evidence_regexes, find_completed_publications)
+from utils.result_sink import ResultSink, create_result_sink, open_result_sink, read_results, drop_publications, FORMATS as RESULT_FORMATS, FORMAT_CSV, DEFAULT_FLUSH_EVERY_ROWS, DEFAULT_FLUSH_INTERVAL_SECONDS
+from utils.batch_backend import BatchBackend, BatchRequest, create_batch_backend, write_batch_requests, read_batch_results, BACKENDS as BATCH_BACKENDS, BACKEND_LOCAL
+from utils.token_accounting import (
+    Deployment, UsageProjection, ContextLimitExceeded, load_deployment, fit_messages, count_message_tokens, count_tokens,
+    POLICIES as CONTEXT_POLICIES, POLICY_TRIM, DEFAULT_DEPLOYMENT_CONFIG)
+from utils.manifest import Publication, load_manifest, select_publications, MANIFEST_EXTENSIONS, DEFAULT_CACHE_DIR as DEFAULT_MANIFEST_CACHE_DIR
+from utils.response_cache import ResponseCache, MODES as RESPONSE_CACHE_MODES, MODE_OFF, DEFAULT_CACHE_FILE as DEFAULT_RESPONSE_CACHE_FILE
+from utils.instrumentation import Metrics, profile, PROFILERS, DEFAULT_PROFILE_DIR
+from utils.deployment_pool import DeploymentPool, load_endpoints
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, FIRST_EXCEPTION, wait
+import threading
 import time
 import re
 import json
 import pathlib
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Set, Generator, NamedTuple, Tuple
 
 CSV_COLUMNS = [
     'id',
@@ -31,74 +51,552 @@ CSV_COLUMNS = [
     'prompt_tokens',
     'completion_tokens',
     'estimated_cost',
-    'timestamp'
+    'timestamp',
+    'time_to_first_token',
+    'time_to_decision'
 ]
 
-KEY_SYSMSG = "system_message"
-KEY_QUESTIONS = "questions"
-KEY_QUESTION = "question"
-KEY_QUESTION_ID = "id"
-KEY_STOP_CONDITION = "stop_condition"
-KEY_RESP_REGEX = "response_regex"
+# Finish reason of a streamed answer cut short as soon as it matched a stop regex
+FINISH_REASON_STOP_REGEX = 'stop_regex'
+
+class PromptRequest(NamedTuple):
+    prompt_id: int
+    messages: List[Dict]
+    # Regexes deciding the outcome of the prompt as soon as the answer matches one (e.g. no evidence found)
+    stop_regexes: List[str]
+    # Prompts likely to follow this one, given the predicted answers, which can be sent ahead of time
+    speculations: Tuple['PromptRequest', ...] = ()
+
+class SharedPaper(NamedTuple):
+    # Text of a PDF file shared by several publications, extracted once
+    text: str
+    # System message about all the variants of the publications, and the paper: the conversation about each publication
+    # starts with these same messages, so that they form a stable prefix of all its requests
+    messages: List[Dict]
+
+# Conversation with GPT about a publication: yields each prompt, and is sent the response to each prompt,
+# so that the same prompting logic runs whether requests are sent one by one or in batches.
+# Returns the variant with functional evidence (if found).
+Conversation = Generator[PromptRequest, Dict, Optional[str]]
+
+# Conversation with GPT about a publication, following a question graph: yields the prompts of the nodes ready to be asked
+# (which can be sent at the same time), and is sent the responses to any of the prompts sent so far, by prompt #
+GraphConversation = Generator[List[PromptRequest], Dict[int, Dict], None]
+
+class ConversationSetup(NamedTuple):
+    # Longest alias of the variant found in the publication (if any)
+    longest_variant: Optional[str]
+    # Messages the conversation starts with (system message, and shared paper if grouped)
+    messages: List[Dict]
+    input_params: Dict
 
 class PromptExecutor:
     def __init__(self, args, gpt_deployment: str):
         self.publicationid: str = args.publicationId
         self.sleep_at_each_publication: int = args.sleepAtEachPublication
         self.use_mock: bool = args.useMock
-        self.publications_parameters: Dict[str, Any] = self.__read_publication_configs(args.fileConfig)
+        self.publications_parameters: Dict[str, Publication] = self.__read_publication_configs(
+            args.fileConfig, None if args.noManifestCache else args.manifestCacheDir, args.publicationIds, args.publicationPattern)
         self.questions_parameters: Dict = self.__read_question_configs(args.questionConfig)
-        self.result_file_path: str = self.__setup_result_file()
+        self.question_graph: Optional[QuestionGraph] = None
+        if KEY_QUESTION_GRAPH in self.questions_parameters:
+            self.question_graph = QuestionGraph(self.questions_parameters[KEY_QUESTION_GRAPH])
+        self.max_parallel_nodes: int = args.maxParallelNodes
+        self.dry_run: bool = args.dryRun
+        self.stream: bool = args.stream
+        self.speculative: bool = args.speculative
+        if self.speculative and self.question_graph:
+            logging.warning('Ignoring --speculative, as the independent nodes of the question graph are asked at the same time instead')
+            self.speculative = False
+        # Last "no evidence" answer to each functional evidence question, predicted for the following attempts
+        self.predicted_answers: Dict[Any, str] = {}
+        self.completed_publications: Set[str] = set()
+        if args.resume:
+            self.result_sink: ResultSink = self.__resume_result_sink(args.resume, args.flushEveryRows, args.flushIntervalSeconds)
+        else:
+            self.result_sink = self.__setup_result_sink(args.resultFormat, args.flushEveryRows, args.flushIntervalSeconds)
+        self.result_file_path: str = self.result_sink.path
+        self.call_deadline_seconds: Optional[float] = args.callDeadlineSeconds
+        self.deployment_pool: Optional[DeploymentPool] = None
+        if args.deploymentPool and not self.use_mock and not self.dry_run:
+            self.deployment_pool = DeploymentPool(
+                load_endpoints(args.deploymentPool), deadline_seconds=self.call_deadline_seconds,
+                hedge_percentile=args.hedgePercentile, max_workers=max(args.concurrency, 1) * 4)
+        elif args.deploymentPool:
+            # Endpoints share their model, whose context limit and pricing are used in dry runs
+            gpt_deployment = gpt_deployment or load_endpoints(args.deploymentPool)[0].deployment
+        if self.deployment_pool and not gpt_deployment:
+            gpt_deployment = self.deployment_pool.endpoints[0].deployment
         self.gpt_deployment: str = gpt_deployment
+        self.deployment: Deployment = load_deployment(args.deploymentConfig, gpt_deployment)
+        self.context_policy: str = args.contextPolicy
+        self.context_skipped: List[str] = []
+        self.dry_run_completion_tokens: int = args.dryRunCompletionTokens
+        self.projection: UsageProjection = UsageProjection(self.deployment)
         self.temperature: int = args.temperature
         self.max_tokens: int = args.maxTokens
+        self.pdf_extractor: file_utils.PdfExtractor = file_utils.PdfExtractor(args.extractionBackend, args.extractionPageWorkers)
+        self.extraction_cache: Optional[ExtractionCache] = None
+        if not args.noExtractionCache:
+            self.extraction_cache = ExtractionCache(args.extractionCacheDir, args.extractionCacheMaxMb, self.pdf_extractor)
+        self.extraction_workers: int = args.extractionWorkers
+        self.extraction_lookahead: int = args.extractionLookahead
+        self.pdf_prefetcher: Optional[PdfPrefetcher] = None
+        self.concurrency: int = args.concurrency
+        self.max_retries: int = args.maxRetries
+        self.requests_per_minute: Optional[int] = args.requestsPerMinute
+        self.tokens_per_minute: Optional[int] = args.tokensPerMinute
+        self.rate_limiter: Optional[RateLimiter] = None
+        if (args.requestsPerMinute or args.tokensPerMinute) and not self.dry_run:
+            self.rate_limiter = RateLimiter(args.requestsPerMinute, args.tokensPerMinute)
+        self.result_lock: threading.Lock = threading.Lock()
+        self.reduce_context: bool = args.reduceContext
+        self.group_by_pdf: bool = args.groupByPdf
+        self.context_window: int = args.contextWindow
+        self.context_token_budget: int = args.contextTokenBudget
+        self.normalize_text: bool = args.normalizeText
+        self.normalization_steps: List[str] = args.normalizationSteps
+        self.header_min_repeats: int = args.headerMinRepeats
+        self.context_keywords: List[str] = [s.strip() for s in args.contextKeywords.split(',')] if args.contextKeywords else DEFAULT_ASSAY_KEYWORDS
+        self.variant_index: Optional[VariantIndex] = None
+        if args.skipUnmentioned:
+            self.variant_index = VariantIndex(args.variantIndexFile)
+        self.response_cache: Optional[ResponseCache] = None
+        if args.responseCache != MODE_OFF and not self.use_mock and not self.dry_run:
+            self.response_cache = ResponseCache(
+                args.responseCacheFile, args.responseCache, args.responseCacheMaxMb, args.responseCacheMaxAgeDays)
+        self.batch_backend: Optional[BatchBackend] = None
+        if args.batch:
+            batch_dir = os.path.splitext(self.result_file_path)[0] + '-batches'
+            self.batch_backend = create_batch_backend(
+                args.batchBackend, batch_dir, complete=self.__complete_request, workers=self.concurrency)
+        self.metrics: Metrics = Metrics()
+        self.prometheus_file: Optional[str] = args.prometheusFile
+        self.profiler: Optional[str] = args.profile
+        self.profile_dir: str = args.profileDir
 
     def process(self) -> None:
         """
         Process publications in PDF as per configuration
         """
-        if self.publicationid:
-            # Only process the publication specified in the argument
-            self.__handle_single_publication(self.publicationid)
+        try:
+            if self.publicationid:
+                # Only process the publication specified in the argument
+                if str(self.publicationid) in self.completed_publications:
+                    logging.info(f'Publication already completed in the resumed run: id={self.publicationid}')
+                else:
+                    self.__handle_single_publication(self.publicationid)
+            else:
+                # Process all files included in the specified folder
+                if self.extraction_workers and self.extraction_workers > 0:
+                    # Extract upcoming PDF files in worker processes while prompting
+                    pdf_filepaths = self.__list_pdf_filepaths()
+                    if self.group_by_pdf:
+                        pdf_filepaths = list(dict.fromkeys(pdf_filepaths))
+                    self.pdf_prefetcher = PdfPrefetcher(
+                        pdf_filepaths, self.extraction_workers, self.extraction_lookahead, self.extraction_cache,
+                        self.pdf_extractor)
+                try:
+                    publication_ids = [id for id in self.publications_parameters if str(id) not in self.completed_publications]
+                    if self.completed_publications:
+                        logging.info(f'Resuming the run: {len(publication_ids)} of {len(self.publications_parameters)} publications remaining')
+                    groups = self.__group_publications(publication_ids)
+                    if self.batch_backend:
+                        self.__handle_publications_in_batches(self.batch_backend, groups)
+                    elif self.concurrency and self.concurrency > 1:
+                        self.__handle_publications_concurrently(groups)
+                    else:
+                        count = 0
+                        for group in groups:
+                            self.__handle_publication_group(group)
+                            count += 1
+                            if (self.sleep_at_each_publication and self.sleep_at_each_publication >= 0
+                                and count < len(groups)):
+                                logging.info(f'Sleeping for {self.sleep_at_each_publication} seconds')
+                                time.sleep(self.sleep_at_each_publication)
+                                logging.debug('Awake from the sleep')
+                finally:
+                    if self.pdf_prefetcher:
+                        self.pdf_prefetcher.close()
+                        self.pdf_prefetcher = None
+
+            if self.context_skipped:
+                logging.warning(f'{len(self.context_skipped)} publications skipped, as they do not fit in the context window: {self.context_skipped}')
+            if self.dry_run:
+                self.__log_projection()
+            if self.extraction_cache:
+                logging.info(f'Extraction cache: {self.extraction_cache.hits} hits, {self.extraction_cache.misses} misses')
+            if self.response_cache:
+                logging.info(f'Response cache ({self.response_cache.mode}): {self.response_cache.hits} hits, {self.response_cache.misses} misses')
+        finally:
+            self.result_sink.close()
+            if self.variant_index:
+                self.variant_index.close()
+            if self.response_cache:
+                self.response_cache.close()
+            self.__write_metrics()
+            if self.deployment_pool:
+                self.deployment_pool.log_stats()
+                self.deployment_pool.close()
+
+    def __write_metrics(self) -> None:
+        """
+        Writes the timing and token metrics of the run next to the result file (JSON summary and Prometheus text file)
+        """
+        summary_path = os.path.splitext(self.result_file_path)[0] + '-metrics.json'
+        prometheus_path = self.prometheus_file or os.path.splitext(self.result_file_path)[0] + '-metrics.prom'
+        self.metrics.log_summary()
+        self.metrics.write(summary_path, prometheus_path)
+        logging.info(f'Wrote the run metrics to {summary_path} and {prometheus_path}')
+
+    def __group_publications(self, publication_ids: List[str]) -> List[List[str]]:
+        """
+        Groups the publications sharing a PDF file (with --groupByPdf), in order of their first publication
+
+        :param publication_ids: ids of publications specified in the publication param configs
+        :return: groups of publication ids (a group per publication without --groupByPdf)
+        """
+        if not self.group_by_pdf:
+            return [[id] for id in publication_ids]
+        groups: Dict[str, List[str]] = {}
+        for id in publication_ids:
+            publication = self.publications_parameters.get(str(id))
+            groups.setdefault(publication.pdf_filepath if publication else f'missing:{id}', []).append(id)
+        shared = [group for group in groups.values() if len(group) > 1]
+        if shared:
+            logging.info(f'{sum(len(group) for group in shared)} publications share {len(shared)} PDF files')
+        return list(groups.values())
+
+    def __handle_publication_group(self, publication_ids: List[str]) -> None:
+        """
+        Handles processing of a group of publications sharing a PDF file, one after the other, from the same shared paper
+
+        :param publication_ids: ids of publications specified in the publication param configs
+        """
+        shared = self.__share_paper(publication_ids)
+        for publication_id in publication_ids:
+            self.__handle_single_publication(publication_id, shared)
+
+    def __share_paper(self, publication_ids: List[str]) -> Optional[SharedPaper]:
+        """
+        Extracts the PDF file shared by a group of publications once (reduced to the paragraphs relevant to any
+        of their variants with --reduceContext), and builds the messages their conversations start with
+
+        :param publication_ids: ids of publications sharing a PDF file
+        :return: shared paper, or None for a single publication
+        """
+        publications = [self.publications_parameters[str(id)] for id in publication_ids if str(id) in self.publications_parameters]
+        if len(publications) < 2:
+            return None
+        pdf_filepath = publications[0].pdf_filepath
+        variants = list(dict.fromkeys(publication.variant for publication in publications))
+        genes = list(dict.fromkeys(publication.gene for publication in publications))
+        variant_aliases = list(dict.fromkeys(alias for publication in publications for alias in publication.aliases if alias))
+
+        with self.metrics.span('shared_paper'):
+            with self.metrics.span('extract_pdf'):
+                pdf_in_text = self.__extract_pdf_text(pdf_filepath)
+            if self.normalize_text:
+                with self.metrics.span('normalize_text'):
+                    pdf_in_text = self.__normalize_text(','.join(map(str, publication_ids)), pdf_filepath, pdf_in_text)
+            if self.reduce_context:
+                variant_perms = variant_aliases + variants
+                alias_scan = variant_utils.get_alias_matcher(tuple(variant_perms)).scan(pdf_in_text)
+                with self.metrics.span('reduce_context'):
+                    pdf_in_text = self.__reduce_context(
+                        ','.join(map(str, publication_ids)), pdf_filepath, pdf_in_text, variant_perms,
+                        [match.start for match in alias_scan.matches])
+
+        system_message = self.questions_parameters[KEY_SYSMSG]
+        if '$param' in system_message:
+            system_message = Template(system_message).substitute(
+                param_variant=', '.join(variants), param_gene=', '.join(genes), param_variant_aliases=', '.join(variant_aliases))
+        paper_message = Template(self.questions_parameters.get(KEY_SHARED_CONTENT_MESSAGE, DEFAULT_SHARED_CONTENT_MESSAGE)).substitute(
+            content=pdf_in_text)
+        messages = [{"role": "system", "content": system_message}, {"role": "user", "content": paper_message}]
+        logging.info(f'{len(publications)} publications share {pdf_filepath}: its ~{count_message_tokens(messages, self.deployment.model)} '
+                     f'prompt tokens are sent once per request, ahead of the questions about each variant')
+        return SharedPaper(pdf_in_text, messages)
+
+    def __handle_publications_concurrently(self, groups: List[List[str]]) -> None:
+        """
+        Processes publications in a pool of threads. Each publication's prompts still run in order
+        within a single thread, while the rate limiter paces the calls across all publications.
+
+        :param groups: groups of ids of publications sharing a PDF file (processed in the same thread)
+        """
+        if self.sleep_at_each_publication:
+            logging.warning('Ignoring --sleepAtEachPublication, as calls are paced by the rate limiter instead')
+        logging.info(f'Processing {sum(len(group) for group in groups)} publications with a concurrency of {self.concurrency}')
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='publication') as pool:
+            futures = [pool.submit(self.__handle_publication_group, group) for group in groups]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                # Raise the first error, like processing publications one at a time would
+                future.result()
+
+    def __handle_publications_in_batches(self, batch_backend: BatchBackend, groups: List[List[str]]) -> None:
+        """
+        Processes publications in rounds of batch jobs: each round, the next prompt of every ongoing conversation
+        (the prompts of the nodes ready to be asked, with a question graph) is written to a batch file (`custom_id` = publication id and prompt #), submitted to the batch backend,
+        and the conversations are advanced with the responses, until every conversation has ended.
+
+        :param batch_backend: backend running the batch jobs
+        :param groups: groups of ids of publications sharing a PDF file
+        """
+        conversations: Dict[str, GraphConversation] = {}
+        pending: Dict[str, List[PromptRequest]] = {}
+        for group in groups:
+            shared = self.__share_paper(group)
+            for publication_id in group:
+                conversation = self.__start_batched_conversation(publication_id, shared)
+                if conversation:
+                    conversations[publication_id] = conversation
+                    self.__advance_conversation(publication_id, conversation, None, pending)
+
+        batch_round = 0
+        while pending:
+            batch_round += 1
+            requests = {
+                f'{publication_id}:{prompt.prompt_id}': (publication_id, prompt.prompt_id, self.__build_chat_completion_request(prompt.messages))
+                for publication_id, prompts in pending.items() for prompt in prompts
+            }
+            requests_path = os.path.splitext(self.result_file_path)[0] + f'-requests_{batch_round}.jsonl'
+            write_batch_requests(requests_path, [BatchRequest(custom_id, body) for custom_id, (_, _, body) in requests.items()])
+            logging.info(f'Batch round #{batch_round}: {len(requests)} requests written to {requests_path}')
+
+            batch_id = batch_backend.submit(requests_path)
+            results = read_batch_results(batch_backend.wait(batch_id))
+
+            responses: Dict[str, Dict[int, Dict]] = {}
+            for custom_id, (publication_id, prompt_id, _) in requests.items():
+                if publication_id not in conversations:
+                    continue
+                result = results.get(custom_id)
+                if result is None or result.error or result.response is None:
+                    logging.error(f'No response to {custom_id} in batch {batch_id}: '
+                                  f'{result.error if result else "missing"}. Abandoning publication: id={publication_id}')
+                    conversations.pop(publication_id).close()
+                    responses.pop(publication_id, None)
+                    continue
+                responses.setdefault(publication_id, {})[prompt_id] = result.response
+
+            pending = {}
+            for publication_id, publication_responses in responses.items():
+                self.__advance_conversation(publication_id, conversations[publication_id], publication_responses, pending)
+
+    def __advance_conversation(
+            self,
+            publication_id: str,
+            conversation: GraphConversation,
+            responses: Optional[Dict[int, Dict]],
+            pending: Dict[str, List[PromptRequest]]) -> None:
+        """
+        Sends the responses to a conversation (or starts it), and records its next prompts as pending
+        unless the conversation has ended
+
+        :param responses: responses by prompt # (None to start the conversation)
+        """
+        try:
+            pending[publication_id] = conversation.send(responses) if responses is not None else next(conversation)
+        except StopIteration:
+            logging.info(f'** End processing publication Id: {publication_id}\n')
+        except ContextLimitExceeded as ex:
+            self.__skip_oversized_publication(publication_id, ex)
+
+    def __handle_single_publication(self, publication_id: str, shared: Optional[SharedPaper] = None) -> None:
+        """
+        Handles processing of a single publication, sending its prompts one by one
+
+        :param publication_id: id of publication specified in the publication param configs
+        :param shared: paper shared with other publications, if grouped
+        """
+        with profile(self.profiler, self.profile_dir, publication_id), self.metrics.span('publication', publication_id):
+            try:
+                if self.question_graph:
+                    graph_conversation = self.__start_graph_conversation(self.question_graph, publication_id, shared)
+                    if graph_conversation:
+                        self.__run_graph_conversation(graph_conversation)
+                else:
+                    conversation = self.__start_conversation(publication_id, shared)
+                    if conversation and self.speculative:
+                        self.__run_conversation_speculatively(conversation)
+                    elif conversation:
+                        prompt = next(conversation)
+                        while True:
+                            prompt = conversation.send(self.__call_openapi_chat_completion(prompt.messages, prompt.stop_regexes))
+            except StopIteration:
+                pass
+            except ContextLimitExceeded as ex:
+                self.__skip_oversized_publication(publication_id, ex)
+
+        logging.info(f'** End processing publication Id: {publication_id}\n')
+
+    def __run_conversation_speculatively(self, conversation: Conversation) -> None:
+        """
+        Runs a conversation, sending the speculative prompts that come with each prompt at the same time.
+        A speculative response is only used when the conversation then sends exactly the same request
+        (i.e. the predicted answers were the actual ones), so that the conversation is the same as if prompts
+        were sent one by one. Other speculative responses are discarded.
+        """
+        speculative: Dict[str, Tuple[PromptRequest, Future]] = {}
+        pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='speculation')
+        try:
+            prompt = next(conversation)
+            while True:
+                key = self.__request_key(prompt.messages)
+                if key in speculative:
+                    logging.info(f'Using the speculative response to prompt #{prompt.prompt_id}')
+                    future = speculative.pop(key)[1]
+                else:
+                    future = pool.submit(self.metrics.bind(self.__call_openapi_chat_completion), prompt.messages, prompt.stop_regexes)
+                for speculation in prompt.speculations:
+                    speculation_key = self.__request_key(speculation.messages)
+                    if speculation_key not in speculative:
+                        logging.info(f'Sending prompt #{speculation.prompt_id} speculatively')
+                        speculative[speculation_key] = (speculation, pool.submit(
+                            self.metrics.bind(self.__call_openapi_chat_completion), speculation.messages, speculation.stop_regexes))
+                prompt = conversation.send(future.result())
+        finally:
+            for speculation, future in speculative.values():
+                if not future.cancel():
+                    def log_discarded(done: Future, prompt_id: int = speculation.prompt_id) -> None:
+                        self.__log_discarded_speculation(prompt_id, done)
+                    future.add_done_callback(log_discarded)
+            pool.shutdown(wait=False)
+
+    def __run_graph_conversation(self, conversation: GraphConversation) -> None:
+        """
+        Runs a question graph conversation, sending the prompts of the nodes ready to be asked at the same time,
+        and sending each response to the conversation as soon as it arrives, so that the nodes it leads to are asked
+        without waiting for the other nodes being asked
+        """
+        in_flight: Dict[Future, int] = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_parallel_nodes, thread_name_prefix='node')
+        try:
+            prompts = next(conversation)
+            while True:
+                for prompt in prompts:
+                    future = pool.submit(self.metrics.bind(self.__call_openapi_chat_completion), prompt.messages, prompt.stop_regexes)
+                    in_flight[future] = prompt.prompt_id
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                prompts = conversation.send({in_flight.pop(future): future.result() for future in done})
+        finally:
+            for future in in_flight:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def __log_discarded_speculation(self, prompt_id: int, future: Future) -> None:
+        if future.exception():
+            logging.info(f'Discarded speculative prompt #{prompt_id}, which failed: {future.exception()}')
         else:
-            # Process all files included in the specified folder
-            count = 0
-            for id in self.publications_parameters:
-                self.__handle_single_publication(id)
-                count += 1
-                if (self.sleep_at_each_publication and self.sleep_at_each_publication >= 0
-                    and count < len(self.publications_parameters)):
-                    logging.info(f'Sleeping for {self.sleep_at_each_publication} seconds')
-                    time.sleep(self.sleep_at_each_publication)
-                    logging.debug('Awake from the sleep')
+            usage = future.result()['usage']
+            logging.info(f"Discarded speculative response to prompt #{prompt_id}: "
+                         f"{usage['prompt_tokens']} prompt tokens, {usage['completion_tokens']} completion tokens")
+
+    def __request_key(self, messages: List[Dict]) -> str:
+        """
+        :return: key identifying a request by its content
+        """
+        return ResponseCache.key_for(self.__build_chat_completion_request(messages))
+
+    def __skip_oversized_publication(self, publication_id: str, ex: ContextLimitExceeded) -> None:
+        logging.warning(f'Skipping the publication, as it does not fit in the context window of {self.deployment.name}: '
+                        f'id={publication_id}, {ex}')
+        with self.result_lock:
+            self.context_skipped.append(publication_id)
 
-    def __handle_single_publication(self, publication_id: str) -> None:
+    def __find_publication(self, publication_id: str) -> Optional[Publication]:
         """
-        Handles processing of a single publication
+        Validates the parameters of a publication
 
         :param publication_id: id of publication specified in the publication param configs
+        :return: publication, or None if the publication cannot or should not be processed
         """
         logging.info(f'** Start processing publication Id: {publication_id}\n')
 
-        publication = self.publications_parameters[publication_id]
+        publication = self.publications_parameters.get(str(publication_id))
         if publication:
-            file_path = os.path.join(publication['file_path'], publication['file_name'])
-            variant = publication['variant']
-            gene = publication['gene']
-            variant_aliases = publication['variant_aliases']
-            variants_parsed = [s.strip() for s in variant_aliases.split(',')]
-            expected_outcome = publication['expected_outcomes']
+            file_path = publication.pdf_filepath
+            variant = publication.variant
+            gene = publication.gene
 
             if file_path and variant and gene and Path(file_path).suffix == '.pdf':
-                self.__execute_sequential_prompts(publication_id, file_path, variant, gene, variants_parsed, expected_outcome)
+                if self.variant_index and self.__is_unmentioned(self.variant_index, file_path, variant, publication.aliases):
+                    logging.info(f'Skipping the publication, as its PDF file does not mention the variant: id={publication_id}')
+                    return None
+                return publication
             else:
                 logging.error(
                     f'Required metadata missing for the publication: id={publication_id}')
         else:
             logging.error(
                 f'Cannot find the publication: id={publication_id}')
-        
-        logging.info(f'** End processing publication Id: {publication_id}\n')         
+        return None
+
+    def __start_conversation(self, publication_id: str, shared: Optional[SharedPaper] = None) -> Optional[Conversation]:
+        """
+        Validates the parameters of a publication, and sets up the conversation about it
+
+        :param publication_id: id of publication specified in the publication param configs
+        :param shared: paper shared with other publications, if grouped
+        :return: conversation, or None if the publication cannot or should not be processed
+        """
+        publication = self.__find_publication(publication_id)
+        if not publication:
+            return None
+        return self.__execute_sequential_prompts(
+            publication_id, publication.pdf_filepath, publication.variant, publication.gene, publication.aliases,
+            publication.expected_outcomes, shared)
+
+    def __start_graph_conversation(
+            self,
+            graph: QuestionGraph,
+            publication_id: str,
+            shared: Optional[SharedPaper] = None) -> Optional[GraphConversation]:
+        """
+        Validates the parameters of a publication, and sets up the conversation about it following the question graph
+
+        :param graph: question graph
+        :param publication_id: id of publication specified in the publication param configs
+        :param shared: paper shared with other publications, if grouped
+        :return: conversation, or None if the publication cannot or should not be processed
+        """
+        publication = self.__find_publication(publication_id)
+        if not publication:
+            return None
+        return self.__execute_question_graph(
+            graph, publication_id, publication.pdf_filepath, publication.variant, publication.gene, publication.aliases,
+            publication.expected_outcomes, shared)
+
+    def __start_batched_conversation(self, publication_id: str, shared: Optional[SharedPaper] = None) -> Optional[GraphConversation]:
+        """
+        Sets up the conversation about a publication as sent in batches, yielding the prompts that can be sent together:
+        those of the nodes ready to be asked with a question graph, or each prompt alone otherwise
+        """
+        if self.question_graph:
+            return self.__start_graph_conversation(self.question_graph, publication_id, shared)
+        conversation = self.__start_conversation(publication_id, shared)
+        return self.__prompt_by_prompt(conversation) if conversation else None
+
+    @staticmethod
+    def __prompt_by_prompt(conversation: Conversation) -> GraphConversation:
+        """
+        Adapts a conversation to the interface of a question graph conversation: each prompt is yielded alone,
+        and is sent its response by prompt #
+        """
+        try:
+            prompt = next(conversation)
+            while True:
+                responses = yield [prompt]
+                prompt = conversation.send(responses[prompt.prompt_id])
+        except StopIteration:
+            return
+        finally:
+            conversation.close()
 
     def __execute_sequential_prompts(
             self,
@@ -107,9 +605,11 @@ class PromptExecutor:
             variant: str,
             gene: str,
             variant_aliases: List[str],
-            expected_outcome: str) -> None:
+            expected_outcome: str,
+            shared: Optional[SharedPaper] = None) -> Conversation:
         """
-        Executes a set of prompts configured for the given publication
+        Executes a set of prompts configured for the given publication, as a conversation
+        yielding each prompt and receiving each prompt's response
 
         :param publication_id: id of publication specified in the publication param configs
         :param pdf_filepath: file location of the publication
@@ -117,48 +617,19 @@ class PromptExecutor:
         :param gene: target gene
         :param variant_aliases: list of variant nomenclature aliases equivalent to the target variant
         :param expected_outcome: expected final outcome from running the prompts for comparison
+        :param shared: paper shared with other publications, if grouped: the conversation starts with its messages,
+                       and the questions refer to the paper instead of carrying it
+        :return: variant used to find functional evidence (if found)
         """
-        logging.debug(f"Id: '{publication_id}', File Path: '{pdf_filepath}', Variant: '{variant}', Gene: '{gene}'")
-
-        # Convert PDF to text
-        pdf_in_text = file_utils.convert_pdf_to_txt(pdf_filepath)
-
-        # Find the longest variant that appears in PDF
-        variant_perms = variant_aliases.copy()
-        variant_perms.append(variant)
-        longest_variant = variant_utils.find_longest_matching_variant(pdf_in_text, variant_perms)
-        logging.info(f'Variants: {variant_perms}')
-        logging.info(f'Longest Variant: {longest_variant}')
-
-        # Initialize with a sysmtem message
-        system_message = self.questions_parameters[KEY_SYSMSG]
-        if '$param' in system_message:
-            system_message = Template(system_message).substitute(param_variant=variant, param_gene=gene, param_variant_aliases=", ".join(variant_aliases))
-        
-        messages = [
-            { 
-                "role": "system",
-                "content": system_message
-            }
-        ]
-        logging.info('> System: ' + messages[0]['content'] + '\n')
+        setup = self.__set_up_conversation(publication_id, pdf_filepath, variant, gene, variant_aliases, expected_outcome, shared)
+        messages = setup.messages
+        input_params = setup.input_params
 
         # Get a list of configured questions (prompts)
         questions = self.questions_parameters[KEY_QUESTIONS]
 
-        # Initialize input parameters
-        input_params = {
-            'index': 0,
-            'param_gene': gene,
-            'content': pdf_in_text,
-            'publication_id': publication_id,
-            'pdf_filepath': pdf_filepath,
-            'system_message': system_message,
-            'expected_outcome': expected_outcome
-        }
-
         # Find variant using question #1 (with content included) and #2 (without content)
-        variant_with_evidence = self.__execute_prompt_for_functional_evidence(variant, longest_variant, questions, messages, input_params)
+        variant_with_evidence = yield from self.__execute_prompt_for_functional_evidence(variant, setup.longest_variant, questions, messages, input_params)
 
         # If functional evidence was found, ask remaining questions
         if variant_with_evidence:
@@ -174,7 +645,8 @@ class PromptExecutor:
                 if KEY_STOP_CONDITION in item and KEY_RESP_REGEX in item[KEY_STOP_CONDITION]:
                     stop_condition = item[KEY_STOP_CONDITION][KEY_RESP_REGEX]
 
-                result = self.__execute_single_prompt(item, variant_with_evidence, messages, input_params)
+                result = yield from self.__execute_single_prompt(
+                    item, variant_with_evidence, messages, input_params, [stop_condition] if stop_condition else None)
 
                 # Check if the stopping condition exists and has been satisfied
                 if stop_condition:
@@ -182,14 +654,267 @@ class PromptExecutor:
                     if found:
                         logging.info(f'Stopping condition {stop_condition} has been satisfied: match={found}')
                         should_stop = True
+
+        return variant_with_evidence
     
+    def __set_up_conversation(
+            self,
+            publication_id: str,
+            pdf_filepath: str,
+            variant: str,
+            gene: str,
+            variant_aliases: List[str],
+            expected_outcome: str,
+            shared: Optional[SharedPaper] = None) -> ConversationSetup:
+        """
+        Extracts the text of a publication, finds the variant in it, and builds the messages the conversation
+        about the publication starts with
+
+        :return: longest alias of the variant found, first messages and input parameters of the conversation
+        """
+        logging.debug(f"Id: '{publication_id}', File Path: '{pdf_filepath}', Variant: '{variant}', Gene: '{gene}'")
+
+        # Convert PDF to text
+        if shared:
+            pdf_in_text = shared.text
+        else:
+            with self.metrics.span('extract_pdf', publication_id):
+                pdf_in_text = self.__extract_pdf_text(pdf_filepath)
+            if self.normalize_text:
+                with self.metrics.span('normalize_text', publication_id):
+                    pdf_in_text = self.__normalize_text(publication_id, pdf_filepath, pdf_in_text)
+
+        # Find the longest variant that appears in PDF
+        variant_perms = variant_aliases.copy()
+        variant_perms.append(variant)
+        with self.metrics.span('find_variant', publication_id):
+            alias_scan = variant_utils.get_alias_matcher(tuple(variant_perms)).scan(pdf_in_text)
+        longest_variant = alias_scan.longest
+        logging.info(f'Variants: {variant_perms}')
+        logging.info(f'Longest Variant: {longest_variant}')
+        logging.debug(f'Variant mentions: {alias_scan.counts}')
+
+        # Keep only the paragraphs relevant to the variant, as the content is re-sent with every prompt
+        if self.reduce_context and not shared:
+            variant_offsets = [match.start for match in alias_scan.matches]
+            with self.metrics.span('reduce_context', publication_id):
+                pdf_in_text = self.__reduce_context(publication_id, pdf_filepath, pdf_in_text, variant_perms, variant_offsets)
+
+        # Initialize with a sysmtem message
+        if shared:
+            messages = list(shared.messages)
+            system_message = messages[0]['content']
+            content = self.questions_parameters.get(KEY_SHARED_CONTENT_REFERENCE, DEFAULT_SHARED_CONTENT_REFERENCE)
+        else:
+            system_message = self.questions_parameters[KEY_SYSMSG]
+            if '$param' in system_message:
+                with self.metrics.span('template', publication_id):
+                    system_message = Template(system_message).substitute(param_variant=variant, param_gene=gene, param_variant_aliases=", ".join(variant_aliases))
+            messages = [
+                {
+                    "role": "system",
+                    "content": system_message
+                }
+            ]
+            content = pdf_in_text
+        logging.info('> System: ' + messages[0]['content'] + '\n')
+
+        # Initialize input parameters
+        input_params = {
+            'index': 0,
+            'param_gene': gene,
+            # Substituted in the questions, and trimmed to fit the context window, respectively
+            'content': content,
+            'paper': pdf_in_text,
+            'publication_id': publication_id,
+            'pdf_filepath': pdf_filepath,
+            'system_message': system_message,
+            'expected_outcome': expected_outcome
+        }
+        return ConversationSetup(longest_variant, messages, input_params)
+
+    def __execute_question_graph(
+            self,
+            graph: QuestionGraph,
+            publication_id: str,
+            pdf_filepath: str,
+            variant: str,
+            gene: str,
+            variant_aliases: List[str],
+            expected_outcome: str,
+            shared: Optional[SharedPaper] = None) -> GraphConversation:
+        """
+        Asks the nodes of the question graph about the given publication as a conversation yielding the prompts
+        of the nodes ready to be asked, and receiving the responses to any of them, until every node is settled
+        (asked or skipped)
+
+        :param graph: question graph
+        :param publication_id: id of publication specified in the publication param configs
+        :param pdf_filepath: file location of the publication
+        :param variant: target variant
+        :param gene: target gene
+        :param variant_aliases: list of variant nomenclature aliases equivalent to the target variant
+        :param expected_outcome: expected final outcome from running the prompts for comparison
+        :param shared: paper shared with other publications, if grouped
+        """
+        setup = self.__set_up_conversation(publication_id, pdf_filepath, variant, gene, variant_aliases, expected_outcome, shared)
+        # Messages every node's conversation starts with (system message, and shared paper if grouped)
+        messages = setup.messages
+        input_params = setup.input_params
+        # Other forms of the variant the nodes can ask about (longest alias, gene-prefixed variant)
+        variants = {VARIANT_LONGEST: setup.longest_variant or variant, VARIANT_GENE: f'{gene} {variant}'}
+        run = graph.start(take_all_edges=self.dry_run)
+        # Question and answer of each node answered, and variant each node asked about
+        exchanges: Dict[str, List[Dict]] = {}
+        node_variants: Dict[str, str] = {}
+        # Prompt being asked for each node, by prompt #
+        in_flight: Dict[int, Tuple[GraphNode, List[Dict], Generator[PromptRequest, Dict, Dict]]] = {}
+        while True:
+            prompts = []
+            for node in run.ready():
+                if node.variant == VARIANT_INHERIT:
+                    trigger = run.trigger(node.id)
+                    node_variants[node.id] = node_variants[trigger] if trigger else variant
+                else:
+                    node_variants[node.id] = variants.get(node.variant, variant)
+                node_messages = list(messages)
+                if node.history:
+                    for ancestor in run.history(node.id):
+                        node_messages += exchanges[ancestor]
+                execution = self.__execute_single_prompt(node.question, node_variants[node.id], node_messages, input_params, node.stop_regexes)
+                prompt = next(execution)
+                in_flight[prompt.prompt_id] = (node, node_messages, execution)
+                prompts.append(prompt)
+            if not in_flight:
+                return
+
+            responses = yield prompts
+            for prompt_id, response in responses.items():
+                node, node_messages, execution = in_flight.pop(prompt_id)
+                try:
+                    execution.send(response)
+                except StopIteration:
+                    pass
+                exchanges[node.id] = node_messages[-2:]
+                run.complete(node.id, node_messages[-1]['content'])
+
+    def __extract_pdf_text(self, pdf_filepath: str) -> str:
+        """
+        Gets the text of the given PDF file, from the prefetching workers if enabled,
+        or by reading through the extraction cache otherwise
+
+        :param pdf_filepath: file location of the publication
+        :return: text extracted from the publication
+        """
+        if self.pdf_prefetcher:
+            return self.pdf_prefetcher.get(pdf_filepath)
+        elif self.extraction_cache:
+            return self.extraction_cache.get_or_extract(pdf_filepath)
+        else:
+            return self.pdf_extractor(pdf_filepath)
+
+    @staticmethod
+    def __is_unmentioned(variant_index: VariantIndex, pdf_filepath: str, variant: str, variant_aliases: List[str]) -> bool:
+        """
+        Checks in the variant index whether the PDF file mentions none of the variant and its aliases.
+        PDF files missing from the index are never considered unmentioned.
+        """
+        if not variant_index.is_indexed(pdf_filepath):
+            logging.warning(f'PDF file not found in the variant index: {pdf_filepath}')
+            return False
+        return not variant_index.count_mentions(variant_aliases + [variant], pdf_filepath)
+
+    def __normalize_text(self, publication_id: str, pdf_filepath: str, pdf_in_text: str) -> str:
+        """
+        Removes the noise of the text of the publication (broken words, whitespace, running headers and footers,
+        figure text and boilerplate sections), and records the characters and tokens saved next to the result file
+
+        :param publication_id: id of publication specified in the publication param configs
+        :param pdf_filepath: file location of the publication
+        :param pdf_in_text: text of the publication
+        :return: normalized text of the publication
+        """
+        normalization = normalize_text(pdf_in_text, self.normalization_steps, self.header_min_repeats)
+        original_tokens = count_tokens(pdf_in_text, self.deployment.model)
+        normalized_tokens = count_tokens(normalization.text, self.deployment.model)
+        removed = ', '.join(f'{chars} by {step}' for step, chars in normalization.removed.items() if chars)
+        logging.info(f'Text normalized from {normalization.original_chars} to {normalization.normalized_chars} characters '
+                     f'({removed or "none removed"}), from ~{original_tokens} to ~{normalized_tokens} tokens sent with each prompt')
+
+        record = {
+            'id': publication_id,
+            'file_name': pdf_filepath.split(os.sep)[-1],
+            'original_chars': normalization.original_chars,
+            'normalized_chars': normalization.normalized_chars,
+            'original_tokens': original_tokens,
+            'normalized_tokens': normalized_tokens,
+            'removed_chars': normalization.removed
+        }
+        normalization_file_path = os.path.splitext(self.result_file_path)[0] + '-text_normalization.jsonl'
+        with self.result_lock, open(normalization_file_path, mode='a') as normalization_file:
+            normalization_file.write(json.dumps(record) + '\n')
+
+        return normalization.text
+
+    def __reduce_context(
+            self,
+            publication_id: str,
+            pdf_filepath: str,
+            pdf_in_text: str,
+            variant_perms: List[str],
+            variant_offsets: List[int]) -> str:
+        """
+        Reduces the publication to the paragraphs mentioning the variant or assays, within the token budget,
+        and records what was dropped next to the result file
+
+        :param publication_id: id of publication specified in the publication param configs
+        :param pdf_filepath: file location of the publication
+        :param pdf_in_text: text of the publication
+        :param variant_perms: variant and its nomenclature aliases
+        :param variant_offsets: offsets of the variant aliases in the text
+        :return: reduced text of the publication
+        """
+        reduction = reduce_context(
+            pdf_in_text, variant_perms, self.context_keywords, self.context_window, self.context_token_budget, variant_offsets)
+        logging.info(f'Context reduced from ~{reduction.original_tokens} to ~{reduction.reduced_tokens} tokens: '
+                     f'kept {len(reduction.kept)} of {reduction.paragraphs} paragraphs')
+
+        record = {
+            'id': publication_id,
+            'file_name': pdf_filepath.split(os.sep)[-1],
+            'original_tokens': reduction.original_tokens,
+            'reduced_tokens': reduction.reduced_tokens,
+            'paragraphs': reduction.paragraphs,
+            'kept': reduction.kept,
+            'dropped': [
+                {'start': start, 'end': end, 'preview': re.sub(r'\s+', ' ', pdf_in_text[start:end][:80])}
+                for start, end in reduction.dropped
+            ]
+        }
+        context_file_path = os.path.splitext(self.result_file_path)[0] + '-context_reduction.jsonl'
+        with self.result_lock, open(context_file_path, mode='a') as context_file:
+            context_file.write(json.dumps(record) + '\n')
+
+        return reduction.text
+
+    def __list_pdf_filepaths(self) -> List[str]:
+        """
+        :return: file locations of the publications to process, in processing order
+        """
+        pdf_filepaths = []
+        for publication in self.publications_parameters.values():
+            file_path = publication.pdf_filepath
+            if Path(file_path).suffix == '.pdf':
+                pdf_filepaths.append(file_path)
+        return pdf_filepaths
+
     def __execute_prompt_for_functional_evidence(
             self,
             variant: str,
             longest_variant: Optional[str],
             questions: List[Dict],
             messages: List[Dict],
-            input_params: Dict) -> Optional[str]:
+            input_params: Dict) -> Conversation:
         """
         Handles special logic to look for functional evidence by using 3 different variation of the target variant.
 
@@ -206,9 +931,6 @@ class PromptExecutor:
 
         If no variant with evidence exists, it returns None
         """
-        regex_no_answer = r'do\s+not\s+know\s+\w*\s*answer'
-        regex_not_in_pub = r'not\s+[\S*\s+]*in\s+[\S*\s+]*[pP]ublication'
-
         # Find variant using question #1 (with content included) and #2 (without content)
         question_with_content = questions[0]
         regex_with_content = question_with_content[KEY_STOP_CONDITION][KEY_RESP_REGEX]
@@ -250,31 +972,78 @@ class PromptExecutor:
         variant_with_evidence = None
         for i, prompt in enumerate(prompts_to_execute):
             logging.info('Searching for Functional Evidence Attept #' + str(i+1) + ': ' + prompt['description'] + '\n')
-            result = self.__execute_single_prompt(prompt['question'], prompt['variant'], messages, input_params)
+            speculations = self.__speculate_evidence_attempts(prompts_to_execute[i:], messages, input_params) if self.speculative else ()
+            result = yield from self.__execute_single_prompt(
+                prompt['question'], prompt['variant'], messages, input_params, get_no_evidence_regexes(prompt['regex_condition']), speculations)
 
-            no_evidence = re.search(prompt['regex_condition'], result['answer'])
-            no_evidence = re.search(regex_no_answer, result['answer']) if no_evidence is None else no_evidence
-            no_evidence = re.search(regex_not_in_pub, result['answer']) if no_evidence is None else no_evidence
             # Check if functional evidence has been found
-            if not no_evidence:
+            if not has_no_evidence(result['answer'], prompt['regex_condition']):
                 variant_with_evidence = prompt['variant']
                 break
+            self.predicted_answers[prompt['question'][KEY_QUESTION_ID]] = messages[-1]['content']
 
         return variant_with_evidence
     
+    def __speculate_evidence_attempts(
+            self,
+            attempts: List[Dict],
+            messages: List[Dict],
+            input_params: Dict) -> Tuple[PromptRequest, ...]:
+        """
+        Builds the prompts of the evidence attempts following the one about to be sent, as they will be sent
+        if every attempt before them finds no evidence, answering as predicted (the last "no evidence" answer
+        to the question, or the answer the question asks for)
+
+        :param attempts: attempt about to be sent, followed by the remaining attempts
+        :param messages: GPT chat history
+        :param input_params: set of input parameters
+        :return: speculative prompts
+        """
+        speculations = []
+        history = list(messages)
+        prompt_id = input_params['index'] + 1
+        for attempt, next_attempt in zip(attempts, attempts[1:]):
+            question_id = attempt['question'][KEY_QUESTION_ID]
+            history += [
+                {"role": "user", "content": self.__build_prompt(attempt['question'], attempt['variant'], input_params)},
+                {"role": "assistant", "content": self.predicted_answers.get(question_id, NO_EVIDENCE_ANSWER)}
+            ]
+            prompt_id += 1
+            speculative_messages = history + [
+                {"role": "user", "content": self.__build_prompt(next_attempt['question'], next_attempt['variant'], input_params)}]
+            try:
+                speculative_messages = fit_messages(
+                    speculative_messages, self.deployment.context_limit - self.max_tokens,
+                    self.context_policy, self.deployment.model, input_params['paper'])
+            except ContextLimitExceeded:
+                break
+            speculations.append(PromptRequest(prompt_id, speculative_messages, get_no_evidence_regexes(next_attempt['regex_condition'])))
+        return tuple(speculations)
+
+    def __build_prompt(self, question: Dict, variant: str, input_params: Dict) -> str:
+        """
+        Substitutes the parameters of a question
+        """
+        return Template(question[KEY_QUESTION]).substitute(
+            param_variant=variant, param_gene=input_params['param_gene'], content=input_params['content'])
+
     def __execute_single_prompt(
             self,
             question: Dict,
             variant: str,
             messages: List[Dict],
-            input_params: Dict) -> Dict:
+            input_params: Dict,
+            stop_regexes: Optional[List[str]] = None,
+            speculations: Tuple[PromptRequest, ...] = ()) -> Generator[PromptRequest, Dict, Dict]:
         """
-        Helper method to execute a single prompt
+        Helper method to execute a single prompt: yields the prompt to send, and is sent the response
 
         :param question: prompt to execute
         :param variant: variant
         :param messages: GPT chat history
         :param input_params: set of input parameters
+        :param stop_regexes: regexes deciding the outcome of the prompt as soon as the answer matches one
+        :param speculations: prompts likely to follow, which can be sent ahead of time
 
         :return result: result of executing the prompt
         """
@@ -282,65 +1051,93 @@ class PromptExecutor:
 
         index = input_params['index']
         gene = input_params['param_gene']
-        pdf_in_text = input_params['content']
+        pdf_in_text = input_params['paper']
         publication_id = input_params['publication_id']
         pdf_filepath = input_params['pdf_filepath']
         system_message = input_params['system_message']
         expected_outcome = input_params['expected_outcome']
 
-        prompt_template = question[KEY_QUESTION]
-        id = question[KEY_QUESTION_ID]
-        logging.info(f'##### Start prompt #{id}')
+        # Time the prompt from its substitution to the write of its result, including the wait for its response
+        with self.metrics.span('prompt', publication_id):
+            prompt_template = question[KEY_QUESTION]
+            id = question[KEY_QUESTION_ID]
+            logging.info(f'##### Start prompt #{id}')
 
-        # Set up the next prompt
-        prompt = Template(prompt_template).substitute(param_variant=variant, param_gene=gene, content=pdf_in_text)
-        messages.append({
-            "role": "user",
-            "content": prompt
-        })
-        size_limit = min(len(messages[-1]['content']), 300)
-        logging.info('> Human: ' + re.sub('\s+', ' ', messages[-1]['content'][:size_limit]) + ' ...')
-
-        # Call OpenAI
-        response = self.__call_openapi_chat_completion(messages)
-
-        # Append response to the messages to retain previous context
-        usage = response['usage']
-        message = response['choices'][0]['message']
-        messages.append(message)
-        logging.info('> AI: ' + message['content'])
-        logging.info('Completion Tokens: ' + str(usage['completion_tokens']) + ', Prompt Tokens: ' + str(usage['prompt_tokens']))
-        logging.info(f'##### End prompt #{id}\n')
-
-        # Capture a summary of result for each prompt
-        result = {
-            'id': publication_id,
-            'file_name': pdf_filepath.split(os.sep)[-1],
-            'system_message': system_message,
-            'prompt_id': index,
-            'prompt': re.sub('\s+', ' ', prompt_template),
-            'answer': re.sub('\s+', ' ', message['content']),
-            'variant': variant,
-            'gene': gene,
-            'expected_outcomes': expected_outcome,
-            'prompt_tokens': usage['prompt_tokens'],
-            'completion_tokens': usage['completion_tokens'],
-            'estimated_cost': (0.06 * (usage['prompt_tokens']/1000) + 0.12 * (usage['completion_tokens']/1000)),
-            'timestamp': datetime.now().isoformat()
-        }
-        # Write the result to CSV file
-        self.__write_result_to_csv(result)
+            # Set up the next prompt
+            with self.metrics.span('template'):
+                prompt = self.__build_prompt(question, variant, input_params)
+            messages.append({
+                "role": "user",
+                "content": prompt
+            })
+            size_limit = min(len(messages[-1]['content']), 300)
+            logging.info('> Human: ' + re.sub('\s+', ' ', messages[-1]['content'][:size_limit]) + ' ...')
+
+            # Fit the request in the context window of the deployment, as per the context policy
+            with self.metrics.span('fit_messages'):
+                request_messages = fit_messages(
+                    messages, self.deployment.context_limit - self.max_tokens, self.context_policy, self.deployment.model, pdf_in_text)
+            if request_messages is not messages:
+                logging.warning(f'Request fitted in the context window of {self.deployment.name} ({self.context_policy}): '
+                                f'{len(messages) - len(request_messages)} messages dropped, '
+                                f'~{count_message_tokens(request_messages, self.deployment.model)} prompt tokens')
+
+            # Call OpenAI
+            response = yield PromptRequest(index, request_messages, stop_regexes or [], speculations)
 
-        return result
+            # Append response to the messages to retain previous context
+            # (with --stream, the answer as cut short by a stop regex)
+            usage = response['usage']
+            self.metrics.add_completion(usage['prompt_tokens'], usage['completion_tokens'])
+            message = response['choices'][0]['message']
+            messages.append(message)
+            logging.info('> AI: ' + message['content'])
+            logging.info('Completion Tokens: ' + str(usage['completion_tokens']) + ', Prompt Tokens: ' + str(usage['prompt_tokens']))
+            logging.info(f'##### End prompt #{id}\n')
+
+            # Capture a summary of result for each prompt
+            result = {
+                'id': publication_id,
+                'file_name': pdf_filepath.split(os.sep)[-1],
+                'system_message': system_message,
+                'prompt_id': index,
+                'prompt': re.sub('\s+', ' ', prompt_template),
+                'answer': re.sub('\s+', ' ', message['content']),
+                'variant': variant,
+                'gene': gene,
+                'expected_outcomes': expected_outcome,
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage['completion_tokens'],
+                'estimated_cost': self.deployment.cost(usage['prompt_tokens'], usage['completion_tokens']),
+                'timestamp': datetime.now().isoformat(),
+                'time_to_first_token': response.get('timing', {}).get('time_to_first_token'),
+                'time_to_decision': response.get('timing', {}).get('time_to_decision')
+            }
+            # Write the result to the result file
+            with self.metrics.span('write_result'):
+                self.result_sink.write(result)
+
+            return result
     
-    def __call_openapi_chat_completion(self, messages: List[Dict]) -> Dict:
+    def __call_openapi_chat_completion(self, messages: List[Dict], stop_regexes: Optional[List[str]] = None) -> Dict:
         """
         Call GPT service to get a response back
 
         :param messages: GPT chat messages (history + new prompt)
+        :param stop_regexes: when streaming, regexes on which generation is cancelled as soon as the answer matches one
         :return: response from GPT
         """
-        if self.use_mock:
+        with self.metrics.span('chat_completion'):
+            return self.__complete_request(self.__build_chat_completion_request(messages), stop_regexes)
+
+    def __complete_request(self, request: Dict, stop_regexes: Optional[List[str]] = None) -> Dict:
+        """
+        Gets the response to a chat completion request, from the mock service, the response cache or GPT service
+        (or projects it, in a dry run)
+        """
+        if self.dry_run:
+            return self.__project_response(request)
+        elif self.use_mock:
             # Enabled to use mock instead of calling GPT service
             # Useful when verifying the logic used before and after calling the service
             logging.debug('Calling mock service')       
@@ -366,44 +1163,198 @@ class PromptExecutor:
                 }
             }
         else:
-            logging.debug(f'Calling OpenAI: GPT Deployment - {self.gpt_deployment}')    
-            return openai.ChatCompletion.create(
-                        engine = self.gpt_deployment,
-                        messages = messages,
-                        temperature=self.temperature,
-                        max_tokens=self.max_tokens,
-                        top_p=0.95,
-                        frequency_penalty=0,
-                        presence_penalty=0)
+            if self.stream:
+                send = lambda: self.__stream_chat_completion(request, stop_regexes or [])
+            else:
+                send = lambda: self.__send_chat_completion(request)
+            call = lambda: call_with_retries(send, self.max_retries, self.rate_limiter)
+            if self.response_cache:
+                # Reuse the response to an identical request answered in a previous run. Answers cut short by a stop
+                # regex are not cached, as they are not the full response to the request the cache key stands for
+                return self.response_cache.get_or_call(request, call, self.__is_full_response)
+            logging.debug(f'Calling OpenAI: GPT Deployment - {self.gpt_deployment}')
+            return call()
+
+    @staticmethod
+    def __is_full_response(response: Dict) -> bool:
+        """
+        :return: False if the answer was cut short by a stop regex
+        """
+        return response['choices'][0].get('finish_reason') != FINISH_REASON_STOP_REGEX
+
+    def __build_chat_completion_request(self, messages: List[Dict]) -> Dict:
+        """
+        Builds the parameters of a chat completion request, which also identify the request in the response cache
+        """
+        return {
+            'engine': self.gpt_deployment,
+            'messages': [{'role': message['role'], 'content': message['content']} for message in messages],
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+            'top_p': 0.95,
+            'frequency_penalty': 0,
+            'presence_penalty': 0
+        }
+
+    def __send_chat_completion(self, request: Dict) -> Dict:
+        """
+        Sends a single chat completion request, once the rate limiter lets it through
+        """
+        self.__wait_for_rate_limiter(request)
+        with self.metrics.span('openai_request') as span:
+            if self.deployment_pool:
+                response = self.deployment_pool.complete(request, self.__estimate_request_tokens(request['messages']))
+            else:
+                response = openai.ChatCompletion.create(**request, **self.__timeout_params())
+        self.metrics.observe_throughput(response['usage']['completion_tokens'], time.perf_counter() - span.started)
+        return response
+
+    def __timeout_params(self) -> Dict:
+        """
+        :return: parameters of openai.ChatCompletion.create enforcing the call deadline (if any)
+        """
+        return {'request_timeout': self.call_deadline_seconds} if self.call_deadline_seconds else {}
+
+    def __wait_for_rate_limiter(self, request: Dict) -> None:
+        """
+        Waits until the rate limiter lets the request through (if rate limits are set)
+        """
+        if self.rate_limiter:
+            with self.metrics.span('rate_limit_wait'):
+                waited = self.rate_limiter.acquire(self.__estimate_request_tokens(request['messages']))
+            if waited > 0:
+                logging.debug(f'Waited {waited:.1f} seconds for the rate limiter')
+
+    def __stream_chat_completion(self, request: Dict, stop_regexes: List[str]) -> Dict:
+        """
+        Sends a single chat completion request, and consumes the answer as it is generated.
+        As soon as the answer matches one of the stop regexes, its outcome is decided: generation is cancelled,
+        and the partial answer is returned. Usage is counted locally, as streamed responses do not report it.
+
+        :param request: chat completion request
+        :param stop_regexes: regexes deciding the outcome of the prompt
+        :return: response, in the same format as a response which is not streamed, with the time to first token
+                 and the time to decision (in seconds)
+        """
+        self.__wait_for_rate_limiter(request)
+        # Streamed answers are not hedged: the call is routed to a single endpoint of the pool
+        pool = self.deployment_pool
+        endpoint = pool.select() if pool else None
+        if pool and endpoint:
+            pool.acquire(endpoint, self.__estimate_request_tokens(request['messages']))
+
+        # The request lasts until the answer is consumed
+        with self.metrics.span('openai_request'):
+            started = time.monotonic()
+            try:
+                chunks = openai.ChatCompletion.create(
+                    **dict(request, **(endpoint.credentials() if endpoint else {})), **self.__timeout_params(), stream=True)
+            except Exception:
+                if pool and endpoint:
+                    pool.record(endpoint, None)
+                raise
+            content = ''
+            finish_reason = None
+            time_to_first_token = None
+            time_to_decision = None
+            try:
+                for chunk in chunks:
+                    if not chunk['choices']:
+                        continue # e.g. content filter results sent ahead of the answer
+                    choice = chunk['choices'][0]
+                    delta = choice.get('delta', {}).get('content')
+                    if delta:
+                        if time_to_first_token is None:
+                            time_to_first_token = time.monotonic() - started
+                        content += delta
+                        found = next((match for match in (re.search(regex, content) for regex in stop_regexes) if match), None)
+                        if found:
+                            time_to_decision = time.monotonic() - started
+                            finish_reason = FINISH_REASON_STOP_REGEX
+                            logging.debug(f'Cancelling generation, as the answer matches a stop regex: match={found}')
+                            break
+                    if choice.get('finish_reason'):
+                        finish_reason = choice['finish_reason']
+            finally:
+                # Closing the stream drops the connection, which cancels generation
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+        if time_to_decision is None:
+            time_to_decision = time.monotonic() - started
+        if pool and endpoint:
+            pool.record(endpoint, time_to_first_token or time_to_decision)
+        logging.info(f'Time to first token: {time_to_first_token or 0:.2f}s, time to decision: {time_to_decision:.2f}s ({finish_reason})')
+
+        prompt_tokens = count_message_tokens(request['messages'], self.deployment.model)
+        completion_tokens = count_tokens(content, self.deployment.model)
+        self.metrics.observe_throughput(completion_tokens, time_to_decision)
+        return {
+            "choices": [{"finish_reason": finish_reason, "index": 0, "message": {"content": content, "role": "assistant"}}],
+            "usage": {
+                "completion_tokens": completion_tokens,
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            },
+            "timing": {
+                "time_to_first_token": time_to_first_token,
+                "time_to_decision": time_to_decision
+            }
+        }
+
+    def __estimate_request_tokens(self, messages: List[Dict]) -> int:
+        """
+        Estimates the # of tokens a request counts against the tokens-per-minute quota:
+        its prompt tokens plus the max # of tokens in response
+        """
+        return count_message_tokens(messages, self.deployment.model) + self.max_tokens
+
+    def __project_response(self, request: Dict) -> Dict:
+        """
+        Stands in for the GPT service in a dry run: counts the prompt tokens locally, and answers with an empty message
+        (which satisfies no stop condition, so that every question is projected) of the projected # of completion tokens
+        """
+        prompt_tokens = count_message_tokens(request['messages'], self.deployment.model)
+        completion_tokens = min(self.dry_run_completion_tokens, self.max_tokens)
+        with self.result_lock:
+            self.projection.add(prompt_tokens, completion_tokens)
+        return {
+            "choices": [{"finish_reason": "stop", "index": 0, "message": {"content": "", "role": "assistant"}}],
+            "usage": {
+                "completion_tokens": completion_tokens,
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def __log_projection(self) -> None:
+        """
+        Logs the projected tokens, cost and wall time of the run
+        """
+        projection = self.projection
+        wall_time = projection.wall_time(self.concurrency, self.requests_per_minute, self.tokens_per_minute)
+        logging.info(f'Dry run projection for {self.deployment.name} ({self.deployment.model}): '
+                     f'{len(self.publications_parameters) - len(self.completed_publications)} publications, '
+                     f'{projection.requests} requests, {projection.prompt_tokens} prompt tokens, '
+                     f'{projection.completion_tokens} completion tokens, ${projection.cost:.2f}, '
+                     f'wall time ~{wall_time / 60:.1f} minutes')
         
-    def __read_publication_configs(self, fname: str) -> Dict[str, Any]:
+    def __read_publication_configs(
+            self,
+            fname: str,
+            cache_dir: Optional[str],
+            ids: Optional[List[str]],
+            patterns: Optional[List[str]]) -> Dict[str, Publication]:
         """
-        From the publication config file, get a list of functional paper to process
+        From the publication config file (xlsx, CSV or Parquet), get a list of functional paper to process
         along with their execusion parameters (e.g. variant, gene, aliases, etc.)
         """
         logging.debug('Reading publication param file: ' + fname)
-        self.__validate_file_extension(fname, '.xlsx')
-
-        data = read_excel(fname)
-
-        pub_configs = {}
-        for index, row in data.iterrows():
-            publication = {
-                'id': '',
-                'file_path': '',
-                'file_name': '',
-                'variant': '',
-                'gene': '',
-                'variant_aliases': '',
-                'expected_outcomes': ''
-            }
-            for key in data.keys():
-                publication[key] = row[key]
+        if pathlib.Path(fname).suffix.lower() not in MANIFEST_EXTENSIONS:
+            raise TypeError(f'Invalid file type: {fname} (expected one of {MANIFEST_EXTENSIONS})')
 
-            pub_id = publication['id']
-            del publication['id']
-            pub_configs[pub_id] = publication
-        
+        pub_configs = select_publications(load_manifest(fname, cache_dir), ids, patterns)
+        if ids or patterns:
+            logging.info(f'Selected {len(pub_configs)} publications of {fname}')
         return pub_configs
     
     def __read_question_configs(self, file_path: str) -> Dict:
@@ -430,34 +1381,58 @@ class PromptExecutor:
         if file_ext != expected_ext: 
             raise TypeError(f"Only supports extension '{expected_ext}', but provided a file with '{file_ext}'")
     
-    def __setup_result_file(self) -> str:
+    def __setup_result_sink(self, result_format: str, flush_every_rows: int, flush_interval_seconds: float) -> ResultSink:
         """
-        Creates a CSV file to store prompt execution results
+        Creates a result file (CSV, JSONL or Parquet) to store prompt execution results
+        (or their projection, in a dry run)
 
-        :return: path to the CSV file created
+        :param result_format: format of the result file
+        :param flush_every_rows: # of rows buffered before being written to disk
+        :param flush_interval_seconds: maximum # of seconds rows are buffered before being written to disk
+        :return: result sink writing to the file created
         """
         time_suffix = datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
-        file_name = f'prompt_execution_result-{time_suffix}.csv'
-        file_path = os.path.join('result', file_name)
-        logging.debug('Setup result file: ' + file_path)
-
-        file_exists = os.path.isfile(file_path)
-        with open(file_path, mode='a') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=CSV_COLUMNS)
-            if not file_exists:
-                writer.writeheader()
+        file_name = f'prompt_execution_{"projection" if self.dry_run else "result"}-{time_suffix}'
+        return create_result_sink(
+            result_format, os.path.join('result', file_name), CSV_COLUMNS,
+            flush_every_rows=flush_every_rows, flush_interval_seconds=flush_interval_seconds)
 
-        return file_path
-    
-    def __write_result_to_csv(self, result: Dict) -> None:
+    def __resume_result_sink(self, resume_path: str, flush_every_rows: int, flush_interval_seconds: float) -> ResultSink:
         """
-        Saves the given result to the CSV file set up during initialization
+        Reopens the result file of a previous run, so that only the publications it did not complete are processed.
+        Rows of publications whose questions were interrupted are removed, as these publications are processed again.
+
+        :param resume_path: result file, or folder whose latest result file is resumed
+        :param flush_every_rows: # of rows buffered before being written to disk
+        :param flush_interval_seconds: maximum # of seconds rows are buffered before being written to disk
+        :return: result sink appending to the resumed file
         """
-        with open(self.result_file_path, mode='a') as csv_file:
-            result_writer = csv.DictWriter(csv_file, fieldnames=CSV_COLUMNS)
-            result_writer.writerow(result)
-            csv_file.close()
+        result_file_path = resume_path
+        if os.path.isdir(resume_path):
+            candidates = [path for path in pathlib.Path(resume_path).glob('prompt_execution_result-*')
+                          if path.suffix in ['.csv', '.jsonl']]
+            if not candidates:
+                raise FileNotFoundError(f'No result file to resume in {resume_path}')
+            result_file_path = str(max(candidates, key=lambda path: path.stat().st_mtime))
+        logging.info(f'Resuming result file: {result_file_path}')
 
+        results = read_results(result_file_path, CSV_COLUMNS)
+        if self.question_graph:
+            self.completed_publications = self.question_graph.find_completed_publications(results)
+        else:
+            self.completed_publications = find_completed_publications(results, self.questions_parameters, self.publications_parameters)
+        if self.dry_run:
+            # Only project the remaining publications, leaving the resumed file untouched
+            logging.info(f'{len(self.completed_publications)} publications already completed')
+            return self.__setup_result_sink(os.path.splitext(result_file_path)[1].lstrip('.'), flush_every_rows, flush_interval_seconds)
+        interrupted = set(results['id'].astype(str)) - self.completed_publications
+        if interrupted:
+            removed = drop_publications(result_file_path, interrupted)
+            logging.info(f'Removed {removed} rows of {len(interrupted)} interrupted publications: {sorted(interrupted)}')
+        logging.info(f'{len(self.completed_publications)} publications already completed')
+
+        return open_result_sink(
+            result_file_path, CSV_COLUMNS, flush_every_rows=flush_every_rows, flush_interval_seconds=flush_interval_seconds)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -471,17 +1446,132 @@ def main():
     parser.add_argument(
         '--debug', help='Sets logger level to DEBUG', action='store_true')
     parser.add_argument(
-        '--fileConfig', help='List of files to process', required=True)
+        '--fileConfig', help='List of files to process (xlsx, CSV or Parquet)', required=True)
+    parser.add_argument(
+        '--publicationIds', help='Ids of the publications to process', required=False, nargs='+')
+    parser.add_argument(
+        '--publicationPattern', help="Glob pattern(s) of the ids of the publications to process (e.g. 'pub-1*')", required=False, nargs='+')
+    parser.add_argument(
+        '--manifestCacheDir', help='Folder caching parsed publication param files', required=False, default=DEFAULT_MANIFEST_CACHE_DIR)
+    parser.add_argument(
+        '--noManifestCache', help='Parses the publication param file without caching it', action='store_true')
     parser.add_argument(
         '--questionConfig', help='System message and list of questions', required=True)
     parser.add_argument(
         '--temperature', help='GPT model - temperature setting', required=False, type=int, default=0)
     parser.add_argument(
         '--maxTokens', help='GPT model - max # of tokens in response', required=False, type=int, default=1000)
+    parser.add_argument(
+        '--extractionCacheDir', help='Folder storing texts extracted from PDF files across runs', required=False, default=DEFAULT_CACHE_DIR)
+    parser.add_argument(
+        '--extractionCacheMaxMb', help='Maximum size of the extraction cache in MB', required=False, type=float, default=DEFAULT_MAX_SIZE_MB)
+    parser.add_argument(
+        '--noExtractionCache', help='Disables the extraction cache, and extracts every PDF file again', action='store_true')
+    parser.add_argument(
+        '--extractionWorkers', help='If specified, extract upcoming PDF files in x worker processes while prompting', required=False, type=int, default=0)
+    parser.add_argument(
+        '--extractionLookahead', help='Maximum # of PDF files extracted ahead of the publication being prompted', required=False, type=int, default=DEFAULT_LOOKAHEAD)
+    parser.add_argument(
+        '--extractionBackend', help='PDF extraction backend(s), each one falling back to the next on failure', required=False,
+        nargs='+', choices=file_utils.BACKENDS, default=file_utils.DEFAULT_BACKENDS)
+    parser.add_argument(
+        '--extractionPageWorkers', help='If specified, split large PDF files into page ranges extracted by x workers', required=False, type=int, default=0)
+    parser.add_argument(
+        '--concurrency', help='If specified, process x publications concurrently (calls paced by the rate limits below)', required=False, type=int, default=1)
+    parser.add_argument(
+        '--requestsPerMinute', help='Maximum # of requests sent per minute across all publications', required=False, type=int)
+    parser.add_argument(
+        '--tokensPerMinute', help='Maximum # of tokens (estimated prompt tokens + maxTokens) sent per minute across all publications', required=False, type=int)
+    parser.add_argument(
+        '--maxRetries', help='Maximum # of retries of a call throttled (429) or failed with a server error (5xx)', required=False, type=int, default=5)
+    parser.add_argument(
+        '--reduceContext', help='Reduces the publication to the paragraphs mentioning the variant aliases or assay keywords', action='store_true')
+    parser.add_argument(
+        '--contextWindow', help='# of paragraphs kept before and after a paragraph mentioning the variant', required=False, type=int, default=DEFAULT_WINDOW)
+    parser.add_argument(
+        '--contextTokenBudget', help='Maximum # of tokens of the reduced publication', required=False, type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument(
+        '--contextKeywords', help='Comma-separated assay keywords (defaults to a built-in list)', required=False, type=str)
+    parser.add_argument(
+        '--normalizeText', help='Removes the noise of the text extracted from each PDF file (broken words, whitespace, running headers '
+                                'and footers, figure text, acknowledgements and supplementary sections)', action='store_true')
+    parser.add_argument(
+        '--normalizationSteps', help='With --normalizeText, normalization steps to apply', required=False,
+        nargs='+', choices=NORMALIZATION_STEPS, default=DEFAULT_NORMALIZATION_STEPS)
+    parser.add_argument(
+        '--headerMinRepeats', help='Minimum # of occurrences of a line to be removed as a running header or footer', required=False,
+        type=int, default=DEFAULT_MIN_REPEATS)
+    parser.add_argument(
+        '--skipUnmentioned', help='Skips publications whose PDF file does not mention the variant, as per the variant index', action='store_true')
+    parser.add_argument(
+        '--variantIndexFile', help='SQLite file storing the variant index (built with index_variants.py)', required=False, default=DEFAULT_VARIANT_INDEX_FILE)
+    parser.add_argument(
+        '--resultFormat', help='Format of the result file: csv, jsonl or parquet (requires pyarrow)', required=False, choices=RESULT_FORMATS, default=FORMAT_CSV)
+    parser.add_argument(
+        '--flushEveryRows', help='# of result rows buffered before being written to disk', required=False, type=int, default=DEFAULT_FLUSH_EVERY_ROWS)
+    parser.add_argument(
+        '--flushIntervalSeconds', help='Maximum # of seconds result rows are buffered before being written to disk', required=False, type=float, default=DEFAULT_FLUSH_INTERVAL_SECONDS)
+    parser.add_argument(
+        '--resume', help='Result file (or folder of result files, the latest is used) of a previous run to resume: '
+                         'completed publications are skipped, and results are appended to that file', required=False)
+    parser.add_argument(
+        '--stream', help='Streams answers, and cancels generation as soon as an answer matches a stop condition', action='store_true')
+    parser.add_argument(
+        '--speculative', help='Sends the remaining attempts to find functional evidence at the same time as the first one, '
+                              'assuming the previous attempts find no evidence', action='store_true')
+    parser.add_argument(
+        '--deploymentConfig', help='Model, context limit, pricing and throughput of each GPT deployment', required=False, default=DEFAULT_DEPLOYMENT_CONFIG)
+    parser.add_argument(
+        '--contextPolicy', help='What to do with a request exceeding the context limit of the deployment: trim (the publication), '
+                                'window (drop the oldest messages, then trim) or skip (the publication)',
+        required=False, choices=CONTEXT_POLICIES, default=POLICY_TRIM)
+    parser.add_argument(
+        '--dryRun', help='Projects the tokens, cost and wall time of the run without calling OpenAI', action='store_true')
+    parser.add_argument(
+        '--dryRunCompletionTokens', help='# of completion tokens projected per response in a dry run', required=False, type=int, default=200)
+    parser.add_argument(
+        '--batch', help='Sends the prompts of all publications in rounds of batch jobs, instead of one by one', action='store_true')
+    parser.add_argument(
+        '--batchBackend', help='Service running the batch jobs (local: completes the batch files in this process)',
+        required=False, choices=BATCH_BACKENDS, default=BACKEND_LOCAL)
+    parser.add_argument(
+        '--responseCache', help='Response cache mode: off, read-through (reuse cached responses, call on a miss), '
+                                'record (always call and cache) or replay (only use cached responses, fail on a miss)',
+        required=False, choices=RESPONSE_CACHE_MODES, default=MODE_OFF)
+    parser.add_argument(
+        '--responseCacheFile', help='SQLite file storing cached responses', required=False, default=DEFAULT_RESPONSE_CACHE_FILE)
+    parser.add_argument(
+        '--responseCacheMaxMb', help='Maximum size of the response cache in MB', required=False, type=float)
+    parser.add_argument(
+        '--responseCacheMaxAgeDays', help='Maximum age of a cached response in days', required=False, type=float)
+    parser.add_argument(
+        '--maxParallelNodes', help='With a question graph, maximum # of nodes of a publication asked at the same time',
+        required=False, type=int, default=DEFAULT_MAX_PARALLEL_NODES)
+    parser.add_argument(
+        '--groupByPdf', help='Processes the publications sharing a PDF file together: the paper is extracted once, and sent once '
+                             'ahead of the questions about each variant, as a prefix shared by their conversations', action='store_true')
+    parser.add_argument(
+        '--deploymentPool', help='JSON file of the deployments (endpoints) to route calls across, by weight, latency and error rate, '
+                                 'instead of the AZURE_GPT_DEPLOYMENT deployment', required=False)
+    parser.add_argument(
+        '--callDeadlineSeconds', help='Maximum # of seconds to wait for the response to a call (retried as a timeout)', required=False, type=float)
+    parser.add_argument(
+        '--hedgePercentile', help='With --deploymentPool, sends a duplicate of a call to a second deployment when the first one has not '
+                                  'answered within this percentile of its recent latencies (e.g. 95), keeping the first answer',
+        required=False, type=float)
+    parser.add_argument(
+        '--prometheusFile', help='Prometheus text file to write the run metrics to (by default, next to the result file)', required=False)
+    parser.add_argument(
+        '--profile', help='Profiles the processing of each publication with cprofile or pyinstrument (requires pyinstrument)',
+        required=False, choices=PROFILERS)
+    parser.add_argument(
+        '--profileDir', help='Folder to write the profile of each publication to', required=False, default=DEFAULT_PROFILE_DIR)
     args = parser.parse_args()
 
+    # Tag log lines with the thread name when publications are processed concurrently
+    log_format = '%(asctime)s %(levelname)-8s %(threadName)s %(message)s' if args.concurrency > 1 else '%(asctime)s %(levelname)-8s %(message)s'
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
-                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        format=log_format,
                         datefmt='%a, %d %b %Y %H:%M:%S',
                         handlers=[
                             TimedRotatingFileHandler(os.path.join('logs', 'execute_prompts.log'), when='midnight'),
@@ -0,0 +1,183 @@
+import os
+import re
+import logging
+import argparse
+from pandas import DataFrame, isna, read_csv, read_excel
+from typing import Dict, List, Optional, Set, Tuple
+from utils.nomenclature import get_nomenclature_variations_many, get_nomenclature_variations_notation, parse_variant
+from utils.variant_validator import (
+    BACKENDS, BACKEND_HTTP, DEFAULT_CACHE_FILE, DEFAULT_FIXTURE_DIR, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_WORKERS,
+    VariantQuery, VariantValidatorClient, VariantValidatorError, create_backend)
+
+ALIASES_COLUMN = 'variant_aliases'
+TRANSCRIPT_COLUMN = 'transcript'
+BUILD_COLUMN = 'build'
+DEFAULT_BUILD = 'GRCh38'
+# Transcript of a curated alias (e.g. NM_000527.5:c.1A>C), used to look up rows without a transcript column
+TRANSCRIPT_ALIAS_REGEX = re.compile(r'\b(N[MR]_\d+(?:\.\d+)?):c\.')
+
+# (gene, variant, transcript, build): rows sharing all of them share their aliases
+VariantKey = Tuple[str, str, str, str]
+
+
+def read_manifest(path: str) -> DataFrame:
+    return read_csv(path) if path.lower().endswith('.csv') else read_excel(path)
+
+
+def write_manifest(data: DataFrame, path: str) -> None:
+    if path.lower().endswith('.csv'):
+        data.to_csv(path, index=False)
+    else:
+        data.to_excel(path, index=False)
+
+
+def __cell(row, column: str, default: str = '') -> str:
+    value = row.get(column)
+    return default if value is None or isna(value) else str(value).strip()
+
+
+def __split_aliases(cell: str) -> List[str]:
+    return [alias.strip() for alias in cell.split(',') if alias.strip()]
+
+
+def __transcript(row) -> str:
+    transcript = __cell(row, TRANSCRIPT_COLUMN)
+    if not transcript:
+        match = TRANSCRIPT_ALIAS_REGEX.search(__cell(row, ALIASES_COLUMN))
+        transcript = match.group(1) if match else ''
+    return transcript
+
+
+def generate_aliases(
+        data: DataFrame,
+        client: Optional[VariantValidatorClient] = None,
+        default_build: str = DEFAULT_BUILD,
+        only_missing: bool = False,
+        replace: bool = False) -> List[str]:
+    """
+    Fills the variant_aliases column of a publication param table in one pass.
+
+    Each distinct (gene, variant, transcript, build) is processed once: aliases are derived from the p./c. notation
+    of the variant and, if a client is given, merged with the aliases of the VariantValidator lookup of its cDNA change
+    (for rows with a transcript, from the transcript column or from a curated alias such as NM_000527.5:c.1A>C).
+    The generated aliases are added to the curated aliases of each row, which keep their order.
+
+    :param data: publication params (modified in place)
+    :param client: VariantValidator client, or None to only derive aliases from the notation
+    :param default_build: genome build of rows without a build column
+    :param only_missing: if True, keeps the aliases of rows that already have some
+    :param replace: if True, replaces the curated aliases with the generated ones instead of adding to them
+    :return: ids of the rows whose variant cannot be parsed (their aliases are left untouched)
+    """
+    if ALIASES_COLUMN not in data.columns:
+        data[ALIASES_COLUMN] = None
+
+    keys_per_row: Dict[int, VariantKey] = {}
+    for index, row in zip(data.index, data.to_dict('records')):
+        if only_missing and __cell(row, ALIASES_COLUMN):
+            continue
+        keys_per_row[index] = (
+            __cell(row, 'gene'), __cell(row, 'variant'), __transcript(row), __cell(row, BUILD_COLUMN, default_build))
+
+    aliases_per_key: Dict[VariantKey, Set[str]] = {}
+    queries: Dict[VariantKey, VariantQuery] = {}
+    for key in dict.fromkeys(keys_per_row.values()):
+        gene, variant, transcript, build = key
+        try:
+            aliases_per_key[key] = get_nomenclature_variations_notation(gene, variant)
+        except ValueError:
+            continue
+        cdna, _ = parse_variant(variant)
+        if client and transcript and cdna:
+            queries[key] = VariantQuery(build, transcript, cdna.cdna)
+        elif client:
+            logging.warning(f'Aliases of {variant} ({gene}) derived from its notation only: '
+                            f'{"no cDNA change" if transcript else "no transcript column or NM_ alias"} to look up')
+    logging.info(f'{len(keys_per_row)} rows, {len(dict.fromkeys(keys_per_row.values()))} distinct variants, '
+                 f'{len(queries)} to look up in VariantValidator')
+
+    if queries:
+        variations = get_nomenclature_variations_many(queries.values(), client)
+        for key, query in queries.items():
+            if isinstance(variations[query], VariantValidatorError):
+                logging.warning(f'Aliases of {key[1]} ({key[0]}) derived from its notation only: {variations[query]}')
+            else:
+                aliases_per_key[key] |= variations[query]
+
+    unparseable = []
+    for index, key in keys_per_row.items():
+        if key in aliases_per_key:
+            curated = [] if replace else __split_aliases(__cell(data.loc[index], ALIASES_COLUMN))
+            generated = sorted(aliases_per_key[key].difference(curated))
+            data.at[index, ALIASES_COLUMN] = ','.join(curated + generated)
+        else:
+            row_id = data.at[index, 'id'] if 'id' in data.columns else index
+            logging.warning(f"Cannot parse the variant of {row_id}, whose aliases are left untouched: '{key[1]}'")
+            unparseable.append(row_id)
+    return unparseable
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate the nomenclature aliases of the variants of a publication param file')
+    parser.add_argument(
+        '--fileConfig', help='Publication param file (xlsx or csv)', required=True)
+    parser.add_argument(
+        '--outputFile', help='File to write (by default, <fileConfig>-aliases next to the publication param file)', required=False)
+    parser.add_argument(
+        '--inPlace', help='Updates the publication param file in place, instead of writing another file', action='store_true')
+    parser.add_argument(
+        '--onlyMissing', help='Keeps the aliases of rows that already have some', action='store_true')
+    parser.add_argument(
+        '--replace', help='Replaces the aliases of each row with the generated ones, instead of adding to them', action='store_true')
+    parser.add_argument(
+        '--lookup', help='Adds the aliases found by VariantValidator for rows with a transcript (column, or NM_ alias)', action='store_true')
+    parser.add_argument(
+        '--build', help='Genome build of rows without a build column', required=False, default=DEFAULT_BUILD)
+    parser.add_argument(
+        '--variantValidatorBackend', help='Source of VariantValidator responses', required=False,
+        choices=BACKENDS, default=BACKEND_HTTP)
+    parser.add_argument(
+        '--variantValidatorCache', help='SQLite file caching VariantValidator responses', required=False, default=DEFAULT_CACHE_FILE)
+    parser.add_argument(
+        '--fixtureDir', help='Folder of recorded VariantValidator responses (fixtures backend)', required=False, default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument(
+        '--workers', help='Maximum # of concurrent VariantValidator lookups', required=False, type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        '--requestsPerMinute', help='Maximum # of VariantValidator requests per minute', required=False, type=int,
+        default=DEFAULT_REQUESTS_PER_MINUTE)
+    args = parser.parse_args()
+    if args.inPlace and args.outputFile:
+        parser.error('--inPlace and --outputFile are mutually exclusive')
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        handlers=[logging.StreamHandler()])
+
+    client = None
+    if args.lookup:
+        backend = create_backend(args.variantValidatorBackend, args.fixtureDir, pool_size=args.workers)
+        client = VariantValidatorClient(backend, args.variantValidatorCache, args.workers, args.requestsPerMinute)
+
+    data = read_manifest(args.fileConfig)
+    try:
+        unparseable = generate_aliases(data, client, args.build, args.onlyMissing, args.replace)
+    finally:
+        if client:
+            client.close()
+
+    output_file = args.outputFile
+    if args.inPlace:
+        output_file = args.fileConfig
+    elif not output_file:
+        base, ext = os.path.splitext(args.fileConfig)
+        output_file = f'{base}-aliases{ext}'
+    write_manifest(data, output_file)
+    logging.info(f'Wrote the variant aliases to {os.path.abspath(output_file)}')
+    if unparseable:
+        logging.warning(f'{len(unparseable)} rows with a variant that cannot be parsed: {unparseable}')
+
+
+if __name__ == "__main__":
+    main()
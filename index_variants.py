@@ -0,0 +1,97 @@
+import sys
+import logging
+import argparse
+from typing import Dict, List
+from utils import file_utils
+from utils.manifest import load_manifest
+from utils.extraction_cache import ExtractionCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+from utils.variant_index import VariantIndex, DEFAULT_INDEX_FILE
+
+
+def query_terms(index: VariantIndex, terms: List[str]) -> None:
+    """
+    Prints the PDF files mentioning each of the given variant aliases or gene symbols, with the mention offsets
+    """
+    for term in terms:
+        postings = index.query(term)
+        print(f"'{term}': {len(postings)} mentions")
+        offsets_per_path: Dict[str, List[int]] = {}
+        for posting in postings:
+            offsets_per_path.setdefault(posting.path, []).append(posting.offset)
+        for path, offsets in offsets_per_path.items():
+            print(f'  {path}: offsets {offsets}')
+
+
+def query_manifest(index: VariantIndex, file_config: str) -> None:
+    """
+    Prints, for each publication of a publication param file, the # of mentions of its variant and aliases
+    in its PDF file, flagging publications without any mention
+    """
+    publications = load_manifest(file_config)
+    unmentioned = []
+    for publication in publications:
+        pdf_filepath = publication.pdf_filepath
+        if not index.is_indexed(pdf_filepath):
+            print(f"{publication.id}: not indexed ({pdf_filepath})")
+            continue
+        aliases = publication.aliases + [publication.variant]
+        count = sum(index.count_mentions(aliases, pdf_filepath).values())
+        print(f"{publication.id}: {count} mentions of {publication.variant} ({publication.gene})")
+        if count == 0:
+            unmentioned.append(publication.id)
+    print(f'{len(unmentioned)} of {len(publications)} publications without any mention: {unmentioned}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build, update or query the index of variant and gene mentions across PDF files')
+    parser.add_argument(
+        'command', help='Action to perform on the index', choices=['update', 'query'])
+    parser.add_argument(
+        '--indexFile', help='SQLite file storing the index', required=False, default=DEFAULT_INDEX_FILE)
+    parser.add_argument(
+        '--pdfDir', help='update: folder(s) containing PDF files to index', required=False, nargs='*', default=[])
+    parser.add_argument(
+        '--fileConfig', help='update: publication param file(s) listing the PDF files to index; '
+                             'query: publication param file whose variants are looked up', required=False, nargs='*', default=[])
+    parser.add_argument(
+        '--prune', help='update: removes indexed PDF files that are no longer listed', action='store_true')
+    parser.add_argument(
+        '--term', help='query: variant alias(es) or gene symbol(s) to look up', required=False, nargs='*', default=[])
+    parser.add_argument(
+        '--extractionCacheDir', help='Folder storing texts extracted from PDF files across runs', required=False, default=DEFAULT_CACHE_DIR)
+    parser.add_argument(
+        '--extractionCacheMaxMb', help='Maximum size of the extraction cache in MB', required=False, type=float, default=DEFAULT_MAX_SIZE_MB)
+    parser.add_argument(
+        '--extractionBackend', help='PDF extraction backend(s), each one falling back to the next on failure', required=False,
+        nargs='+', choices=file_utils.BACKENDS, default=file_utils.DEFAULT_BACKENDS)
+    parser.add_argument(
+        '--extractionPageWorkers', help='If specified, split large PDF files into page ranges extracted by x workers', required=False, type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        handlers=[logging.StreamHandler()])
+
+    extraction_cache = ExtractionCache(
+        args.extractionCacheDir, args.extractionCacheMaxMb, file_utils.PdfExtractor(args.extractionBackend, args.extractionPageWorkers))
+    index = VariantIndex(args.indexFile, extraction_cache)
+    try:
+        if args.command == 'update':
+            if not args.fileConfig and not args.pdfDir:
+                sys.exit('update requires --fileConfig or --pdfDir')
+            stats = index.update(file_utils.list_pdf_files(args.fileConfig, args.pdfDir), prune=args.prune)
+            logging.info(f'Updated the variant index: {stats}')
+        else:
+            if not args.term and not args.fileConfig:
+                sys.exit('query requires --term or --fileConfig')
+            query_terms(index, args.term)
+            for file_config in args.fileConfig:
+                query_manifest(index, file_config)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
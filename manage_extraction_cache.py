@@ -0,0 +1,82 @@
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime
+from typing import List
+from utils import file_utils
+from utils.extraction_cache import ExtractionCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+
+
+def warm(cache: ExtractionCache, pdf_files: List[str]) -> None:
+    """
+    Extracts the given PDF files into the cache, skipping those already cached
+    """
+    for pdf_file in pdf_files:
+        if not os.path.isfile(pdf_file):
+            logging.error(f'Cannot find the PDF file: {pdf_file}')
+            continue
+        try:
+            cache.get_or_extract(pdf_file)
+        except Exception as ex:
+            logging.error(f'Failed to extract {pdf_file}: {ex}')
+    logging.info(f'Warmed the extraction cache: {cache.misses} extracted, {cache.hits} already cached')
+
+
+def inspect(cache: ExtractionCache) -> None:
+    """
+    Prints the cache entries, from the least to the most recently used
+    """
+    entries = cache.entries()
+    for entry in entries:
+        meta = entry['metadata']
+        last_used = datetime.fromtimestamp(entry['last_used']).isoformat(timespec='seconds')
+        stale = '' if meta.get('extractor_version') == cache.extractor_version else ' (stale)'
+        print(f"{entry['key'][:16]}  {entry['size']:>10}  {last_used}  {meta.get('source', '')}{stale}")
+
+    total_size = sum(entry['size'] for entry in entries)
+    print(f'{len(entries)} entries, {total_size / (1024 * 1024):.2f} MB '
+          f'(limit {cache.max_size_bytes / (1024 * 1024):.2f} MB), extractor version: {cache.extractor_version}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Warm up, inspect or purge the cache of texts extracted from PDF files')
+    parser.add_argument(
+        'command', help='Action to perform on the cache', choices=['warm', 'inspect', 'purge'])
+    parser.add_argument(
+        '--cacheDir', help='Folder storing the extraction cache', required=False, default=DEFAULT_CACHE_DIR)
+    parser.add_argument(
+        '--maxSizeMb', help='Maximum size of the extraction cache in MB', required=False, type=float, default=DEFAULT_MAX_SIZE_MB)
+    parser.add_argument(
+        '--fileConfig', help='warm: publication param file(s) listing the PDF files to extract', required=False, nargs='*', default=[])
+    parser.add_argument(
+        '--pdfDir', help='warm: folder(s) containing PDF files to extract', required=False, nargs='*', default=[])
+    parser.add_argument(
+        '--staleOnly', help='purge: only removes entries produced by another extractor version', action='store_true')
+    parser.add_argument(
+        '--extractionBackend', help='PDF extraction backend(s), each one falling back to the next on failure', required=False,
+        nargs='+', choices=file_utils.BACKENDS, default=file_utils.DEFAULT_BACKENDS)
+    parser.add_argument(
+        '--extractionPageWorkers', help='If specified, split large PDF files into page ranges extracted by x workers', required=False, type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        handlers=[logging.StreamHandler()])
+
+    cache = ExtractionCache(args.cacheDir, args.maxSizeMb, file_utils.PdfExtractor(args.extractionBackend, args.extractionPageWorkers))
+    if args.command == 'warm':
+        if not args.fileConfig and not args.pdfDir:
+            sys.exit('warm requires --fileConfig or --pdfDir')
+        warm(cache, file_utils.list_pdf_files(args.fileConfig, args.pdfDir))
+    elif args.command == 'inspect':
+        inspect(cache)
+    else:
+        removed = cache.purge(stale_only=args.staleOnly)
+        logging.info(f'Removed {removed} entries from the extraction cache')
+
+
+if __name__ == "__main__":
+    main()
@@ -2,41 +2,77 @@ import os
 import logging
 from logging import DEBUG, INFO
 import argparse
-from pandas import read_csv
-import re
+from pandas import Series, read_csv
 from typing import Mapping
+from utils.outcome_rules import RULES, RULE_REGEXES
+from utils.result_sink import iter_results, DEFAULT_CHUNK_SIZE
+
+
+def classify_answers(answers: Series) -> Series:
+    """
+    Classifies answers with the label of the first rule matching them, or keeps them as is if no rule matches.
+    Each distinct answer is classified once (answers to the last questions are mostly the same few phrases),
+    and each rule is only applied to the answers no previous rule matched.
+
+    :param answers: answers to classify
+    :return: processed answers
+    """
+    distinct = Series(answers.dropna().unique(), dtype=object)
+    labels = distinct.copy()
+    remaining = distinct.astype(str)
+    for (label, _), regex in zip(RULES, RULE_REGEXES):
+        matched = remaining.str.contains(regex)
+        labels[matched[matched].index] = label
+        remaining = remaining[~matched]
+    return answers.map(dict(zip(distinct, labels)))
+
 
 def process_answer(row: Mapping[str, str]) -> str:
+    """
+    Classifies the answer of a single result row
+    """
     answer = row['answer']
-
-    found = re.search(r'[aA]ssay\s+[\S*\s+]*not\s+[pP]resent', answer)
-    if found:
-        return 'Assays Not Present'
-
-    found = re.search(r'[vV]ariant\s+\w*\s*[iI]ntermediate\s+[fF]unction', answer)
-    if found:
-        return 'Evidence of Intermediate Function'
-    
-    found = re.search(r'[vV]ariant\s+\w*\s*[pP]athogenic', answer)
-    if found:
-        return 'Pathogenic Evidence'
-    
-    found = re.search(r'[vV]ariant\s+\w*\s*[bB]enign', answer)
-    if found:
-        return 'Benign Evidence'
-    
-    found = re.search(r'[vV]ariant\s+\w*\s*[iL]nconclusive', answer)
-    if found:
-        return 'Assays are Inconclusive'
-    
+    for (label, _), regex in zip(RULES, RULE_REGEXES):
+        if regex.search(answer):
+            return label
     return answer
 
 
+def process_outcome_file(outcome_file: str, output_file: str, chunk_size: int = DEFAULT_CHUNK_SIZE, append: bool = False) -> int:
+    """
+    Adds the processed answer to every row of a result file, chunk by chunk, and writes them to a CSV file
+
+    :param outcome_file: result file (CSV, JSONL or Parquet)
+    :param output_file: CSV file to write
+    :param chunk_size: maximum # of rows processed at once
+    :param append: if True, appends to the output file instead of overwriting it
+    :return: # of rows processed
+    """
+    count = 0
+    # Rows appended to an output file follow its columns, as result files of different versions may differ
+    columns = list(read_csv(output_file, nrows=0).columns) if append and os.path.isfile(output_file) else None
+    for chunk in iter_results(outcome_file, chunk_size):
+        # Add a new column in the result file for the processed answer
+        chunk['processed_answer'] = classify_answers(chunk['answer'])
+        if columns:
+            chunk = chunk.reindex(columns=columns)
+        header = columns is None and count == 0
+        chunk.to_csv(output_file, mode='w' if header else 'a', header=header, index=False)
+        count += len(chunk)
+    logging.info(f'Processed {count} rows of {outcome_file} into {output_file}')
+    return count
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Post process outcome from sequential prompts')
     parser.add_argument(
-        '--outcomeFile', help='file with outcomes from sequential prompts', required=True)
+        '--outcomeFile', help='file(s) with outcomes from sequential prompts', required=True, nargs='+')
+    parser.add_argument(
+        '--outputFile', help='CSV file combining the processed outcomes of all files '
+                             '(by default, each file is written to <outcome file>-processed.csv)', required=False)
+    parser.add_argument(
+        '--chunkSize', help='Maximum # of rows processed at once', required=False, type=int, default=DEFAULT_CHUNK_SIZE)
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO,
@@ -48,10 +84,11 @@ def main():
                             logging.StreamHandler()
                         ])
 
-    data = read_csv(args.outcomeFile)
-    # Add a new column in the result file for the processed answer
-    data['processed_answer'] = data.apply(lambda row: process_answer(row), axis=1)
-    data.to_csv(args.outcomeFile, index=False)
+    for i, outcome_file in enumerate(args.outcomeFile):
+        if args.outputFile:
+            process_outcome_file(outcome_file, args.outputFile, args.chunkSize, append=i > 0)
+        else:
+            process_outcome_file(outcome_file, os.path.splitext(outcome_file)[0] + '-processed.csv', args.chunkSize)
 
 if __name__ == "__main__":
     main()
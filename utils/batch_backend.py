@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import uuid
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+# Endpoint of the requests in a batch file, as per the OpenAI batch file format
+CHAT_COMPLETIONS_URL = '/chat/completions'
+
+DEFAULT_POLL_SECONDS = 30.0
+
+
+class BatchRequest(NamedTuple):
+    custom_id: str
+    body: Dict[str, Any]
+
+
+class BatchResult(NamedTuple):
+    custom_id: str
+    response: Optional[Dict[str, Any]]
+    error: Optional[str]
+
+
+def write_batch_requests(path: str, requests: List[BatchRequest]) -> None:
+    """
+    Writes chat completion requests to a batch file, one JSON line per request:
+    {"custom_id": ..., "method": "POST", "url": "/chat/completions", "body": {...}}
+
+    Only the envelope follows the OpenAI batch file format: the body holds the parameters of the chat completion
+    request as given, e.g. the Azure deployment as `engine` rather than the model as `model`.
+
+    :param path: location of the batch file
+    :param requests: requests, identified by their custom id
+    """
+    with open(path, mode='w', encoding='utf-8') as fd:
+        for request in requests:
+            fd.write(json.dumps({
+                'custom_id': request.custom_id,
+                'method': 'POST',
+                'url': CHAT_COMPLETIONS_URL,
+                'body': request.body
+            }) + '\n')
+
+
+def read_batch_requests(path: str) -> List[BatchRequest]:
+    """
+    Reads the requests of a batch file
+    """
+    requests = []
+    with open(path, mode='r', encoding='utf-8') as fd:
+        for line in fd:
+            if line.strip():
+                record = json.loads(line)
+                requests.append(BatchRequest(record['custom_id'], record['body']))
+    return requests
+
+
+def read_batch_results(path: str) -> Dict[str, BatchResult]:
+    """
+    Reads the output file of a batch job, one JSON line per request:
+    {"custom_id": ..., "response": {"status_code": 200, "body": {...}}, "error": null}
+
+    :param path: location of the output file
+    :return: results by custom id
+    """
+    results = {}
+    with open(path, mode='r', encoding='utf-8') as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            error = record.get('error')
+            if isinstance(error, dict):
+                error = error.get('message') or error.get('code')
+            if not error and response.get('status_code', 200) != 200:
+                error = f"HTTP {response['status_code']}: {response.get('body')}"
+            results[record['custom_id']] = BatchResult(record['custom_id'], None if error else response.get('body'), error)
+    return results
+
+
+class BatchBackend(ABC):
+    """
+    Service running batch jobs: takes a batch file of chat completion requests,
+    and produces an output file with the response (or error) of each request
+    """
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        """
+        Submits a batch file
+
+        :param requests_path: location of the batch file
+        :return: id of the batch job
+        """
+
+    @abstractmethod
+    def wait(self, batch_id: str) -> str:
+        """
+        Waits for a batch job to complete
+
+        :param batch_id: id of the batch job
+        :return: location of the output file
+        """
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Stand-in for a batch service, storing batch jobs as files.
+
+    Each submitted batch file is copied to `<batch_dir>/<batch_id>-input.jsonl`. If a completion function
+    is given, requests are completed locally (by `workers` threads) into `<batch_id>-output.jsonl`.
+    Otherwise, the output file is expected to be written by another process, and is polled for.
+    """
+    def __init__(
+            self,
+            batch_dir: str,
+            complete: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+            workers: int = 1,
+            poll_seconds: float = DEFAULT_POLL_SECONDS):
+        self.batch_dir: str = batch_dir
+        self.complete: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = complete
+        self.workers: int = max(workers, 1)
+        self.poll_seconds: float = poll_seconds
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f'batch_{uuid.uuid4().hex}'
+        requests = read_batch_requests(requests_path)
+        write_batch_requests(self.__input_path(batch_id), requests)
+        logging.info(f'Submitted batch {batch_id}: {len(requests)} requests')
+
+        complete = self.complete
+        if complete:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch') as pool:
+                records = list(pool.map(partial(self.__complete_request, complete), requests))
+            tmp_path = self.__output_path(batch_id) + '.tmp'
+            with open(tmp_path, mode='w', encoding='utf-8') as fd:
+                for record in records:
+                    fd.write(json.dumps(record) + '\n')
+            os.replace(tmp_path, self.__output_path(batch_id))
+        return batch_id
+
+    def wait(self, batch_id: str) -> str:
+        output_path = self.__output_path(batch_id)
+        while not os.path.isfile(output_path):
+            logging.info(f'Waiting for the output of batch {batch_id}: {output_path}')
+            time.sleep(self.poll_seconds)
+        return output_path
+
+    @staticmethod
+    def __complete_request(complete: Callable[[Dict[str, Any]], Dict[str, Any]], request: BatchRequest) -> Dict[str, Any]:
+        """
+        Completes a single request, recording its error instead of failing the whole batch
+        """
+        try:
+            response = complete(request.body)
+            return {'custom_id': request.custom_id, 'response': {'status_code': 200, 'body': response}, 'error': None}
+        except Exception as ex:
+            logging.error(f'Request {request.custom_id} of the batch failed: {ex}')
+            return {'custom_id': request.custom_id, 'response': None, 'error': {'code': type(ex).__name__, 'message': str(ex)}}
+
+    def __input_path(self, batch_id: str) -> str:
+        return os.path.join(self.batch_dir, f'{batch_id}-input.jsonl')
+
+    def __output_path(self, batch_id: str) -> str:
+        return os.path.join(self.batch_dir, f'{batch_id}-output.jsonl')
+
+
+BACKEND_LOCAL = 'local'
+BACKENDS = [BACKEND_LOCAL]
+
+
+def create_batch_backend(name: str, batch_dir: str, **kwargs) -> BatchBackend:
+    """
+    Creates a batch backend
+
+    :param name: name of the backend
+    :param batch_dir: folder storing batch files
+    :return: batch backend
+    """
+    if name == BACKEND_LOCAL:
+        return LocalBatchBackend(batch_dir, **kwargs)
+    raise ValueError(f"Unsupported batch backend '{name}'")
@@ -0,0 +1,169 @@
+import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from utils.variant_utils import get_alias_matcher
+
+# Keywords of functional assays, used to keep paragraphs describing assays even without a variant mention
+DEFAULT_ASSAY_KEYWORDS = [
+    'assay', 'in vitro', 'in vivo', 'functional', 'activity', 'expression', 'localization', 'transfect',
+    'western blot', 'immunoblot', 'luciferase', 'reporter', 'minigene', 'splicing', 'enzym', 'binding',
+    'knock-in', 'knockout', 'mice', 'mouse', 'zebrafish', 'yeast', 'wild-type', 'wild type', 'mutant'
+]
+DEFAULT_WINDOW = 1
+DEFAULT_TOKEN_BUDGET = 3000
+MAX_PARAGRAPH_CHARS = 1500
+GAP_MARKER = '\n[...]\n'
+
+# Tiers of paragraphs, from the most to the least relevant
+TIER_VARIANT = 0
+TIER_WINDOW = 1
+TIER_KEYWORD = 2
+TIER_LEADING = 3
+
+
+class ContextReduction(NamedTuple):
+    text: str
+    original_tokens: int
+    reduced_tokens: int
+    paragraphs: int
+    kept: List[Tuple[int, int]]
+    dropped: List[Tuple[int, int]]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the # of tokens of a text (roughly 4 characters per token)
+    """
+    return len(text) // 4
+
+
+def split_paragraphs(text: str, max_chars: int = MAX_PARAGRAPH_CHARS) -> List[Tuple[int, int]]:
+    """
+    Splits a text into paragraphs separated by blank lines. Text extracted from PDF files often has
+    no blank lines, so paragraphs longer than `max_chars` are further split at line breaks.
+
+    :param text: text to split
+    :param max_chars: maximum # of characters of a paragraph (unless a single line is longer)
+    :return: list of (start, end) offsets of the paragraphs
+    """
+    paragraphs = []
+    start = 0
+    for separator in re.finditer(r'\n\s*\n', text):
+        paragraphs.append((start, separator.start()))
+        start = separator.end()
+    paragraphs.append((start, len(text)))
+
+    spans = []
+    for start, end in paragraphs:
+        while end - start > max_chars:
+            split_at = text.rfind('\n', start + 1, start + max_chars)
+            if split_at < 0:
+                split_at = text.find('\n', start + max_chars, end)
+                if split_at < 0:
+                    break
+            spans.append((start, split_at))
+            start = split_at + 1
+        if text[start:end].strip():
+            spans.append((start, end))
+    return spans
+
+
+def find_mentions(text: str, terms: Iterable[str]) -> List[int]:
+    """
+    Finds the offsets of all case-insensitive literal occurrences of the given terms in the text
+    """
+    return [match.start for match in get_alias_matcher(tuple(terms)).find_all(text)]
+
+
+def reduce_context(
+        text: str,
+        variant_aliases: Iterable[str],
+        keywords: Iterable[str] = DEFAULT_ASSAY_KEYWORDS,
+        window: int = DEFAULT_WINDOW,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        variant_offsets: Optional[List[int]] = None) -> ContextReduction:
+    """
+    Reduces a publication to the paragraphs relevant to the target variant, within a token budget.
+
+    Paragraphs are kept by priority: those mentioning a variant alias first, then those within `window`
+    paragraphs of a mention (closest first), then those mentioning assay keywords (most keywords first).
+    If the variant is not mentioned at all, the leading paragraphs fill the rest of the budget.
+    Kept paragraphs are returned in their original order, with a marker where paragraphs were dropped.
+
+    :param text: text of the publication
+    :param variant_aliases: variant and its nomenclature aliases
+    :param keywords: assay keywords
+    :param window: # of paragraphs kept before and after a paragraph mentioning the variant
+    :param token_budget: maximum # of tokens of the reduced text
+    :param variant_offsets: offsets of the variant aliases in the text, if already found
+    :return: reduced text, along with the spans kept and dropped
+    """
+    # Keep paragraphs well below the budget (a quarter of it), so that each one can fit
+    paragraphs = split_paragraphs(text, min(MAX_PARAGRAPH_CHARS, max(token_budget, 1)))
+    original_tokens = estimate_tokens(text)
+    if original_tokens <= token_budget:
+        return ContextReduction(text, original_tokens, original_tokens, len(paragraphs), paragraphs, [])
+
+    if variant_offsets is None:
+        variant_offsets = find_mentions(text, variant_aliases)
+    variant_hits = __count_per_paragraph(paragraphs, variant_offsets)
+    keyword_hits = __count_per_paragraph(paragraphs, find_mentions(text, keywords))
+
+    # Rank paragraphs by tier, then by distance to a variant mention or by # of keywords
+    anchors = [i for i, count in enumerate(variant_hits) if count > 0]
+    ranked = []
+    for i in range(len(paragraphs)):
+        distance = min((abs(i - anchor) for anchor in anchors), default=None)
+        if distance == 0:
+            ranked.append((TIER_VARIANT, -variant_hits[i], i))
+        elif distance is not None and distance <= window:
+            ranked.append((TIER_WINDOW, distance, i))
+        elif keyword_hits[i] > 0:
+            ranked.append((TIER_KEYWORD, -keyword_hits[i], i))
+        elif not anchors:
+            # Variant not mentioned anywhere: fill the rest of the budget from the beginning (title, abstract)
+            ranked.append((TIER_LEADING, 0, i))
+    ranked.sort()
+
+    selected = set()
+    budget = token_budget
+    for _, _, i in ranked:
+        start, end = paragraphs[i]
+        tokens = estimate_tokens(text[start:end]) + estimate_tokens(GAP_MARKER)
+        if tokens <= budget:
+            selected.add(i)
+            budget -= tokens
+
+    kept = [paragraphs[i] for i in sorted(selected)]
+    dropped = [paragraphs[i] for i in range(len(paragraphs)) if i not in selected]
+
+    parts = []
+    previous = -1
+    for i in sorted(selected):
+        if i != previous + 1:
+            parts.append(GAP_MARKER)
+        elif parts:
+            # Keep the original separator between adjacent paragraphs
+            parts.append(text[paragraphs[previous][1]:paragraphs[i][0]])
+        parts.append(text[paragraphs[i][0]:paragraphs[i][1]])
+        previous = i
+    if previous != len(paragraphs) - 1:
+        parts.append(GAP_MARKER)
+    reduced_text = ''.join(parts)
+
+    return ContextReduction(reduced_text, original_tokens, estimate_tokens(reduced_text), len(paragraphs), kept, dropped)
+
+
+def __count_per_paragraph(paragraphs: List[Tuple[int, int]], offsets: List[int]) -> List[int]:
+    """
+    Counts the offsets falling in each paragraph
+    """
+    counts = [0] * len(paragraphs)
+    i = 0
+    for offset in sorted(offsets):
+        while i < len(paragraphs) and paragraphs[i][1] <= offset:
+            i += 1
+        if i == len(paragraphs):
+            break
+        if paragraphs[i][0] <= offset:
+            counts[i] += 1
+    return counts
@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional
+import openai
+from utils.rate_limiter import RateLimiter
+
+# # of recent calls of an endpoint its latency and error rate are measured over
+LATENCY_HISTORY = 100
+ERROR_HISTORY = 20
+# Weight of the error rate in the routing score: an endpoint failing 25% of its calls gets half the traffic
+ERROR_PENALTY = 4.0
+# Consecutive failures after which an endpoint is left out of the routing for a while
+FAILURES_BEFORE_COOLDOWN = 3
+COOLDOWN_SECONDS = 30.0
+# # of latencies needed to compute the hedging delay
+DEFAULT_HEDGE_MIN_SAMPLES = 10
+DEFAULT_MAX_WORKERS = 16
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when no endpoint answered a call within its deadline
+    """
+    def __init__(self, seconds: float, endpoints: List[str]):
+        super().__init__(f'No response within the deadline of {seconds:.1f} seconds from {endpoints}')
+        self.seconds: float = seconds
+        self.endpoints: List[str] = endpoints
+
+
+class Endpoint(NamedTuple):
+    name: str
+    deployment: str
+    api_base: Optional[str] = None
+    api_key: Optional[str] = None
+    api_version: Optional[str] = None
+    api_type: Optional[str] = None
+    # Share of the traffic of the endpoint, relative to the other endpoints, all else being equal
+    weight: float = 1.0
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+
+    def credentials(self) -> Dict[str, str]:
+        """
+        :return: parameters of openai.ChatCompletion.create sending a request to this endpoint
+        """
+        params = {'engine': self.deployment, 'api_base': self.api_base, 'api_key': self.api_key,
+                  'api_version': self.api_version, 'api_type': self.api_type}
+        return {key: value for key, value in params.items() if value is not None}
+
+
+def load_endpoints(config_path: str) -> List[Endpoint]:
+    """
+    Reads the endpoints of a deployment pool config file (JSON): {"endpoints": [{"name": ..., "deployment": ..., ...}]}.
+    The API key can be given as the name of an environment variable (api_key_env). Missing API settings default
+    to the AZURE_OPENAI_* environment variables.
+
+    :param config_path: location of the deployment pool config file
+    :return: endpoints
+    """
+    with open(config_path, 'r') as fd:
+        data: Dict[str, Any] = json.load(fd)
+
+    endpoints = []
+    for params in data['endpoints']:
+        params = dict(params)
+        api_key_env = params.pop('api_key_env', None)
+        if api_key_env:
+            params['api_key'] = os.getenv(api_key_env)
+        params.setdefault('api_base', os.getenv('AZURE_OPENAI_ENDPOINT'))
+        params.setdefault('api_key', os.getenv('AZURE_OPENAI_KEY'))
+        params.setdefault('api_version', os.getenv('AZURE_OPENAI_VERSION'))
+        params.setdefault('api_type', os.getenv('AZURE_OPENAI_TYPE'))
+        endpoints.append(Endpoint(**params))
+    if not endpoints:
+        raise ValueError(f'No endpoint in the deployment pool config {config_path}')
+    return endpoints
+
+
+def send_with_openai(endpoint: Endpoint, request: Dict, timeout: Optional[float]) -> Dict:
+    """
+    Sends a chat completion request to an endpoint with the openai package
+    """
+    params = dict(request, **endpoint.credentials())
+    if timeout:
+        params['request_timeout'] = timeout
+    return openai.ChatCompletion.create(**params)
+
+
+class EndpointStats:
+    """
+    Recent latencies and outcomes of the calls to an endpoint
+    """
+    def __init__(self) -> None:
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_HISTORY)
+        self.outcomes: Deque[bool] = deque(maxlen=ERROR_HISTORY)
+        self.consecutive_failures: int = 0
+        self.cooldown_until: float = 0.0
+        self.calls: int = 0
+        self.errors: int = 0
+        self.hedges_sent: int = 0
+        self.hedges_won: int = 0
+
+    def latency_percentile(self, percent: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class DeploymentPool:
+    """
+    Routes chat completion calls across a pool of deployments (endpoints), by weight, recent latency and error rate,
+    within the quotas of each endpoint.
+
+    Calls can be given a deadline, and hedged: when an endpoint has not answered within the given percentile
+    of its recent latencies, a duplicate of the call is sent to another endpoint, and whichever answers first is kept
+    (the other response is discarded). Hedging costs a few duplicate calls (e.g. ~5% at the 95th percentile)
+    to cut the tail latency.
+    """
+    def __init__(
+            self,
+            endpoints: List[Endpoint],
+            send: Callable[[Endpoint, Dict, Optional[float]], Dict] = send_with_openai,
+            deadline_seconds: Optional[float] = None,
+            hedge_percentile: Optional[float] = None,
+            hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+            max_workers: int = DEFAULT_MAX_WORKERS,
+            clock: Callable[[], float] = time.monotonic):
+        """
+        :param endpoints: endpoints of the pool
+        :param send: function sending a request to an endpoint within a timeout (replaced by stand-ins in tests)
+        :param deadline_seconds: maximum # of seconds to wait for a response to a call (None for no deadline)
+        :param hedge_percentile: percentile of the recent latencies after which a call is hedged (None not to hedge)
+        :param hedge_min_samples: # of latencies measured before calls are hedged
+        :param max_workers: maximum # of calls in flight
+        """
+        if not endpoints:
+            raise ValueError('A deployment pool needs at least one endpoint')
+        self.endpoints: List[Endpoint] = endpoints
+        self.send: Callable[[Endpoint, Dict, Optional[float]], Dict] = send
+        self.deadline_seconds: Optional[float] = deadline_seconds
+        self.hedge_percentile: Optional[float] = hedge_percentile
+        self.hedge_min_samples: int = hedge_min_samples
+        self.clock: Callable[[], float] = clock
+        self.stats: Dict[str, EndpointStats] = {endpoint.name: EndpointStats() for endpoint in endpoints}
+        self.limiters: Dict[str, Optional[RateLimiter]] = {
+            endpoint.name: RateLimiter(endpoint.requests_per_minute, endpoint.tokens_per_minute)
+            if endpoint.requests_per_minute or endpoint.tokens_per_minute else None
+            for endpoint in endpoints}
+        self.lock: threading.Lock = threading.Lock()
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='deployment')
+
+    def select(self, exclude: Iterable[str] = ()) -> Optional[Endpoint]:
+        """
+        Picks an endpoint at random, in proportion to its weight divided by its median latency and its error rate.
+        Endpoints cooling down after consecutive failures are only picked if all the others are too.
+
+        :param exclude: names of endpoints not to pick
+        :return: endpoint, or None if all are excluded
+        """
+        exclude = set(exclude)
+        now = self.clock()
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.name not in exclude]
+            available = [endpoint for endpoint in candidates if self.stats[endpoint.name].cooldown_until <= now]
+            candidates = available or candidates
+            if not candidates:
+                return None
+            known = [latency for latency in (self.stats[endpoint.name].latency_percentile(50) for endpoint in candidates) if latency]
+            # Endpoints without any latency yet are assumed as fast as the fastest one, so that they get traffic
+            default_latency = min(known, default=1.0)
+            scores = []
+            for endpoint in candidates:
+                stats = self.stats[endpoint.name]
+                latency = stats.latency_percentile(50) or default_latency
+                scores.append(endpoint.weight / (latency * (1 + ERROR_PENALTY * stats.error_rate)))
+        return random.choices(candidates, weights=scores)[0]
+
+    def acquire(self, endpoint: Endpoint, tokens: int) -> float:
+        """
+        Blocks until a request fits in the quotas of the endpoint
+
+        :return: # of seconds spent waiting
+        """
+        limiter = self.limiters[endpoint.name]
+        return limiter.acquire(tokens) if limiter else 0.0
+
+    def record(self, endpoint: Endpoint, latency: Optional[float]) -> None:
+        """
+        Records the outcome of a call to an endpoint
+
+        :param latency: # of seconds the call took, or None if it failed
+        """
+        with self.lock:
+            stats = self.stats[endpoint.name]
+            stats.calls += 1
+            stats.outcomes.append(latency is not None)
+            if latency is not None:
+                stats.latencies.append(latency)
+                stats.consecutive_failures = 0
+                return
+            stats.errors += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= FAILURES_BEFORE_COOLDOWN:
+                stats.cooldown_until = self.clock() + COOLDOWN_SECONDS
+                logging.warning(f'Deployment {endpoint.name} failed {stats.consecutive_failures} calls in a row: '
+                                f'left out for {COOLDOWN_SECONDS:.0f} seconds')
+
+    def complete(self, request: Dict, tokens: int) -> Dict:
+        """
+        Sends a chat completion request to the pool, hedging it if it is slow, within the deadline
+
+        :param request: chat completion request (its engine is replaced by the deployment of the endpoint)
+        :param tokens: estimated # of tokens of the request, counted against the quotas of the endpoint
+        :return: first successful response
+        """
+        started = self.clock()
+        deadline = started + self.deadline_seconds if self.deadline_seconds else None
+        primary = self.select()
+        if primary is None:
+            raise ValueError('No endpoint of the deployment pool is available')
+        futures: Dict[Future, Endpoint] = {self.executor.submit(self.__call, primary, request, tokens, deadline): primary}
+        hedge_at = self.__hedge_delay(primary)
+        hedge_at = started + hedge_at if hedge_at is not None else None
+        hedge: Optional[Endpoint] = None
+        error: Optional[BaseException] = None
+
+        while futures:
+            now = self.clock()
+            timeouts = [moment - now for moment in (deadline, hedge_at if hedge is None else None) if moment is not None]
+            done, _ = wait(list(futures), timeout=max(min(timeouts), 0) if timeouts else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                endpoint = futures.pop(future)
+                if future.exception() is None:
+                    if endpoint is hedge:
+                        with self.lock:
+                            self.stats[endpoint.name].hedges_won += 1
+                        logging.info(f'Hedged call to {endpoint.name} answered before {primary.name}')
+                    # Responses to the other calls still in flight are discarded
+                    for other in futures:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+                logging.warning(f'Call to {endpoint.name} failed: {error!r}')
+            if done:
+                continue
+
+            now = self.clock()
+            if deadline is not None and now >= deadline:
+                for future in futures:
+                    future.cancel()
+                raise DeadlineExceeded(deadline - started, [endpoint.name for endpoint in futures.values()])
+            if hedge is None and hedge_at is not None and now >= hedge_at:
+                hedge = self.select(exclude=[primary.name])
+                hedge_at = None
+                if hedge:
+                    with self.lock:
+                        self.stats[hedge.name].hedges_sent += 1
+                    logging.info(f'No response from {primary.name} after {now - started:.1f} seconds: hedging the call to {hedge.name}')
+                    futures[self.executor.submit(self.__call, hedge, request, tokens, deadline)] = hedge
+        # Every call failed (the loop only ends once a call answered or failed)
+        if error is None:
+            raise RuntimeError(f'No response from {primary.name}')
+        raise error
+
+    def __hedge_delay(self, endpoint: Endpoint) -> Optional[float]:
+        """
+        :return: # of seconds after which a call to the endpoint is hedged, or None not to hedge it
+        """
+        if self.hedge_percentile is None or len(self.endpoints) < 2:
+            return None
+        with self.lock:
+            stats = self.stats[endpoint.name]
+            if len(stats.latencies) >= self.hedge_min_samples:
+                return stats.latency_percentile(self.hedge_percentile)
+            # Until the endpoint has enough latencies of its own, hedge as per the whole pool
+            pooled = EndpointStats()
+            for other in self.stats.values():
+                pooled.latencies.extend(other.latencies)
+            if len(pooled.latencies) >= self.hedge_min_samples:
+                return pooled.latency_percentile(self.hedge_percentile)
+        return None
+
+    def __call(self, endpoint: Endpoint, request: Dict, tokens: int, deadline: Optional[float]) -> Dict:
+        self.acquire(endpoint, tokens)
+        started = self.clock()
+        timeout = deadline - started if deadline is not None else None
+        if timeout is not None and timeout <= 0:
+            # There is a deadline only if deadline_seconds is set
+            assert self.deadline_seconds is not None
+            raise DeadlineExceeded(self.deadline_seconds, [endpoint.name])
+        try:
+            response = self.send(endpoint, request, timeout)
+        except Exception:
+            self.record(endpoint, None)
+            raise
+        self.record(endpoint, self.clock() - started)
+        return response
+
+    def log_stats(self) -> None:
+        """
+        Logs the calls, errors, latencies and hedges of each endpoint
+        """
+        with self.lock:
+            for endpoint in self.endpoints:
+                stats = self.stats[endpoint.name]
+                p50, p99 = stats.latency_percentile(50), stats.latency_percentile(99)
+                logging.info(f'Deployment {endpoint.name} ({endpoint.deployment}): {stats.calls} calls, {stats.errors} errors, '
+                             f'p50 {p50 or 0:.2f}s, p99 {p99 or 0:.2f}s, {stats.hedges_sent} hedges sent, {stats.hedges_won} won')
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
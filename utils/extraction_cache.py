@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from typing import Callable, Dict, List, Optional
+from utils import file_utils
+
+DEFAULT_CACHE_DIR = os.path.join('cache', 'extraction')
+DEFAULT_MAX_SIZE_MB = 512
+
+TEXT_SUFFIX = '.txt'
+META_SUFFIX = '.json'
+
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 digest of a file's content
+
+    :param file_path: location of the file
+    :param chunk_size: number of bytes read at a time
+    :return: hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Persistent, content-addressed cache of texts extracted from PDF files.
+
+    Entries are keyed by the SHA-256 of the PDF content and the extractor version, so renaming
+    or moving a PDF keeps its entry valid while changing the extraction logic invalidates it.
+    Each entry is stored as a text file with a small JSON metadata file next to it.
+    The total size is bounded, and the least recently used entries are evicted first
+    (an entry's modification time is refreshed on every hit).
+    """
+    def __init__(
+            self,
+            cache_dir: str = DEFAULT_CACHE_DIR,
+            max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+            extractor: Optional[file_utils.PdfExtractor] = None):
+        self.cache_dir: str = cache_dir
+        self.max_size_bytes: int = int(max_size_mb * 1024 * 1024)
+        self.extractor: file_utils.PdfExtractor = extractor or file_utils.DEFAULT_EXTRACTOR
+        self.extractor_version: str = self.extractor.version
+        self.hits: int = 0
+        self.misses: int = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, pdf_filepath: str) -> str:
+        """
+        Builds the cache key of a PDF file from its content hash and the extractor version
+
+        :param pdf_filepath: location of PDF file
+        :return: cache key
+        """
+        content_hash = hash_file(pdf_filepath)
+        return hashlib.sha256(f'{content_hash}:{self.extractor_version}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up the text cached under the given key, and marks the entry as recently used
+
+        :param key: cache key
+        :return: cached text (if exists)
+        """
+        text_path = self.__text_path(key)
+        try:
+            with open(text_path, 'r', encoding='utf-8') as fd:
+                text = fd.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(text_path, None)
+        except OSError:
+            pass # Entry evicted concurrently; the text read is still valid
+        return text
+
+    def put(self, key: str, text: str, metadata: Optional[Dict] = None) -> None:
+        """
+        Stores the given text under the given key, then evicts entries if the cache is too large
+
+        :param key: cache key
+        :param text: text to store
+        :param metadata: additional information stored along with the text (e.g. source file)
+        """
+        meta = {
+            'extractor_version': self.extractor_version,
+            'chars': len(text),
+            'created': time.time()
+        }
+        if metadata:
+            meta.update(metadata)
+
+        # Write the metadata first, so that a visible text file always has its metadata
+        self.__write_atomic(self.__meta_path(key), json.dumps(meta))
+        self.__write_atomic(self.__text_path(key), text)
+        self.evict()
+
+    def get_or_extract(
+            self,
+            pdf_filepath: str,
+            extract: Optional[Callable[[str], str]] = None) -> str:
+        """
+        Returns the cached text of the given PDF file, extracting and caching it on a miss
+
+        :param pdf_filepath: location of PDF file
+        :param extract: function converting a PDF file into text (by default, the extractor of the cache)
+        :return: text extracted from PDF file
+        """
+        key = self.key_for(pdf_filepath)
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            logging.debug(f'Extraction cache hit: {pdf_filepath}')
+            return text
+
+        self.misses += 1
+        logging.debug(f'Extraction cache miss: {pdf_filepath}')
+        text = (extract or self.extractor)(pdf_filepath)
+        self.put(key, text, {'source': os.path.basename(pdf_filepath)})
+        return text
+
+    def entries(self) -> List[Dict]:
+        """
+        Lists the cache entries, from the least to the most recently used
+
+        :return: list of entries with their key, size, last access time and metadata
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(TEXT_SUFFIX):
+                continue
+            key = file_name[:-len(TEXT_SUFFIX)]
+            try:
+                stat = os.stat(self.__text_path(key))
+                size = stat.st_size
+                meta_path = self.__meta_path(key)
+                meta = {}
+                if os.path.isfile(meta_path):
+                    size += os.path.getsize(meta_path)
+                    with open(meta_path, 'r', encoding='utf-8') as fd:
+                        meta = json.load(fd)
+            except (OSError, ValueError):
+                continue # Entry removed or being rewritten concurrently
+            entries.append({
+                'key': key,
+                'size': size,
+                'last_used': stat.st_mtime,
+                'metadata': meta
+            })
+
+        return sorted(entries, key=lambda entry: entry['last_used'])
+
+    def total_size(self) -> int:
+        """
+        :return: total size of the cache entries in bytes
+        """
+        return sum(entry['size'] for entry in self.entries())
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the cache fits in its size limit
+
+        :return: number of entries removed
+        """
+        entries = self.entries()
+        total_size = sum(entry['size'] for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            self.remove(entry['key'])
+            total_size -= entry['size']
+            removed += 1
+
+        if removed > 0:
+            logging.debug(f'Evicted {removed} entries from the extraction cache')
+        return removed
+
+    def purge(self, stale_only: bool = False) -> int:
+        """
+        Removes cache entries
+
+        :param stale_only: if True, only removes entries produced by another extractor version
+        :return: number of entries removed
+        """
+        removed = 0
+        for entry in self.entries():
+            if stale_only and entry['metadata'].get('extractor_version') == self.extractor_version:
+                continue
+            self.remove(entry['key'])
+            removed += 1
+        return removed
+
+    def remove(self, key: str) -> None:
+        """
+        Removes the entry stored under the given key (if exists)
+        """
+        for path in [self.__text_path(key), self.__meta_path(key)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __text_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + TEXT_SUFFIX)
+
+    def __meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + META_SUFFIX)
+
+    def __write_atomic(self, path: str, content: str) -> None:
+        """
+        Writes the content to a temporary file first, then moves it in place,
+        so that readers never see a partially written entry
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
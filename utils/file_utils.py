@@ -1,27 +1,410 @@
 import re
+import shutil
+import logging
+import itertools
+import subprocess
+import PyPDF2
+from abc import ABC, abstractmethod
 from PyPDF2 import PdfReader
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from utils.manifest import load_manifest
+from pathlib import Path
+from types import ModuleType
+from typing import Generator, Iterator, List, NamedTuple, Optional, Tuple
+
+pdfminer: Optional[ModuleType]
+try:
+    import pdfminer
+    from pdfminer.high_level import extract_pages as pdfminer_extract_pages
+    from pdfminer.layout import LTPage, LTTextContainer
+    from pdfminer.pdfpage import PDFPage
+except ImportError:
+    pdfminer = None
+
+# Revision of the extraction logic. Bump it whenever the extraction or reference-section removal changes,
+# so that cached texts are invalidated (the version of each backend is part of the extractor version too).
+EXTRACTION_REVISION = 3
+
+# Standalone "References" heading line
+REFERENCES_HEADING_REGEX = re.compile(r'^\s*references\s*$', re.IGNORECASE | re.MULTILINE)
+# Lines typical of a reference list: authors "et al.", DOIs, or a year followed by a punctuation mark
+REFERENCE_LINE_REGEX = re.compile(r'et al\.|doi|\b(?:19|20)\d{2}\s*[;:,.)]', re.IGNORECASE)
+# A page is part of the reference list if at least this share of its lines look like references
+REFERENCE_PAGE_MIN_RATIO = 0.3
+# # of reference-like pages following a references heading confirming it is the trailing one
+DEFAULT_CONFIRM_PAGES = 2
+# Numbered entries of a reference list, e.g. "1. Smith J, ..." or "[1] Smith J, ..."
+NUMBERED_REFERENCE_REGEX = re.compile(r'^\s*\[?(\d{1,3})[\].]\s+\S', re.MULTILINE)
+# A references heading followed by entries numbered from 1 to at least this # is confirmed without waiting for more pages
+MIN_NUMBERED_REFERENCES = 3
+
+BACKEND_PYPDF2 = 'pypdf2'
+BACKEND_PDFMINER = 'pdfminer'
+BACKEND_POPPLER = 'poppler'
+BACKENDS = [BACKEND_PYPDF2, BACKEND_PDFMINER, BACKEND_POPPLER]
+DEFAULT_BACKENDS = [BACKEND_PYPDF2]
+# Documents with at least this # of pages are split into page ranges extracted in parallel (if workers are given)
+DEFAULT_PARALLEL_MIN_PAGES = 16
+DEFAULT_PAGES_PER_RANGE = 8
+POPPLER_TIMEOUT_SECONDS = 120
+
+
+class ExtractionStats(NamedTuple):
+    pages_parsed: int
+    # None if the page count of the PDF file is unknown
+    pages_skipped: Optional[int]
+    backend: str
+
+
+class ExtractionBackend(ABC):
+    """
+    PDF text extraction engine, extracting a range of pages of a PDF file
+    """
+    name: str = ''
+    # If True, the backend does not hold the GIL while extracting (e.g. runs a subprocess),
+    # so that page ranges can be extracted in threads rather than processes
+    releases_gil: bool = False
+
+    def is_available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def version(self) -> str:
+        pass
+
+    @abstractmethod
+    def page_count(self, pdf_filepath: str) -> Optional[int]:
+        """
+        :param pdf_filepath: location of PDF file
+        :return: # of pages of the PDF file, as read by the backend (None if the backend cannot tell)
+        """
+
+    @abstractmethod
+    def iter_pages(self, pdf_filepath: str, first: int, last: Optional[int]) -> Generator[str, None, None]:
+        """
+        Extracts the text of pages [first, last) of a PDF file, each page being parsed only when requested
+
+        :param pdf_filepath: location of PDF file
+        :param first: index of the first page (from 0)
+        :param last: index of the page after the last one (None for the last page of the file)
+        :return: generator of the text of each page
+        """
+
+
+class PyPDF2Backend(ExtractionBackend):
+    name = BACKEND_PYPDF2
+
+    def version(self) -> str:
+        return f'PyPDF2-{PyPDF2.__version__}'
+
+    def page_count(self, pdf_filepath: str) -> Optional[int]:
+        return len(PdfReader(pdf_filepath).pages)
+
+    def iter_pages(self, pdf_filepath: str, first: int, last: Optional[int]) -> Generator[str, None, None]:
+        pages = PdfReader(pdf_filepath).pages
+        for index in range(first, len(pages) if last is None else min(last, len(pages))):
+            yield pages[index].extract_text()
+
+
+class PdfMinerBackend(ExtractionBackend):
+    """
+    pdfminer.six backend (requires `pip install pdfminer.six`): slower than PyPDF2, but better at multi-column layouts
+    """
+    name = BACKEND_PDFMINER
+
+    def is_available(self) -> bool:
+        return pdfminer is not None
+
+    def version(self) -> str:
+        return f"pdfminer-{pdfminer.__version__ if pdfminer else 'unknown'}"
+
+    def page_count(self, pdf_filepath: str) -> Optional[int]:
+        with open(pdf_filepath, 'rb') as file:
+            return sum(1 for _ in PDFPage.get_pages(file))
+
+    def iter_pages(self, pdf_filepath: str, first: int, last: Optional[int]) -> Generator[str, None, None]:
+        layouts: Iterator[LTPage]
+        if last is None:
+            layouts = itertools.islice(pdfminer_extract_pages(pdf_filepath), first, None)
+        else:
+            layouts = pdfminer_extract_pages(pdf_filepath, page_numbers=range(first, last))
+        for layout in layouts:
+            yield ''.join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+
+class PopplerBackend(ExtractionBackend):
+    """
+    Runs poppler's pdftotext, typically much faster than the pure Python backends on large PDF files.
+    Pages are converted a few at a time, each call converting several pages.
+    """
+    name = BACKEND_POPPLER
+    releases_gil = True
+    pages_per_call: int = 8
+
+    def is_available(self) -> bool:
+        return shutil.which('pdftotext') is not None
+
+    def version(self) -> str:
+        # e.g. "pdftotext version 22.02.0", printed on stderr
+        output = subprocess.run(['pdftotext', '-v'], capture_output=True, text=True)
+        match = re.search(r'version\s+(\S+)', output.stderr + output.stdout)
+        return f"poppler-{match.group(1) if match else 'unknown'}"
+
+    def page_count(self, pdf_filepath: str) -> Optional[int]:
+        if shutil.which('pdfinfo') is None:
+            return None
+        result = subprocess.run(
+            ['pdfinfo', pdf_filepath], capture_output=True, check=True, timeout=POPPLER_TIMEOUT_SECONDS)
+        match = re.search(r'^Pages:\s+(\d+)', result.stdout.decode('utf-8', errors='replace'), re.MULTILINE)
+        return int(match.group(1)) if match else None
+
+    def iter_pages(self, pdf_filepath: str, first: int, last: Optional[int]) -> Generator[str, None, None]:
+        if last is None:
+            # Unknown page count: the remaining pages are converted in a single call
+            result = subprocess.run(
+                ['pdftotext', '-f', str(first + 1), '-enc', 'UTF-8', pdf_filepath, '-'],
+                capture_output=True, check=True, timeout=POPPLER_TIMEOUT_SECONDS)
+            # The last page ends with a form feed too
+            yield from result.stdout.decode('utf-8', errors='replace').split('\f')[:-1]
+            return
+        for start in range(first, last, self.pages_per_call):
+            end = min(start + self.pages_per_call, last)
+            result = subprocess.run(
+                ['pdftotext', '-f', str(start + 1), '-l', str(end), '-enc', 'UTF-8', pdf_filepath, '-'],
+                capture_output=True, check=True, timeout=POPPLER_TIMEOUT_SECONDS)
+            # Each page ends with a form feed
+            yield from result.stdout.decode('utf-8', errors='replace').split('\f')[:end - start]
+
+
+def create_backend(name: str) -> ExtractionBackend:
+    """
+    Creates a PDF extraction backend
+
+    :param name: pypdf2, pdfminer or poppler
+    :return: backend
+    """
+    if name == BACKEND_PYPDF2:
+        return PyPDF2Backend()
+    elif name == BACKEND_PDFMINER:
+        return PdfMinerBackend()
+    elif name == BACKEND_POPPLER:
+        return PopplerBackend()
+    raise ValueError(f"Unsupported PDF extraction backend '{name}'")
+
+
+def extract_page_range(backend: ExtractionBackend, pdf_filepath: str, first: int, last: Optional[int]) -> List[str]:
+    """
+    Extracts the text of pages [first, last) of a PDF file.
+    Runs in a worker process, so it must stay a module-level function.
+    """
+    return list(backend.iter_pages(pdf_filepath, first, last))
+
+
+def __is_reference_page(text: str) -> bool:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return False
+    matching = sum(1 for line in lines if REFERENCE_LINE_REGEX.search(line))
+    return matching / len(lines) >= REFERENCE_PAGE_MIN_RATIO
+
+
+def __has_numbered_references(text: str) -> bool:
+    numbers = [int(match.group(1)) for match in NUMBERED_REFERENCE_REGEX.finditer(text)][:MIN_NUMBERED_REFERENCES]
+    return numbers == list(range(1, MIN_NUMBERED_REFERENCES + 1)) and __is_reference_page(text)
+
+
+def collect_pdf_text(
+        pages: Iterator[str],
+        total_pages: Optional[int],
+        backend: str,
+        early_stop: bool = True,
+        confirm_pages: int = DEFAULT_CONFIRM_PAGES) -> Tuple[str, ExtractionStats]:
+    """
+    Collects the text of the pages of a PDF file, without its reference section.
+
+    With early stop, once a references heading is followed by `confirm_pages` pages that look like
+    a reference list, or by reference-like entries numbered from 1, the heading is taken as the trailing one
+    and the remaining pages are not requested. A references heading followed by a page that does not look
+    like references (e.g. supplementary material) is not trailing, and collection goes on.
+
+    :param pages: text of each page, parsed as requested
+    :param total_pages: # of pages of the PDF file (None if unknown)
+    :param backend: name of the backend extracting the pages
+    :param early_stop: if True, stops requesting pages once the trailing references heading is confirmed
+    :param confirm_pages: # of reference-like pages confirming a references heading
+    :return: text of the PDF file, and # of pages parsed and skipped
+    """
+    collected: List[str] = []
+    # # of reference-like pages since the last references heading (None if no heading found yet)
+    reference_pages: Optional[int] = None
+    # Text following the last references heading
+    since_heading = ''
+    stopped = False
+    for text in pages:
+        collected.append(text)
+        if not early_stop:
+            continue
+        headings = list(REFERENCES_HEADING_REGEX.finditer(text))
+        if headings:
+            reference_pages = 0
+            since_heading = text[headings[-1].end():]
+        elif reference_pages is not None:
+            if not __is_reference_page(text):
+                reference_pages = None
+                continue
+            reference_pages += 1
+            since_heading += text
+        else:
+            continue
+        if reference_pages >= confirm_pages or __has_numbered_references(since_heading):
+            stopped = True
+            break
+
+    pages_skipped: Optional[int]
+    if total_pages is not None:
+        pages_skipped = total_pages - len(collected)
+    else:
+        # The pages left after an early stop are unknown
+        pages_skipped = None if stopped else 0
+    stats = ExtractionStats(len(collected), pages_skipped, backend)
+    return __remove_reference_section(''.join(collected)), stats
+
+
+class PdfExtractor:
+    """
+    Converts PDF files into plain text, without their reference section, with a chain of backends:
+    a PDF file a backend fails on (or extracts no text from) is extracted by the next backend.
+
+    Large PDF files can be split into page ranges extracted in parallel by `workers` processes
+    (threads for backends running a subprocess). Ranges are requested in order, so that ranges past
+    the trailing references section are cancelled before they start.
+    """
+    def __init__(
+            self,
+            backends: Optional[List[str]] = None,
+            workers: int = 0,
+            parallel_min_pages: int = DEFAULT_PARALLEL_MIN_PAGES,
+            pages_per_range: int = DEFAULT_PAGES_PER_RANGE,
+            early_stop: bool = True,
+            confirm_pages: int = DEFAULT_CONFIRM_PAGES):
+        self.backends: List[ExtractionBackend] = []
+        for name in backends or DEFAULT_BACKENDS:
+            backend = create_backend(name)
+            if backend.is_available():
+                self.backends.append(backend)
+            else:
+                logging.warning(f"PDF extraction backend '{name}' is not installed, and is left out of the chain")
+        if not self.backends:
+            raise ValueError(f'None of the PDF extraction backends {backends} is installed')
+        self.workers: int = workers
+        self.parallel_min_pages: int = parallel_min_pages
+        self.pages_per_range: int = max(pages_per_range, 1)
+        self.early_stop: bool = early_stop
+        self.confirm_pages: int = confirm_pages
+        self.version: str = '+'.join(backend.version() for backend in self.backends) + f'/{EXTRACTION_REVISION}'
+        if not early_stop:
+            self.version += '-full'
+
+    def __call__(self, pdf_filepath: str) -> str:
+        return self.extract(pdf_filepath)[0]
+
+    def extract(self, pdf_filepath: str) -> Tuple[str, ExtractionStats]:
+        """
+        Converts a PDF file into plain text, trying each backend of the chain in turn
+
+        :param pdf_filepath: location of PDF file
+        :return: text extracted from PDF file, and # of pages parsed and skipped by the backend that extracted it
+        """
+        result: Optional[Tuple[str, ExtractionStats]] = None
+        for backend in self.backends:
+            try:
+                result = self.__extract_with(backend, pdf_filepath)
+            except Exception as ex:
+                if backend is self.backends[-1] and result is None:
+                    raise
+                logging.warning(f'{backend.name} failed to extract {pdf_filepath}: {ex!r}')
+                continue
+            if result[0].strip():
+                break
+            logging.warning(f'{backend.name} extracted no text from {pdf_filepath}')
+
+        if result is None:
+            raise ValueError(f'No PDF extraction backend extracted {pdf_filepath}')
+        text, stats = result
+        skipped = 'an unknown # of pages' if stats.pages_skipped is None else f'{stats.pages_skipped}'
+        logging.info(f'Extracted {pdf_filepath} with {stats.backend}: {stats.pages_parsed} pages parsed, '
+                     f'{skipped} skipped after the references section')
+        return text, stats
+
+    def __extract_with(self, backend: ExtractionBackend, pdf_filepath: str) -> Tuple[str, ExtractionStats]:
+        try:
+            total_pages = backend.page_count(pdf_filepath)
+        except Exception as ex:
+            total_pages = None
+            logging.warning(f'{backend.name} cannot count the pages of {pdf_filepath}: {ex!r}')
+        if total_pages is None:
+            # Without a page count, the pages cannot be split into ranges, and are extracted in turn
+            pages = backend.iter_pages(pdf_filepath, 0, None)
+        elif self.workers > 1 and total_pages >= self.parallel_min_pages:
+            pages = self.__iter_pages_in_parallel(backend, pdf_filepath, total_pages)
+        else:
+            pages = backend.iter_pages(pdf_filepath, 0, total_pages)
+        try:
+            return collect_pdf_text(pages, total_pages, backend.name, self.early_stop, self.confirm_pages)
+        finally:
+            pages.close()
+
+    def __iter_pages_in_parallel(self, backend: ExtractionBackend, pdf_filepath: str, total_pages: int) -> Generator[str, None, None]:
+        executor_class = ThreadPoolExecutor if backend.releases_gil else ProcessPoolExecutor
+        executor = executor_class(max_workers=self.workers)
+        futures: List[Future] = [
+            executor.submit(extract_page_range, backend, pdf_filepath, first, min(first + self.pages_per_range, total_pages))
+            for first in range(0, total_pages, self.pages_per_range)]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+DEFAULT_EXTRACTOR = PdfExtractor()
+# Identifies the extraction logic of the default extractor
+EXTRACTOR_VERSION = DEFAULT_EXTRACTOR.version
+
 
 def convert_pdf_to_txt(pdf_filepath: str) -> str:
     """
-    Converts a PDF file located at the given file path into plain text
+    Converts a PDF file located at the given file path into plain text,
+    without the reference section (and the pages after it)
 
     :param pdf_filepath: location of PDF file
     :return: text extracted from PDF file
     """
-    full_text = ''
-    pdf_reader = PdfReader(pdf_filepath)
-    for page in pdf_reader.pages:
-        full_text += page.extract_text()
-
-    # Find the reference section, and remove it (if exists)
-    return __remove_reference_section(full_text)
+    return DEFAULT_EXTRACTOR(pdf_filepath)
 
 def __remove_reference_section(text_content: str) -> str:
     # Find the reference section, and remove it (if exists)
-    matching_indexes = [i.start() for i in re.finditer(r'[R|r]eferences\s*\n', text_content, re.IGNORECASE)]
+    matching_indexes = [i.start() for i in REFERENCES_HEADING_REGEX.finditer(text_content)]
     if len(matching_indexes) > 0:
         last_index = matching_indexes[-1]
         return text_content[:last_index]
     else:
         return text_content
 
+def list_pdf_files(file_configs: List[str], pdf_dirs: List[str]) -> List[str]:
+    """
+    Collects the PDF files referenced by the given publication param files and found in the given folders
+
+    :param file_configs: publication param files (xlsx, CSV or Parquet)
+    :param pdf_dirs: folders containing PDF files
+    :return: list of unique PDF file paths
+    """
+    pdf_files: List[str] = []
+    for file_config in file_configs:
+        pdf_files.extend(publication.pdf_filepath for publication in load_manifest(file_config))
+    for pdf_dir in pdf_dirs:
+        pdf_files.extend(str(path) for path in sorted(Path(pdf_dir).rglob('*.pdf')))
+
+    return list(dict.fromkeys(pdf_files))
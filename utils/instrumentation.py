@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PROFILER_CPROFILE = 'cprofile'
+PROFILER_PYINSTRUMENT = 'pyinstrument'
+PROFILERS = [PROFILER_CPROFILE, PROFILER_PYINSTRUMENT]
+DEFAULT_PROFILE_DIR = os.path.join('logs', 'profiles')
+
+# Upper bounds of the latency histogram buckets, in seconds (from a template substitution to a whole publication)
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+# Upper bounds of the completion throughput histogram buckets, in tokens per second
+THROUGHPUT_BUCKETS: List[float] = [1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300]
+# Width of the windows of the token throughput timeline, in seconds
+THROUGHPUT_WINDOW_SECONDS = 60
+PROMETHEUS_PREFIX = 'prompt_execution'
+
+
+class Histogram:
+    """
+    Distribution of observed values: bucket counts (as exported to Prometheus),
+    along with the values themselves for exact percentiles in the run summary
+    """
+    def __init__(self, buckets: List[float]):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * len(self.buckets)
+        self.values: List[float] = []
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.values.append(value)
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    def cumulative_counts(self) -> List[int]:
+        """
+        :return: # of values lower than or equal to each bucket bound
+        """
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def percentile(self, percent: float) -> float:
+        values = sorted(self.values)
+        if not values:
+            return 0.0
+        return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': max(self.values, default=0.0),
+        }
+
+
+class Span:
+    """
+    Timing span of a stage, nested in the spans open in the same thread (or in the thread it was bound from)
+    """
+    def __init__(self, name: str, publication_id: Optional[str], parent: Optional['Span']):
+        self.name: str = name
+        self.publication_id: Optional[str] = publication_id
+        self.parent: Optional['Span'] = parent
+        self.started: float = time.perf_counter()
+
+    @property
+    def path(self) -> str:
+        """
+        :return: names of the enclosing spans and of this span (e.g. 'publication/prompt/chat_completion')
+        """
+        return f'{self.parent.path}/{self.name}' if self.parent else self.name
+
+
+class Metrics:
+    """
+    Collects the timing spans of the stages of a run, along with token counts, and exports them
+    as a JSON run summary and a Prometheus text file.
+
+    Stage durations are kept in a latency histogram per stage (e.g. 'publication', 'prompt', 'extract_pdf',
+    'chat_completion') and per span path, and totalled per publication. Thread-safe: publications processed
+    concurrently each have their own span stack.
+    """
+    def __init__(self) -> None:
+        self.started: float = time.perf_counter()
+        self.stages: Dict[str, Histogram] = {}
+        self.paths: Dict[str, Histogram] = {}
+        self.publications: Dict[str, Dict[str, float]] = {}
+        self.completion_throughput: Histogram = Histogram(THROUGHPUT_BUCKETS)
+        self.counters: Dict[str, int] = {'prompts': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        # Tokens per window of the run: {window #: [prompt tokens, completion tokens]}
+        self.timeline: Dict[int, List[int]] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.local: threading.local = threading.local()
+
+    def __stack(self) -> List[Span]:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name: str, publication_id: Optional[str] = None) -> Iterator[Span]:
+        """
+        Times a stage, nested in the innermost span open in the thread
+
+        :param name: name of the stage
+        :param publication_id: publication the stage is for (by default, the one of the enclosing span)
+        """
+        stack = self.__stack()
+        parent = stack[-1] if stack else None
+        span = Span(name, publication_id or (parent.publication_id if parent else None), parent)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            # Spans of conversations interleaved in the same thread (batches) may not close in order
+            for index in range(len(stack) - 1, -1, -1):
+                if stack[index] is span:
+                    del stack[index]
+                    break
+            self.observe(span, time.perf_counter() - span.started)
+
+    def observe(self, span: Span, seconds: float) -> None:
+        with self.lock:
+            self.stages.setdefault(span.name, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.paths.setdefault(span.path, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if span.publication_id is not None:
+                stages = self.publications.setdefault(str(span.publication_id), {})
+                stages[span.name] = stages.get(span.name, 0.0) + seconds
+
+    def bind(self, function: Callable) -> Callable:
+        """
+        :return: function running with the spans currently open in this thread as enclosing spans,
+                 to be called from another thread (e.g. a thread pool)
+        """
+        parents = list(self.__stack())
+
+        def bound(*args, **kwargs):
+            stack = self.__stack()
+            saved = list(stack)
+            stack[:] = parents
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stack[:] = saved
+        return bound
+
+    def add_completion(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        Counts the tokens of a completed prompt
+        """
+        with self.lock:
+            self.counters['prompts'] += 1
+            self.counters['prompt_tokens'] += prompt_tokens
+            self.counters['completion_tokens'] += completion_tokens
+            window = int((time.perf_counter() - self.started) // THROUGHPUT_WINDOW_SECONDS)
+            tokens = self.timeline.setdefault(window, [0, 0])
+            tokens[0] += prompt_tokens
+            tokens[1] += completion_tokens
+
+    def observe_throughput(self, completion_tokens: int, seconds: float) -> None:
+        """
+        Records the throughput of a completion generated by the service (not of responses served from a cache)
+        """
+        if seconds > 0:
+            with self.lock:
+                self.completion_throughput.observe(completion_tokens / seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        :return: run summary: wall time, latency percentiles per stage and span path, time per stage of each publication,
+                 token counts and throughput over the run
+        """
+        with self.lock:
+            wall_time = time.perf_counter() - self.started
+            total_tokens = self.counters['prompt_tokens'] + self.counters['completion_tokens']
+            return {
+                'wall_time_seconds': wall_time,
+                'stages': {name: histogram.summary() for name, histogram in sorted(self.stages.items())},
+                'spans': {path: histogram.summary() for path, histogram in sorted(self.paths.items())},
+                'publications': {id: dict(stages) for id, stages in self.publications.items()},
+                'tokens': dict(self.counters, tokens_per_second=total_tokens / wall_time if wall_time else 0.0),
+                'completion_tokens_per_second': self.completion_throughput.summary(),
+                'timeline': [
+                    {'start_seconds': window * THROUGHPUT_WINDOW_SECONDS, 'prompt_tokens': tokens[0],
+                     'completion_tokens': tokens[1],
+                     # The last window is only as long as the run so far
+                     'tokens_per_second': (tokens[0] + tokens[1]) / max(min(THROUGHPUT_WINDOW_SECONDS, wall_time - window * THROUGHPUT_WINDOW_SECONDS), 1e-9)}
+                    for window, tokens in sorted(self.timeline.items())],
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        :return: metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        def histogram(name: str, description: str, histograms: List[Tuple[str, Histogram]]) -> None:
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {description}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} histogram')
+            for labels, values in histograms:
+                separator = ',' if labels else ''
+                for bound, count in zip(values.buckets, values.cumulative_counts()):
+                    lines.append(f'{PROMETHEUS_PREFIX}_{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}_bucket{{{labels}{separator}le="+Inf"}} {values.count}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}_sum{suffix} {values.sum}')
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}_count{suffix} {values.count}')
+
+        def counter(name: str, description: str, value: float) -> None:
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {description}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} counter')
+            lines.append(f'{PROMETHEUS_PREFIX}_{name} {value}')
+
+        with self.lock:
+            histogram('stage_duration_seconds', 'Duration of each stage of the processing of publications',
+                      [(f'stage="{name}"', values) for name, values in sorted(self.stages.items())])
+            histogram('completion_tokens_per_second', 'Completion tokens generated per second, per request',
+                      [('', self.completion_throughput)])
+            counter('prompts_total', 'Prompts completed', self.counters['prompts'])
+            counter('prompt_tokens_total', 'Prompt tokens sent', self.counters['prompt_tokens'])
+            counter('completion_tokens_total', 'Completion tokens received', self.counters['completion_tokens'])
+            counter('publications_total', 'Publications processed', len(self.publications))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, summary_path: str, prometheus_path: str) -> None:
+        """
+        Writes the JSON run summary and the Prometheus text file
+        """
+        with open(summary_path, 'w') as fd:
+            json.dump(self.summary(), fd, indent=2)
+        # Written then renamed, so that a Prometheus textfile collector never reads a partial file
+        tmp_path = f'{prometheus_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fd:
+            fd.write(self.to_prometheus())
+        os.replace(tmp_path, prometheus_path)
+
+    def log_summary(self) -> None:
+        """
+        Logs the total time spent in each stage, slowest first
+        """
+        summary = self.summary()
+        logging.info(f"Run wall time: {summary['wall_time_seconds']:.1f}s, "
+                     f"{summary['tokens']['tokens_per_second']:.1f} tokens/s over {summary['tokens']['prompts']} prompts")
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: item[1]['sum'], reverse=True):
+            logging.info(f"  {name:<16} {stage['sum']:9.2f}s in {stage['count']:5d} spans "
+                         f"(p50 {stage['p50']:.3f}s, p95 {stage['p95']:.3f}s, max {stage['max']:.3f}s)")
+
+
+@contextmanager
+def profile(profiler: Optional[str], profile_dir: str, name: str) -> Iterator[None]:
+    """
+    Profiles the enclosed code with cProfile (written as <name>.prof, readable with pstats or snakeviz)
+    or pyinstrument (written as <name>.html), if a profiler is given
+
+    :param profiler: cprofile, pyinstrument, or None not to profile
+    :param profile_dir: folder to write the profile to
+    :param name: name of the profile file, without extension
+    """
+    if not profiler:
+        yield
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+    file_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(name))
+    if profiler == PROFILER_PYINSTRUMENT:
+        try:
+            from pyinstrument import Profiler  # type: ignore[import-not-found]
+        except ImportError as ex:
+            raise ImportError("The pyinstrument profiler requires pyinstrument: 'pip install pyinstrument'") from ex
+        instrument = Profiler()
+        instrument.start()
+        try:
+            yield
+        finally:
+            instrument.stop()
+            path = os.path.join(profile_dir, f'{file_name}.html')
+            with open(path, 'w') as fd:
+                fd.write(instrument.output_html())
+            logging.info(f'Wrote the profile to {path}')
+    else:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+        try:
+            yield
+        finally:
+            cprofile.disable()
+            path = os.path.join(profile_dir, f'{file_name}.prof')
+            cprofile.dump_stats(path)
+            logging.info(f'Wrote the profile to {path}')
@@ -0,0 +1,118 @@
+import os
+import pickle
+import hashlib
+import logging
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from pandas import DataFrame, read_csv, read_excel, read_parquet
+
+MANIFEST_EXTENSIONS = ['.xlsx', '.csv', '.parquet']
+DEFAULT_CACHE_DIR = os.path.join('cache', 'manifests')
+# Bump whenever Publication or the parsing of manifests changes, so that cached manifests are parsed again
+CACHE_VERSION = 1
+
+
+class Publication(NamedTuple):
+    id: str
+    file_path: str
+    file_name: str
+    variant: str
+    gene: str
+    variant_aliases: str
+    expected_outcomes: str
+
+    @property
+    def pdf_filepath(self) -> str:
+        return os.path.join(self.file_path, self.file_name)
+
+    @property
+    def aliases(self) -> List[str]:
+        """
+        :return: variant aliases, split on commas
+        """
+        return [s.strip() for s in self.variant_aliases.split(',')]
+
+
+def read_manifest_file(path: str) -> List[Publication]:
+    """
+    Parses a publication param file (xlsx, CSV or Parquet). Only the columns of Publication are read;
+    missing columns and empty cells are read as empty strings.
+
+    :param path: location of the publication param file
+    :return: publications, in file order
+    """
+    ext = Path(path).suffix.lower()
+    data: DataFrame
+    if ext == '.xlsx':
+        data = read_excel(path, dtype=str)
+    elif ext == '.csv':
+        data = read_csv(path, dtype=str)
+    elif ext == '.parquet':
+        data = read_parquet(path)
+    else:
+        raise TypeError(f"Unsupported publication param file '{path}': expected one of {MANIFEST_EXTENSIONS}")
+
+    data = data.reindex(columns=list(Publication._fields)).fillna('').astype(str)
+    return [Publication(*row) for row in data.itertuples(index=False, name=None)]
+
+
+def __cache_path(cache_dir: str, path: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest() + '.pickle')
+
+
+def load_manifest(path: str, cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> List[Publication]:
+    """
+    Loads the publications of a publication param file, from the cache when the file has not changed since it was parsed
+    (same modification time and size). Parsed publications are cached as a pickle file, much faster to load than
+    parsing the file again (especially Excel files).
+
+    :param path: location of the publication param file
+    :param cache_dir: folder caching parsed publication param files (None to disable the cache)
+    :return: publications, in file order
+    """
+    if not cache_dir:
+        return read_manifest_file(path)
+
+    stat = os.stat(path)
+    key = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    cache_path = __cache_path(cache_dir, path)
+    try:
+        with open(cache_path, 'rb') as fd:
+            cached_key, publications = pickle.load(fd)
+        if cached_key == key:
+            logging.debug(f'Loaded {len(publications)} publications of {path} from the manifest cache')
+            return publications
+    except FileNotFoundError:
+        pass
+    except Exception as ex:
+        logging.warning(f'Ignoring the unreadable manifest cache of {path}: {ex}')
+
+    publications = read_manifest_file(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fd:
+        pickle.dump((key, publications), fd, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return publications
+
+
+def select_publications(
+        publications: Iterable[Publication],
+        ids: Optional[Iterable[str]] = None,
+        patterns: Optional[Iterable[str]] = None) -> Dict[str, Publication]:
+    """
+    Selects publications by id. Without any id or pattern, all publications are selected.
+
+    :param publications: publications, in processing order
+    :param ids: ids to select
+    :param patterns: glob patterns of the ids to select (e.g. 'pub-1*')
+    :return: selected publications by id, in processing order (the last one wins for duplicate ids)
+    """
+    ids = set(ids or [])
+    patterns = list(patterns or [])
+    if not ids and not patterns:
+        return {publication.id: publication for publication in publications}
+    return {
+        publication.id: publication for publication in publications
+        if publication.id in ids or any(fnmatchcase(publication.id, pattern) for pattern in patterns)}
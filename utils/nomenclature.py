@@ -1,5 +1,6 @@
-import json
-import requests
+import re
+from typing import NamedTuple
+from utils.variant_validator import VariantValidatorError, VariantValidatorClient
 
 # Instructions:
 #
@@ -15,6 +16,9 @@ import requests
 #
 # This library could be called as part of an automated pipeline, but for our study we created a spread sheet containing these variables
 # and then manually created the output and pasted the results back to the spreadsheet for access by the GPT-4 script.
+#
+# Variant Validator responses are cached on disk (cache/variant_validator.sqlite). To look up many variants at once,
+# concurrently, use get_nomenclature_variations_many([(build, transcript, cdna), ...]).
 
 # amino acid long and short forms
 longToShort = {
@@ -72,79 +76,138 @@ shortToLong = {
     'X': 'Ter',
 }
 
-# assumes input of p.A123B or p.Abc123Def format, returns list of aa variations
-def get_nomenclature_variations_aa(aa_change):
-    # set to return
-    variations = set()
+# amino acid codes, long forms first so that e.g. "Ala" is not read as "A" followed by "la"
+_AA_CODE = "(?:" + "|".join(x for x in longToShort.keys() if len(x) == 3) + "|[A-Z*])"
 
-    # add original as submitted
-    variations.add(aa_change)
+# p.A123B, p.Abc123Def, p.(Abc123Def), A123B, p.Arg79*, p.M1?, p.Ser100Leufs*24 (precompiled once)
+AA_CHANGE_REGEX = re.compile(
+    r"(?:p\.\s*)?\(?(?P<ref>" + _AA_CODE + r")(?P<pos>\d+)(?P<alt>" + _AA_CODE + r"|\?|=)"
+    r"(?P<fs>fs(?P<fs_alt>" + _AA_CODE + r")?(?P<fs_pos>\d+)?)?\)?")
 
-    # add without "p."
-    aa_nopdot = aa_change.replace("p.","")
-    variations.add(aa_nopdot)
+# c.70T>C, c.844C > T, c.1780+2T>G, c.1242_1244delCGT, c.299delC
+CDNA_CHANGE_REGEX = re.compile(
+    r"c\.\s*(?P<pos>[-*]?\d+(?:[+-]\d+)?(?:_[-*]?\d+(?:[+-]\d+)?)?)\s*"
+    r"(?:(?P<ref>[ACGT])\s*>\s*(?P<alt>[ACGT])|(?P<edit>(?:delins|del|dup|ins|inv)[ACGT]*))")
 
-    # add with parens
-    aa_parens = "(" + aa_nopdot + ")"
-    variations.add(aa_parens)
+EMPTY_PARENS_REGEX = re.compile(r"\(\s*\)")
 
-    # add with "p." and parens
-    aa_pdotparens = "p." + aa_parens
-    variations.add(aa_pdotparens)
+class AaChange(NamedTuple):
+    short: str  # e.g. C24R
+    long: str   # e.g. Cys24Arg
 
-    # deterine if short or long format (p.A123B or p.Abc123Def)
-    aa_long_first = next((x for x in longToShort.keys() if x in aa_change), None)
-    if aa_long_first == None:  # Must be short form
-        # add long aa form
-        aa_short_first = next((x for x in shortToLong.keys() if x in aa_change), None)
-        aa_short_second = next((x for x in shortToLong.keys() if x in aa_change.replace(aa_short_first,"Z")), None)
-        long_aa = aa_change.replace(aa_short_first,shortToLong[aa_short_first]).replace(aa_short_second,shortToLong[aa_short_second])
-        variations.add(long_aa)
+class CdnaChange(NamedTuple):
+    cdna: str   # e.g. c.70T>C
+    slash: str  # e.g. c.70T/C (substitutions only, empty otherwise)
 
-        # add long aa without "p."
-        long_aa_nopdot = long_aa.replace("p.","")
-        variations.add(long_aa_nopdot)
+def _short_aa(code):
+    return longToShort[code] if len(code) == 3 else code
 
-        # add long aa with parens
-        long_aa_parens = "(" + long_aa_nopdot + ")"
-        variations.add(long_aa_parens)
+def _long_aa(code):
+    return shortToLong.get(code, code) if len(code) == 1 else code
 
-        # add long aa with "p." and parens
-        long_aa_pdotparens = "p." + long_aa_parens
-        variations.add(long_aa_pdotparens)
+# parses an aa change (in short, long or mixed form), returns None if it cannot be parsed
+def parse_aa_change(aa_change):
+    match = AA_CHANGE_REGEX.fullmatch(aa_change.strip())
+    if match is None:
+        return None
+    ref, pos, alt = match.group("ref"), match.group("pos"), match.group("alt")
+    short, long = _short_aa(ref) + pos + _short_aa(alt), _long_aa(ref) + pos + _long_aa(alt)
+    if match.group("fs"):  # frameshift, e.g. Ser100Leufs*24
+        fs_alt, fs_pos = match.group("fs_alt") or "", match.group("fs_pos") or ""
+        short += "fs" + _short_aa(fs_alt) + fs_pos
+        long += "fs" + _long_aa(fs_alt) + fs_pos
+    return AaChange(short, long)
 
-    else:  # Must be long form
-        # add short aa form
-        aa_long_second = next((x for x in longToShort.keys() if x in aa_change.replace(aa_long_first,"ZZZ")), None)
-        short_aa = aa_change.replace(aa_long_first, longToShort[aa_long_first]).replace(aa_long_second,longToShort[aa_long_second])
-        variations.add(short_aa)
+# parses a cdna change, returns None if it cannot be parsed
+def parse_cdna_change(cdna):
+    match = CDNA_CHANGE_REGEX.fullmatch(cdna.strip())
+    if match is None:
+        return None
+    if match.group("edit"):
+        return CdnaChange("c." + match.group("pos") + match.group("edit"), "")
+    return CdnaChange("c." + match.group("pos") + match.group("ref") + ">" + match.group("alt"),
+                      "c." + match.group("pos") + match.group("ref") + "/" + match.group("alt"))
 
-        # add short without "p."
-        short_aa_nopdot = short_aa.replace("p.", "")
-        variations.add(short_aa_nopdot)
+# splits a variant as written in a publication param file (e.g. "c.70T>C (p.C24R)", "p.Gly17Cys (c.49G>T)",
+# "c.348G>A/p.M116I" or "C24R") into its cdna change and aa change, either of which may be None
+def parse_variant(variant):
+    cdna, aa_change = None, None
+    cdna_match = CDNA_CHANGE_REGEX.search(variant)
+    rest = variant
+    if cdna_match:
+        cdna = parse_cdna_change(cdna_match.group(0))
+        rest = variant[:cdna_match.start()] + " " + variant[cdna_match.end():]
+    # drop the parens and separators left around the cdna change
+    rest = EMPTY_PARENS_REGEX.sub(" ", rest).strip(" \t/,;")
+    if rest.startswith("(") and rest.endswith(")"):
+        rest = rest[1:-1].strip()
+    if rest:
+        aa_change = parse_aa_change(rest)
+        if aa_change is None:  # the whole variant cannot be parsed, rather than part of it silently dropped
+            return None, None
+    return cdna, aa_change
 
-        # add short with parens
-        short_aa_parens = "(" + short_aa_nopdot + ")"
-        variations.add(short_aa_parens)
+# returns the 4 ways of writing an aa change (e.g. C24R, p.C24R, (C24R), p.(C24R))
+def _aa_forms(aa):
+    return {aa, "p." + aa, "(" + aa + ")", "p.(" + aa + ")"}
 
-        # add short with "p." and parens
-        short_aa_pdotparens = "p." + short_aa_parens
-        variations.add(short_aa_pdotparens)
+# assumes input of p.A123B or p.Abc123Def format, returns list of aa variations
+def get_nomenclature_variations_aa(aa_change):
+    aa = parse_aa_change(aa_change)
+    if aa is None:
+        raise ValueError("Cannot parse amino acid change: " + aa_change)
 
+    # set to return, with the original as submitted, and the short and long forms with/without "p." and parens
+    variations = {aa_change}
+    variations.update(_aa_forms(aa.short))
+    variations.update(_aa_forms(aa.long))
     return variations
 
+# with input of a gene and variant as written in a publication param file, returns list of variations
+# derived from the notation alone (without calling Variant Validator). Raises ValueError if the variant cannot be parsed
+def get_nomenclature_variations_notation(gene, variant):
+    cdna, aa = parse_variant(variant)
+    if cdna is None and aa is None:
+        raise ValueError("Cannot parse variant: " + variant)
+
+    variations = set()
+    if aa is not None:
+        variations.update(_aa_forms(aa.short))
+        variations.update(_aa_forms(aa.long))
+        if cdna is None:
+            variations.add(aa.short + " (" + gene + ")")
+            variations.add(aa.long + " (" + gene + ")")
+    if cdna is not None:
+        # c.70T>C, 70T>C, and c.70T/C, 70T/C for substitutions
+        for form in filter(None, cdna):
+            variations.add(form)
+            variations.add(form.replace("c.", "", 1))
+        variations.add(gene + " " + cdna.cdna)
+        if aa is not None:
+            variations.add(gene + " " + cdna.cdna + " (p." + aa.long + ")")
+    return variations
+
+# shared client, created on first use: caches VariantValidator responses on disk so that each variant is fetched once
+_default_client = None
+
+def get_default_client():
+    global _default_client
+    if _default_client is None:
+        _default_client = VariantValidatorClient()
+    return _default_client
+
 # with input of genome build, gene transcript and cdna change, returns list of cdna variations
-def get_nomenclature_variations_cdna(build, transcript, cdna):
+def get_nomenclature_variations_cdna(build, transcript, cdna, client=None):
+    # get variant info from Variant Validator API (or its cache)
+    resp_dict = (client or get_default_client()).lookup(build, transcript, cdna)
+    return parse_nomenclature_variations_cdna(resp_dict, cdna)
+
+# with input of a Variant Validator response and the cdna change looked up, returns list of cdna variations
+def parse_nomenclature_variations_cdna(resp_dict, cdna):
     # set to return
-    global lrg_tlr_aa_noparen
     variations = set()
+    lrg_tlr_aa_noparen = ""
 
-    # get variant info from Variant Validator API
-    req = "https://rest.variantvalidator.org/VariantValidator/variantvalidator/"+build+"/"+transcript+":"+cdna+"/all?content-type=application/json"
-    print(req)
-    resp = requests.get(req)
-    resp_dict = resp.json()
-    json_data = json.loads(resp.text)
     root = list(resp_dict.keys())[0]
     data = resp_dict[root]
 
@@ -153,7 +216,7 @@ def get_nomenclature_variations_cdna(build, transcript, cdna):
 
     # various amino acid changes
     aachanges = data.get("hgvs_predicted_protein_consequence")
-    lrg_slr = aachanges.get("lrg_slr") # "LRG_274p1:p.(M1?)"
+    lrg_slr = aachanges.get("lrg_slr") or "" # "LRG_274p1:p.(M1?)"
     if len(lrg_slr) > 0:
         variations.add(lrg_slr)
         # p.(M1?)
@@ -169,7 +232,7 @@ def get_nomenclature_variations_cdna(build, transcript, cdna):
         lrg_slr_aa_nopdotparen = lrg_slr_aa_noparen.replace("p.","")
         variations.add(lrg_slr_aa_nopdotparen)
     # LRG_274p1:p.(Met1?)
-    lrg_tlr = aachanges.get("lrg_tlr") # "LRG_274p1:p.(Met1?)"
+    lrg_tlr = aachanges.get("lrg_tlr") or "" # "LRG_274p1:p.(Met1?)"
     if len(lrg_tlr) > 0:
         variations.add(lrg_tlr)
         # p.(Met1?)
@@ -231,3 +294,19 @@ def get_nomenclature_variations(build, gene, transcript, cdna, aa_change):
     else:
         variations = get_nomenclature_variations_cdna(build, transcript, cdna)
         return variations
+
+
+# with input of a list of (genome build, transcript, cdna change), looks up the variants concurrently
+# and returns the cdna variations of each (or the error of its lookup)
+def get_nomenclature_variations_many(queries, client=None):
+    responses = (client or get_default_client()).lookup_many(queries)
+    variations = {}
+    for query, resp_dict in responses.items():
+        if isinstance(resp_dict, VariantValidatorError):
+            variations[query] = resp_dict
+            continue
+        try:
+            variations[query] = parse_nomenclature_variations_cdna(resp_dict, query.cdna)
+        except (AttributeError, IndexError, KeyError, TypeError) as ex:
+            variations[query] = VariantValidatorError(f"Unexpected Variant Validator response for {query}: {ex!r}")
+    return variations
@@ -0,0 +1,26 @@
+import re
+from typing import List, Optional, Pattern, Tuple
+
+# Classification rules, in priority order: an answer gets the label of the first rule matching it
+RULES: List[Tuple[str, str]] = [
+    ('Assays Not Present', r'[aA]ssay\s+[\S*\s+]*not\s+[pP]resent'),
+    ('Evidence of Intermediate Function', r'[vV]ariant\s+\w*\s*[iI]ntermediate\s+[fF]unction'),
+    ('Pathogenic Evidence', r'[vV]ariant\s+\w*\s*[pP]athogenic'),
+    ('Benign Evidence', r'[vV]ariant\s+\w*\s*[bB]enign'),
+    ('Assays are Inconclusive', r'[vV]ariant\s+\w*\s*[iL]nconclusive'),
+]
+
+
+# Each rule is compiled once. A single alternation of all rules is slower to search with Python's re
+# (which can no longer skip ahead to each rule's first character), and finds the leftmost match, not the first rule.
+RULE_REGEXES: List[Pattern] = [re.compile(regex) for _, regex in RULES]
+
+
+def classify_outcome(answer: str) -> Optional[str]:
+    """
+    :return: label of the first classification rule matching the answer (None if no rule matches)
+    """
+    for (label, _), regex in zip(RULES, RULE_REGEXES):
+        if regex.search(answer):
+            return label
+    return None
@@ -0,0 +1,108 @@
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from utils import file_utils
+from utils.extraction_cache import ExtractionCache
+
+DEFAULT_LOOKAHEAD = 4
+
+
+def extract_pdf_text(
+        pdf_filepath: str,
+        cache: Optional[ExtractionCache] = None,
+        extractor: Optional[file_utils.PdfExtractor] = None) -> Tuple[str, Optional[bool]]:
+    """
+    Extracts the text of a PDF file, reading through the extraction cache if given.
+    Runs in a worker process, so it must stay a module-level function.
+
+    :param pdf_filepath: location of PDF file
+    :param cache: extraction cache (a copy of the caller's cache, as seen by the worker process)
+    :param extractor: PDF extractor used without a cache (by default, the default extractor)
+    :return: text extracted from PDF file, and whether it was a cache hit (None if no cache is used)
+    """
+    if cache is None:
+        return (extractor or file_utils.DEFAULT_EXTRACTOR)(pdf_filepath), None
+
+    hits = cache.hits
+    text = cache.get_or_extract(pdf_filepath)
+    return text, cache.hits > hits
+
+
+class PdfPrefetcher:
+    """
+    Extracts upcoming PDF files in a pool of worker processes, ahead of the publication being prompted,
+    so that CPU-bound extraction overlaps with network-bound chat completions.
+
+    PDF files are extracted in the order given, at most `lookahead` files ahead of the last requested one.
+    """
+    def __init__(
+            self,
+            pdf_filepaths: List[str],
+            workers: int,
+            lookahead: int = DEFAULT_LOOKAHEAD,
+            cache: Optional[ExtractionCache] = None,
+            extractor: Optional[file_utils.PdfExtractor] = None):
+        self.pdf_filepaths: List[str] = list(dict.fromkeys(pdf_filepaths))
+        self.positions: Dict[str, int] = {path: i for i, path in enumerate(self.pdf_filepaths)}
+        self.lookahead: int = max(lookahead, 1)
+        self.cache: Optional[ExtractionCache] = cache
+        self.extractor: Optional[file_utils.PdfExtractor] = extractor
+        self.executor: ProcessPoolExecutor = ProcessPoolExecutor(max_workers=workers)
+        self.futures: Dict[str, Future] = {}
+        self.next_position: int = 0
+        self.lock: threading.Lock = threading.Lock()
+        logging.debug(f'Prefetching PDF extraction with {workers} workers, {self.lookahead} files ahead')
+        with self.lock:
+            self.__fill(0)
+
+    def get(self, pdf_filepath: str) -> str:
+        """
+        Returns the text of the given PDF file, waiting for its extraction if still in progress
+
+        :param pdf_filepath: location of PDF file
+        :return: text extracted from PDF file
+        """
+        with self.lock:
+            future = self.futures.get(pdf_filepath)
+            if future is None:
+                # Not prefetched (unknown file, or already consumed earlier in the run)
+                future = self.executor.submit(extract_pdf_text, pdf_filepath, self.cache, self.extractor)
+                self.futures[pdf_filepath] = future
+
+            # Slide the look-ahead window past the requested file. Files may be requested out of order
+            # when publications are processed concurrently, so earlier files are left in flight.
+            position = self.positions.get(pdf_filepath)
+            if position is not None:
+                self.__fill(position + 1)
+
+        text, cache_hit = future.result()
+        with self.lock:
+            self.futures.pop(pdf_filepath, None)
+            if self.cache is not None and cache_hit is not None:
+                if cache_hit:
+                    self.cache.hits += 1
+                else:
+                    self.cache.misses += 1
+        return text
+
+    def close(self) -> None:
+        """
+        Cancels pending extractions and shuts down the worker processes
+        """
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+        self.executor.shutdown(wait=True)
+
+    def __fill(self, start: int) -> None:
+        """
+        Submits the files from the given position, until `lookahead` files are in flight
+        """
+        self.next_position = max(self.next_position, start)
+        while self.next_position < len(self.pdf_filepaths) and self.next_position < start + self.lookahead:
+            path = self.pdf_filepaths[self.next_position]
+            if path not in self.futures:
+                self.futures[path] = self.executor.submit(extract_pdf_text, path, self.cache, self.extractor)
+            self.next_position += 1
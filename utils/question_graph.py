@@ -0,0 +1,271 @@
+import re
+import logging
+from pandas import DataFrame
+from typing import Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
+from utils.outcome_rules import RULES, classify_outcome
+from utils.question_utils import (
+    KEY_QUESTION, KEY_QUESTION_ID, get_stop_condition, get_no_evidence_regexes, has_no_evidence, normalize_prompt)
+
+# Keys of a node of the question graph, besides those of a question ("id", "question", "stop_condition")
+# Whether the node is asked after the questions and answers of the nodes leading to it, or in a new conversation
+KEY_NODE_HISTORY = "history"
+# Variant the node asks about (see VARIANT_*)
+KEY_NODE_VARIANT = "variant"
+# Edges to the nodes following the node, each one taken if its condition is met by the answer
+KEY_NODE_NEXT = "next"
+KEY_EDGE_NODE = "node"
+KEY_EDGE_CONDITION = "if"
+# Keys of an edge condition: a regex the answer matches, or the label a classifier gives to the answer
+KEY_CONDITION_REGEX = "response_regex"
+KEY_CONDITION_CLASSIFIER = "classifier"
+KEY_CONDITION_LABELS = "labels"
+# If true, the edge is taken when the condition is not met
+KEY_CONDITION_NEGATE = "negate"
+
+# Target variant
+VARIANT_TARGET = 'target'
+# Longest alias of the variant found in the publication (or the target variant)
+VARIANT_LONGEST = 'longest'
+# Gene-prefixed target variant
+VARIANT_GENE = 'gene'
+# Variant of the node whose edge led to the node
+VARIANT_INHERIT = 'inherit'
+VARIANTS = [VARIANT_TARGET, VARIANT_LONGEST, VARIANT_GENE, VARIANT_INHERIT]
+
+# Classifiers of the answers: whether functional evidence was found (as per the stop condition of the node),
+# or the outcome of the answer (labels of the post processing rules)
+CLASSIFIER_EVIDENCE = 'evidence'
+CLASSIFIER_NO_EVIDENCE = 'no_evidence'
+CLASSIFIER_OUTCOME = 'outcome'
+CLASSIFIERS = [CLASSIFIER_EVIDENCE, CLASSIFIER_NO_EVIDENCE, CLASSIFIER_OUTCOME]
+
+DEFAULT_MAX_PARALLEL_NODES = 4
+
+
+class Condition(NamedTuple):
+    regex: Optional[Pattern]
+    classifier: Optional[str]
+    labels: Tuple[str, ...]
+    negate: bool
+
+    def is_met(self, answer: str, stop_condition: Optional[str]) -> bool:
+        """
+        :param answer: answer to the node
+        :param stop_condition: regex of the stop condition of the node, telling "no evidence" answers apart
+                               (required by the evidence classifiers)
+        """
+        if self.regex is not None:
+            met = self.regex.search(answer) is not None
+        elif self.classifier == CLASSIFIER_OUTCOME:
+            met = classify_outcome(answer) in self.labels
+        else:
+            # Without a stop condition, no answer tells that no evidence was found
+            no_evidence = has_no_evidence(answer, stop_condition) if stop_condition else False
+            met = no_evidence == (self.classifier == CLASSIFIER_NO_EVIDENCE)
+        return met != self.negate
+
+
+class Edge(NamedTuple):
+    target: str
+    # None if the edge is always taken
+    condition: Optional[Condition]
+
+
+class GraphNode(NamedTuple):
+    id: str
+    # Node as configured, asked as a question (with its "question" and "id")
+    question: Dict
+    variant: str
+    history: bool
+    edges: List[Edge]
+
+    @property
+    def stop_regexes(self) -> List[str]:
+        """
+        :return: regexes deciding the outcome of the node as soon as the answer matches one
+        """
+        stop_condition = get_stop_condition(self.question)
+        if not stop_condition:
+            return []
+        if any(edge.condition and edge.condition.classifier in (CLASSIFIER_EVIDENCE, CLASSIFIER_NO_EVIDENCE) for edge in self.edges):
+            return get_no_evidence_regexes(stop_condition)
+        return [stop_condition]
+
+
+def parse_condition(node_id: str, condition: Optional[Dict]) -> Optional[Condition]:
+    """
+    :param node_id: id of the node the edge starts from
+    :param condition: condition of the edge, as configured
+    :return: condition (None if the edge is always taken)
+    """
+    if condition is None:
+        return None
+    if KEY_CONDITION_REGEX in condition:
+        return Condition(re.compile(condition[KEY_CONDITION_REGEX]), None, (), bool(condition.get(KEY_CONDITION_NEGATE)))
+    classifier = condition.get(KEY_CONDITION_CLASSIFIER)
+    if classifier not in CLASSIFIERS:
+        raise ValueError(f"Invalid condition of an edge of node '{node_id}': "
+                         f"expected '{KEY_CONDITION_REGEX}', or '{KEY_CONDITION_CLASSIFIER}' among {CLASSIFIERS}")
+    labels = tuple(condition.get(KEY_CONDITION_LABELS, []))
+    unknown = [label for label in labels if label not in [label for label, _ in RULES]]
+    if unknown:
+        raise ValueError(f"Unknown outcome labels in an edge of node '{node_id}': {unknown}")
+    return Condition(None, classifier, labels, bool(condition.get(KEY_CONDITION_NEGATE)))
+
+
+class QuestionGraph:
+    """
+    Questions asked about a publication, as a directed acyclic graph: each node is a question, and each edge
+    leads to a node following it, if the answer meets the condition of the edge.
+
+    A node is asked once all the nodes leading to it are settled (asked or skipped), if the edge of at least one
+    of them was taken. Otherwise, it is skipped, and so are the nodes only it leads to. Nodes whose
+    predecessors are all settled are asked at the same time, each one in a conversation of its own: the system message,
+    followed (if it needs the history) by the questions and answers of the nodes leading to it, in the order they were answered.
+    """
+    def __init__(self, nodes: List[Dict]):
+        self.nodes: Dict[str, GraphNode] = {}
+        for item in nodes:
+            if KEY_QUESTION_ID not in item or KEY_QUESTION not in item:
+                raise ValueError(f"Each node of the question graph needs an '{KEY_QUESTION_ID}' and a '{KEY_QUESTION}': {item}")
+            node_id = str(item[KEY_QUESTION_ID])
+            if node_id in self.nodes:
+                raise ValueError(f"Duplicate node in the question graph: '{node_id}'")
+            variant = item.get(KEY_NODE_VARIANT, VARIANT_TARGET)
+            if variant not in VARIANTS:
+                raise ValueError(f"Invalid variant of node '{node_id}': '{variant}' (expected one of {VARIANTS})")
+            edges = [Edge(str(edge[KEY_EDGE_NODE]), parse_condition(node_id, edge.get(KEY_EDGE_CONDITION)))
+                     for edge in item.get(KEY_NODE_NEXT, [])]
+            if not get_stop_condition(item) and any(
+                    edge.condition and edge.condition.classifier in (CLASSIFIER_EVIDENCE, CLASSIFIER_NO_EVIDENCE) for edge in edges):
+                raise ValueError(f"Node '{node_id}' needs a stop condition, telling its \"no evidence\" answers apart for its edge conditions")
+            self.nodes[node_id] = GraphNode(node_id, item, variant, bool(item.get(KEY_NODE_HISTORY, False)), edges)
+
+        self.parents: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        for node in self.nodes.values():
+            for edge in node.edges:
+                if edge.target not in self.nodes:
+                    raise ValueError(f"Edge of node '{node.id}' to an unknown node: '{edge.target}'")
+                self.parents[edge.target].append(node.id)
+        self.order: List[str] = self.__sort_topologically()
+        # Nodes leading to each node, directly or not
+        self.ancestors: Dict[str, Set[str]] = {}
+        for node_id in self.order:
+            self.ancestors[node_id] = set(self.parents[node_id]).union(
+                *(self.ancestors[parent] for parent in self.parents[node_id]))
+
+    def __sort_topologically(self) -> List[str]:
+        remaining = {node_id: len(parents) for node_id, parents in self.parents.items()}
+        order = [node_id for node_id, count in remaining.items() if count == 0]
+        for node_id in order:
+            for edge in self.nodes[node_id].edges:
+                remaining[edge.target] -= 1
+                if remaining[edge.target] == 0:
+                    order.append(edge.target)
+        if len(order) < len(self.nodes):
+            raise ValueError(f'The question graph has a cycle through nodes {sorted(set(self.nodes) - set(order))}')
+        return order
+
+    def start(self, take_all_edges: bool = False) -> 'GraphRun':
+        """
+        :param take_all_edges: if True, every edge is taken whatever the answers (e.g. to project the cost of every node)
+        :return: run of the graph for a publication
+        """
+        return GraphRun(self, take_all_edges)
+
+    def is_complete(self, answers: Dict[str, str]) -> bool:
+        """
+        Checks whether the given answers settle every node of the graph
+
+        :param answers: answer to each node asked
+        """
+        run = self.start()
+        while True:
+            ready = run.ready()
+            if not ready:
+                return True
+            for node in ready:
+                if node.id not in answers:
+                    return False
+                run.complete(node.id, answers[node.id])
+
+    def find_completed_publications(self, results: DataFrame) -> Set[str]:
+        """
+        Determines which publications were asked every node of the graph they reached in a previous run
+
+        :param results: rows of a result file
+        :return: ids of the completed publications
+        """
+        nodes_by_prompt = {normalize_prompt(node.question[KEY_QUESTION]): node.id for node in self.nodes.values()}
+        completed = set()
+        for publication_id, rows in results.groupby(results['id'].astype(str), sort=False):
+            answers = {}
+            for prompt, answer in zip(rows['prompt'].astype(str), rows['answer']):
+                if prompt in nodes_by_prompt:
+                    answers[nodes_by_prompt[prompt]] = '' if answer is None or answer != answer else str(answer)
+            if self.is_complete(answers):
+                completed.add(publication_id)
+        return completed
+
+
+class GraphRun:
+    """
+    State of the nodes of a question graph, as they are asked about a publication
+    """
+    def __init__(self, graph: QuestionGraph, take_all_edges: bool = False):
+        self.graph: QuestionGraph = graph
+        self.take_all_edges: bool = take_all_edges
+        self.started: Set[str] = set()
+        self.skipped: Set[str] = set()
+        # Nodes answered, in the order they were answered
+        self.answered: List[str] = []
+        # Nodes whose edge to each node was taken, in the order they were answered
+        self.taken: Dict[str, List[str]] = {node_id: [] for node_id in graph.nodes}
+
+    def ready(self) -> List[GraphNode]:
+        """
+        Settles the nodes whose predecessors are all settled: they are either returned, to be asked
+        (and are considered started), or skipped
+
+        :return: nodes to ask
+        """
+        settled = self.skipped.union(self.answered)
+        ready = []
+        for node_id in self.graph.order:
+            if node_id in self.started or node_id in self.skipped:
+                continue
+            parents = self.graph.parents[node_id]
+            if not all(parent in settled for parent in parents):
+                continue
+            if parents and not self.taken[node_id]:
+                logging.info(f"Skipping node '{node_id}' of the question graph, as no edge leading to it was taken")
+                self.skipped.add(node_id)
+                settled.add(node_id)
+            else:
+                self.started.add(node_id)
+                ready.append(self.graph.nodes[node_id])
+        return ready
+
+    def complete(self, node_id: str, answer: str) -> None:
+        """
+        Records the answer to a node, and takes the edges whose condition it meets
+        """
+        self.answered.append(node_id)
+        node = self.graph.nodes[node_id]
+        stop_condition = get_stop_condition(node.question)
+        for edge in node.edges:
+            if self.take_all_edges or edge.condition is None or edge.condition.is_met(answer, stop_condition):
+                self.taken[edge.target].append(node_id)
+
+    def history(self, node_id: str) -> List[str]:
+        """
+        :return: nodes leading to the given node which were answered, in the order they were answered
+        """
+        ancestors = self.graph.ancestors[node_id]
+        return [answered for answered in self.answered if answered in ancestors]
+
+    def trigger(self, node_id: str) -> Optional[str]:
+        """
+        :return: first node answered whose edge to the given node was taken (None for a node without predecessors)
+        """
+        return self.taken[node_id][0] if self.taken[node_id] else None
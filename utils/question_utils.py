@@ -0,0 +1,104 @@
+import re
+from typing import Dict, List, Optional, Set
+from pandas import DataFrame
+from utils.manifest import Publication
+
+KEY_SYSMSG = "system_message"
+KEY_QUESTIONS = "questions"
+# Questions as a graph of nodes, each one asked depending on the answers to the nodes leading to it (see utils/question_graph.py)
+KEY_QUESTION_GRAPH = "question_graph"
+KEY_QUESTION = "question"
+KEY_QUESTION_ID = "id"
+KEY_STOP_CONDITION = "stop_condition"
+KEY_RESP_REGEX = "response_regex"
+# When publications sharing a PDF file are grouped, the paper is sent once in this message, ahead of their questions,
+# and the questions refer to it (instead of carrying it in $content)
+KEY_SHARED_CONTENT_MESSAGE = "shared_content_message"
+KEY_SHARED_CONTENT_REFERENCE = "shared_content_reference"
+DEFAULT_SHARED_CONTENT_MESSAGE = "The publication to analyze is provided below delimited by triple backticks. Publication: ```$content```"
+DEFAULT_SHARED_CONTENT_REFERENCE = "see the publication provided above"
+
+# Answer the functional evidence questions ask for when no evidence is found
+NO_EVIDENCE_ANSWER = 'assay information not present'
+
+# Answers indicating that no functional evidence was found, besides the question's own stop condition
+REGEX_NO_ANSWER = r'do\s+not\s+know\s+\w*\s*answer'
+REGEX_NOT_IN_PUB = r'not\s+[\S*\s+]*in\s+[\S*\s+]*[pP]ublication'
+
+
+def get_stop_condition(question: Dict) -> Optional[str]:
+    """
+    :return: regex of the question's stop condition (if configured)
+    """
+    if KEY_STOP_CONDITION in question and KEY_RESP_REGEX in question[KEY_STOP_CONDITION]:
+        return question[KEY_STOP_CONDITION][KEY_RESP_REGEX]
+    return None
+
+
+def get_no_evidence_regexes(regex_condition: str) -> List[str]:
+    """
+    :param regex_condition: stop condition of a functional evidence question
+    :return: regexes of the answers indicating that no functional evidence was found
+    """
+    return [regex_condition, REGEX_NO_ANSWER, REGEX_NOT_IN_PUB]
+
+
+def has_no_evidence(answer: str, regex_condition: str) -> bool:
+    """
+    Checks if an answer to a functional evidence question indicates that no evidence was found
+
+    :param answer: answer to the question
+    :param regex_condition: stop condition of the question
+    """
+    return any(re.search(regex, answer) for regex in get_no_evidence_regexes(regex_condition))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Collapses whitespaces, as done for the prompts and answers recorded in result files
+    """
+    return re.sub(r'\s+', ' ', prompt)
+
+
+def find_completed_publications(
+        results: DataFrame,
+        questions_parameters: Dict,
+        publications_parameters: Dict[str, Publication]) -> Set[str]:
+    """
+    Determines which publications finished their question chain in a previous run, i.e. whose last result is:
+    - an answer to the last question
+    - an answer satisfying the stop condition of one of the remaining questions
+    - a "no evidence" answer to the last attempt to find functional evidence (gene + variant)
+    - an answer with functional evidence, when no other question is configured
+
+    :param results: rows of a result file, in the order they were written
+    :param questions_parameters: system message and questions
+    :param publications_parameters: publication params by publication id
+    :return: ids of the completed publications
+    """
+    questions: List[Dict] = questions_parameters[KEY_QUESTIONS]
+    evidence_prompts = {normalize_prompt(question[KEY_QUESTION]): question for question in questions[:2]}
+    remaining_prompts = {normalize_prompt(question[KEY_QUESTION]): i for i, question in enumerate(questions) if i >= 2}
+
+    publications = {str(publication_id): publication for publication_id, publication in publications_parameters.items()}
+    completed = set()
+    for publication_id, rows in results.groupby(results['id'].astype(str), sort=False):
+        last = rows.iloc[-1]
+        prompt = str(last['prompt'])
+        answer = '' if last['answer'] is None or last['answer'] != last['answer'] else str(last['answer'])
+
+        if prompt in remaining_prompts:
+            index = remaining_prompts[prompt]
+            stop_condition = get_stop_condition(questions[index])
+            if index == len(questions) - 1 or (stop_condition and re.search(stop_condition, answer)):
+                completed.add(publication_id)
+        elif prompt in evidence_prompts:
+            stop_condition = get_stop_condition(evidence_prompts[prompt])
+            if stop_condition and has_no_evidence(answer, stop_condition):
+                publication = publications.get(publication_id)
+                if publication and str(last['variant']) == f"{publication.gene} {publication.variant}":
+                    completed.add(publication_id)
+            elif len(questions) <= 2:
+                completed.add(publication_id)
+
+    return completed
@@ -0,0 +1,153 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Optional, Tuple
+
+WINDOW_SECONDS = 60.0
+RETRYABLE_HTTP_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'RateLimitError', 'ServiceUnavailableError', 'Timeout', 'TryAgain', 'APIConnectionError',
+    'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'DeadlineExceeded'}
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter on the # of requests and the # of tokens sent per minute,
+    shared by all the publications processed concurrently.
+
+    Capacity is tracked over a sliding window of the last minute. A single request larger than
+    the token quota is let through once the window is empty, so that it is not blocked forever.
+    """
+    def __init__(
+            self,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            clock: Callable[[], float] = time.monotonic):
+        self.requests_per_minute: Optional[int] = requests_per_minute
+        self.tokens_per_minute: Optional[int] = tokens_per_minute
+        self.clock: Callable[[], float] = clock
+        self.window: Deque[Tuple[float, int]] = deque()
+        self.window_tokens: int = 0
+        self.paused_until: float = 0.0
+        self.condition: threading.Condition = threading.Condition()
+
+    def acquire(self, tokens: int) -> float:
+        """
+        Blocks until the request fits in the per-minute quotas, then records it
+
+        :param tokens: estimated # of tokens of the request
+        :return: # of seconds spent waiting
+        """
+        started = self.clock()
+        with self.condition:
+            while True:
+                now = self.clock()
+                self.__expire(now)
+                wait = self.__time_to_capacity(now, tokens)
+                if wait <= 0:
+                    self.window.append((now, tokens))
+                    self.window_tokens += tokens
+                    return now - started
+                self.condition.wait(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds all requests for the given # of seconds (e.g. as requested by a Retry-After header)
+        """
+        with self.condition:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            self.condition.notify_all()
+
+    def __expire(self, now: float) -> None:
+        while self.window and self.window[0][0] <= now - WINDOW_SECONDS:
+            _, tokens = self.window.popleft()
+            self.window_tokens -= tokens
+
+    def __time_to_capacity(self, now: float, tokens: int) -> float:
+        """
+        :return: # of seconds until the request fits in the quotas (0 or less if it fits now)
+        """
+        wait = self.paused_until - now
+        if not self.window:
+            return wait
+
+        oldest_expiry = self.window[0][0] + WINDOW_SECONDS - now
+        if self.requests_per_minute and len(self.window) >= self.requests_per_minute:
+            wait = max(wait, oldest_expiry)
+        if self.tokens_per_minute and self.window_tokens + tokens > self.tokens_per_minute:
+            # Wait for just enough of the oldest requests to expire
+            excess = self.window_tokens + tokens - self.tokens_per_minute
+            for timestamp, request_tokens in self.window:
+                excess -= request_tokens
+                if excess <= 0:
+                    break
+            wait = max(wait, timestamp + WINDOW_SECONDS - now)
+        return wait
+
+
+def is_retryable(ex: Exception) -> bool:
+    """
+    Determines whether a failed call is worth retrying: throttling (429), server errors (5xx),
+    timeouts and connection errors
+    """
+    http_status = getattr(ex, 'http_status', None)
+    if http_status is not None:
+        return http_status in RETRYABLE_HTTP_STATUSES
+    return type(ex).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def get_retry_after(ex: Exception) -> Optional[float]:
+    """
+    Gets the # of seconds the server asked to wait before retrying, from the Retry-After headers (if any)
+    """
+    headers = getattr(ex, 'headers', None) or {}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+        if 'Retry-After' in headers:
+            return float(headers['Retry-After'])
+    except (TypeError, ValueError):
+        pass # e.g. an HTTP date instead of a # of seconds
+    return None
+
+
+def call_with_retries(
+        call: Callable[[], Any],
+        max_retries: int,
+        limiter: Optional[RateLimiter] = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0) -> Any:
+    """
+    Calls the given function, retrying retryable errors with exponential backoff and full jitter.
+    When the server specifies a Retry-After delay, it is honoured and applied to the shared limiter
+    so that other concurrent calls hold off as well.
+
+    :param call: function to call
+    :param max_retries: maximum # of retries before giving up
+    :param limiter: rate limiter shared by concurrent calls
+    :param base_delay: backoff delay of the first retry in seconds
+    :param max_delay: maximum backoff delay in seconds
+    :return: value returned by the function
+    """
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as ex:
+            if attempt >= max_retries or not is_retryable(ex):
+                raise
+
+            retry_after = get_retry_after(ex)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, base_delay)
+                if limiter:
+                    limiter.pause(retry_after)
+            else:
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            attempt += 1
+            logging.warning(f'Retrying in {delay:.1f} seconds (attempt {attempt}/{max_retries}) after error: {ex}')
+            time.sleep(delay)
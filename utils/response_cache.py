@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+MODE_OFF = 'off'
+MODE_READ_THROUGH = 'read-through'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+MODES = [MODE_OFF, MODE_READ_THROUGH, MODE_RECORD, MODE_REPLAY]
+
+DEFAULT_CACHE_FILE = os.path.join('cache', 'responses.sqlite')
+
+
+class ResponseCacheMiss(LookupError):
+    """
+    Raised in replay mode when a request has no recorded response
+    """
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of chat completion responses stored in SQLite.
+
+    Requests are keyed by the SHA-256 of their canonical JSON form: deployment, messages and
+    sampling parameters. Modes:
+
+    - read-through: returns the cached response if any, otherwise calls the service and caches the response
+    - record: always calls the service, and caches (or overwrites) the response
+    - replay: only returns cached responses, and fails on a miss without calling the service
+
+    Entries older than `max_age_days` and, beyond `max_size_mb`, the least recently used entries are evicted.
+    """
+    def __init__(
+            self,
+            db_path: str = DEFAULT_CACHE_FILE,
+            mode: str = MODE_READ_THROUGH,
+            max_size_mb: Optional[float] = None,
+            max_age_days: Optional[float] = None):
+        if mode not in MODES or mode == MODE_OFF:
+            raise ValueError(f"Unsupported response cache mode '{mode}'")
+        self.db_path: str = db_path
+        self.mode: str = mode
+        self.max_size_bytes: Optional[int] = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds: Optional[float] = max_age_days * 24 * 3600 if max_age_days else None
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY,'
+                ' request TEXT NOT NULL,'
+                ' response TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' created REAL NOT NULL,'
+                ' last_used REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.evict()
+
+    @staticmethod
+    def key_for(request: Dict[str, Any]) -> str:
+        """
+        Builds the cache key of a request from its canonical JSON form
+
+        :param request: deployment, messages and sampling parameters of the request
+        :return: cache key
+        """
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get_or_call(
+            self,
+            request: Dict[str, Any],
+            call: Callable[[], Dict],
+            cacheable: Optional[Callable[[Dict], bool]] = None) -> Dict:
+        """
+        Returns the response to the given request as per the cache mode
+
+        :param request: deployment, messages and sampling parameters of the request
+        :param call: function calling the service with the request
+        :param cacheable: if specified, tells whether a response of the service may be cached
+                          (e.g. not an answer cut short, which is not the full response to the request)
+        :return: response from the cache or the service
+        """
+        key = self.key_for(request)
+        if self.mode != MODE_RECORD:
+            response = self.get(key)
+            if response is not None:
+                with self.lock:
+                    self.hits += 1
+                logging.debug(f'Response cache hit: {key}')
+                return response
+
+        with self.lock:
+            self.misses += 1
+        if self.mode == MODE_REPLAY:
+            raise ResponseCacheMiss(f'No recorded response for the request: key={key}')
+
+        response = call()
+        if cacheable is None or cacheable(response):
+            self.put(key, request, response)
+        else:
+            logging.debug(f'Response not cached: {key}')
+        return response
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Looks up the response cached under the given key, and marks the entry as recently used
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, request: Dict[str, Any], response: Dict) -> None:
+        """
+        Stores the response to the given request, then evicts entries if the cache is too large
+        """
+        serialized_request = json.dumps(request, ensure_ascii=False)
+        serialized_response = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, request, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, serialized_request, serialized_response, len(serialized_request) + len(serialized_response), now, now))
+        if self.max_size_bytes:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in its size limit
+
+        :return: number of entries removed
+        """
+        removed = 0
+        with self.lock, self.connection:
+            if self.max_age_seconds:
+                cursor = self.connection.execute(
+                    'DELETE FROM responses WHERE created < ?', (time.time() - self.max_age_seconds,))
+                removed += cursor.rowcount
+            if self.max_size_bytes:
+                total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+                if total_size > self.max_size_bytes:
+                    to_remove = []
+                    for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY last_used'):
+                        if total_size <= self.max_size_bytes:
+                            break
+                        to_remove.append((key,))
+                        total_size -= size
+                    self.connection.executemany('DELETE FROM responses WHERE key = ?', to_remove)
+                    removed += len(to_remove)
+
+        if removed > 0:
+            logging.debug(f'Evicted {removed} entries from the response cache')
+        return removed
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,379 @@
+import os
+import csv
+import json
+import time
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, IO, Iterator, List, Optional, Set
+from pandas import DataFrame, concat, read_csv
+
+DEFAULT_CHUNK_SIZE = 100000
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMATS = [FORMAT_CSV, FORMAT_JSONL, FORMAT_PARQUET]
+
+DEFAULT_FLUSH_EVERY_ROWS = 10
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+
+# Fields repeated on every row of a publication, stored once per publication where the format allows it
+PUBLICATION_FIELDS = ['system_message']
+
+RECORD_TYPE = 'type'
+RECORD_PUBLICATION = 'publication'
+RECORD_RESULT = 'result'
+
+
+class ResultSink(ABC):
+    """
+    Destination of prompt execution results, keeping a single open file and buffering rows.
+
+    Buffered rows are flushed (and fsync-ed, so that they survive a crash) every `flush_every_rows` rows
+    or every `flush_interval_seconds` seconds, whichever comes first, and when the sink is closed.
+    The interval is checked by a background thread too, so that rows are not left buffered while
+    no other row is written (e.g. during a long call). Writes are thread-safe.
+    """
+    def __init__(
+            self,
+            path: str,
+            columns: List[str],
+            flush_every_rows: int = DEFAULT_FLUSH_EVERY_ROWS,
+            flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.path: str = path
+        self.columns: List[str] = columns
+        self.flush_every_rows: int = max(flush_every_rows, 1)
+        self.flush_interval_seconds: float = flush_interval_seconds
+        self.pending_rows: int = 0
+        self.last_flush: float = time.monotonic()
+        self.lock: threading.RLock = threading.RLock()
+        self.closed: threading.Event = threading.Event()
+        # Started along with the first row, flushing the rows left buffered for longer than the interval
+        self.flush_thread: Optional[threading.Thread] = None
+
+    def write(self, result: Dict[str, Any]) -> None:
+        """
+        Writes a result row, flushing if the row count or time interval has been reached
+        """
+        with self.lock:
+            self._write_row(result)
+            self.pending_rows += 1
+            if (self.pending_rows >= self.flush_every_rows
+                    or time.monotonic() - self.last_flush >= self.flush_interval_seconds):
+                self.flush()
+            if self.flush_thread is None and self.flush_interval_seconds > 0:
+                self.flush_thread = threading.Thread(
+                    target=self.__flush_periodically, name='result-sink-flush', daemon=True)
+                self.flush_thread.start()
+
+    def flush(self) -> None:
+        """
+        Persists the buffered rows to disk
+        """
+        with self.lock:
+            if self.pending_rows > 0:
+                self._flush_rows()
+            self.pending_rows = 0
+            self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Flushes the buffered rows and closes the file
+        """
+        self.closed.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+        with self.lock:
+            self.flush()
+            self._close()
+
+    def __flush_periodically(self) -> None:
+        while not self.closed.wait(self.flush_interval_seconds / 2):
+            with self.lock:
+                if self.pending_rows > 0 and time.monotonic() - self.last_flush >= self.flush_interval_seconds:
+                    self.flush()
+
+    @abstractmethod
+    def _write_row(self, result: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    def _flush_rows(self) -> None:
+        pass
+
+    @abstractmethod
+    def _close(self) -> None:
+        pass
+
+
+class _TextFileResultSink(ResultSink):
+    """
+    Base of the sinks appending text lines to a file
+    """
+    def __init__(self, path: str, columns: List[str], **kwargs):
+        super().__init__(path, columns, **kwargs)
+        self.file_existed: bool = os.path.isfile(path) and os.path.getsize(path) > 0
+        self.file: IO = open(path, mode='a', newline='', encoding='utf-8')
+
+    def _flush_rows(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+
+class CsvResultSink(_TextFileResultSink):
+    """
+    Writes results as CSV rows, with a header row at the top of a new file.
+    Rows appended to an existing file follow the columns of its header.
+    """
+    def __init__(self, path: str, columns: List[str], **kwargs):
+        super().__init__(path, columns, **kwargs)
+        fieldnames = columns
+        if self.file_existed:
+            with open(path, mode='r', newline='', encoding='utf-8') as fd:
+                fieldnames = next(csv.reader(fd), []) or columns
+        self.writer: csv.DictWriter = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction='ignore')
+        if not self.file_existed:
+            self.writer.writeheader()
+            self._flush_rows()
+
+    def _write_row(self, result: Dict[str, Any]) -> None:
+        self.writer.writerow(result)
+
+
+class JsonlResultSink(_TextFileResultSink):
+    """
+    Writes results as JSON lines. Fields repeated on every row of a publication (e.g. system message)
+    are written once, in a publication record preceding the publication's first result record.
+    """
+    def __init__(self, path: str, columns: List[str], **kwargs):
+        super().__init__(path, columns, **kwargs)
+        self.publications: Dict[Any, Dict[str, Any]] = {}
+
+    def _write_row(self, result: Dict[str, Any]) -> None:
+        publication_fields = {key: result.get(key) for key in PUBLICATION_FIELDS}
+        if self.publications.get(result['id']) != publication_fields:
+            self.publications[result['id']] = publication_fields
+            self.file.write(json.dumps({RECORD_TYPE: RECORD_PUBLICATION, 'id': result['id'], **publication_fields}) + '\n')
+
+        row = {key: result.get(key) for key in self.columns if key not in PUBLICATION_FIELDS}
+        self.file.write(json.dumps({RECORD_TYPE: RECORD_RESULT, **row}) + '\n')
+
+
+class ParquetResultSink(ResultSink):
+    """
+    Writes results as a Parquet file (requires pyarrow), one row group per flush.
+    Fields repeated on every row of a publication (e.g. system message) are dictionary-encoded,
+    so that each distinct value is stored once per row group.
+
+    Parquet files cannot be appended to, so the file is (re)created when the sink is opened.
+    """
+    def __init__(self, path: str, columns: List[str], **kwargs):
+        super().__init__(path, columns, **kwargs)
+        try:
+            import pyarrow  # type: ignore[import-untyped]
+            import pyarrow.parquet  # type: ignore[import-untyped]
+        except ImportError as ex:
+            raise ImportError("The parquet result format requires pyarrow: 'pip install pyarrow'") from ex
+        self.pyarrow = pyarrow
+        self.rows: List[Dict[str, Any]] = []
+        self.writer: Optional[Any] = None
+
+    def _write_row(self, result: Dict[str, Any]) -> None:
+        self.rows.append({key: result.get(key) for key in self.columns})
+
+    def _flush_rows(self) -> None:
+        pa = self.pyarrow
+        if self.writer is None:
+            self.writer = pa.parquet.ParquetWriter(self.path, self.__infer_schema())
+
+        arrays = []
+        for field in self.writer.schema:
+            values = [self.__row_value(row, field.name, field.type) for row in self.rows]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.writer.schema))
+        self.rows = []
+
+    def __infer_schema(self) -> Any:
+        """
+        Infers the column types from the first rows: integer or floating point numbers, or strings
+        (dictionary-encoded for publication fields)
+        """
+        pa = self.pyarrow
+        fields = []
+        for column in self.columns:
+            values = [row[column] for row in self.rows if row[column] is not None]
+            if column in PUBLICATION_FIELDS:
+                column_type = pa.dictionary(pa.int32(), pa.string())
+            elif values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+                column_type = pa.int64()
+            elif values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+                column_type = pa.float64()
+            else:
+                column_type = pa.string()
+            fields.append(pa.field(column, column_type))
+        return pa.schema(fields)
+
+    def __row_value(self, row: Dict[str, Any], column: str, column_type: Any) -> Any:
+        """
+        Gets the value of a column, converted to a string unless the column is numeric
+        """
+        value = row[column]
+        if value is None or self.pyarrow.types.is_integer(column_type) or self.pyarrow.types.is_floating(column_type):
+            return value
+        return str(value)
+
+    def _close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def create_result_sink(result_format: str, path_without_extension: str, columns: List[str], **kwargs) -> ResultSink:
+    """
+    Creates a result sink of the given format
+
+    :param result_format: csv, jsonl or parquet
+    :param path_without_extension: location of the result file, without its extension
+    :param columns: result columns
+    :return: result sink
+    """
+    path = f'{path_without_extension}.{result_format}'
+    logging.debug('Setup result file: ' + path)
+    if result_format == FORMAT_CSV:
+        return CsvResultSink(path, columns, **kwargs)
+    elif result_format == FORMAT_JSONL:
+        return JsonlResultSink(path, columns, **kwargs)
+    elif result_format == FORMAT_PARQUET:
+        return ParquetResultSink(path, columns, **kwargs)
+    raise ValueError(f"Unsupported result format '{result_format}'")
+
+
+def open_result_sink(path: str, columns: List[str], **kwargs) -> ResultSink:
+    """
+    Opens a result sink appending to an existing result file (format inferred from the file extension)
+
+    :param path: location of the result file
+    :param columns: result columns
+    :return: result sink
+    """
+    path_without_extension, ext = os.path.splitext(path)
+    result_format = ext.lstrip('.')
+    if result_format == FORMAT_PARQUET:
+        raise ValueError('Parquet result files cannot be appended to; use the csv or jsonl result format')
+    return create_result_sink(result_format, path_without_extension, columns, **kwargs)
+
+
+def drop_publications(path: str, publication_ids: Set[str]) -> int:
+    """
+    Removes the rows of the given publications from a CSV or JSONL result file.
+    The file is rewritten to a temporary file first, then moved in place.
+
+    :param path: location of the result file
+    :param publication_ids: ids of the publications to remove
+    :return: # of rows removed
+    """
+    ext = os.path.splitext(path)[1].lstrip('.')
+    if ext not in [FORMAT_CSV, FORMAT_JSONL]:
+        raise ValueError(f"Cannot rewrite a result file with extension '{ext}'")
+
+    removed = 0
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as source, os.fdopen(fd, 'w', newline='', encoding='utf-8') as target:
+            if ext == FORMAT_CSV:
+                reader = csv.DictReader(source)
+                writer = csv.DictWriter(target, fieldnames=reader.fieldnames or [])
+                writer.writeheader()
+                for row in reader:
+                    if row.get('id') in publication_ids:
+                        removed += 1
+                    else:
+                        writer.writerow(row)
+            else:
+                for line in source:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # Truncated by a crash
+                    if str(record.get('id')) in publication_ids:
+                        removed += record.get(RECORD_TYPE) != RECORD_PUBLICATION
+                    else:
+                        target.write(line)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return removed
+
+
+def iter_results(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[DataFrame]:
+    """
+    Reads a result file written by a result sink in chunks of rows, so that large files are read with bounded memory
+
+    :param path: location of the result file
+    :param chunk_size: maximum # of rows per chunk
+    :return: chunks of result rows, with publication fields re-attached to every row
+    """
+    ext = os.path.splitext(path)[1].lstrip('.')
+    if ext == FORMAT_CSV:
+        yield from read_csv(path, chunksize=chunk_size)
+    elif ext == FORMAT_JSONL:
+        rows = []
+        publications: Dict[Any, Dict[str, Any]] = {}
+        with open(path, 'r', encoding='utf-8') as fd:
+            for line in fd:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning(f'Ignoring a truncated line in {path}')
+                    continue
+                if record.pop(RECORD_TYPE, RECORD_RESULT) == RECORD_PUBLICATION:
+                    publications[record['id']] = record
+                    continue
+                rows.append({**publications.get(record.get('id'), {}), **record})
+                if len(rows) >= chunk_size:
+                    yield DataFrame(rows)
+                    rows = []
+        if rows:
+            yield DataFrame(rows)
+    elif ext == FORMAT_PARQUET:
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            data = batch.to_pandas()
+            for column in PUBLICATION_FIELDS:
+                if column in data and hasattr(data[column], 'cat'):
+                    data[column] = data[column].astype(object)
+            yield data
+    else:
+        raise ValueError(f"Unsupported result file extension '{ext}'")
+
+
+def read_results(path: str, columns: Optional[List[str]] = None) -> DataFrame:
+    """
+    Reads a result file written by a result sink (format inferred from the file extension)
+
+    :param path: location of the result file
+    :param columns: if specified, columns to return (missing ones are filled with None)
+    :return: result rows, with publication fields re-attached to every row
+    """
+    chunks = list(iter_results(path))
+    data = concat(chunks, ignore_index=True) if chunks else DataFrame()
+
+    if columns:
+        for column in columns:
+            if column not in data:
+                data[column] = None
+        data = data[columns]
+    return data
@@ -0,0 +1,180 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+# Normalization steps, each one removing a kind of noise from the text extracted from a PDF file
+# Words broken across lines with a hyphen ("func-\ntional")
+STEP_DEHYPHENATE = 'dehyphenate'
+# Runs of spaces and tabs, trailing spaces, and runs of blank lines
+STEP_WHITESPACE = 'whitespace'
+# Running headers and footers, and page numbers, repeated on every page
+STEP_HEADERS = 'headers'
+# Text extracted from figures: lines of evenly spaced axis ticks, and lone panel letters
+STEP_FIGURE_NOISE = 'figure_noise'
+# Acknowledgements, funding, conflicts of interest, author contributions and supplementary material sections
+STEP_BOILERPLATE = 'boilerplate'
+STEPS = [STEP_DEHYPHENATE, STEP_WHITESPACE, STEP_HEADERS, STEP_FIGURE_NOISE, STEP_BOILERPLATE]
+DEFAULT_STEPS = STEPS
+
+# A line is a running header or footer if it appears (digits aside) at least this # of times...
+DEFAULT_MIN_REPEATS = 3
+# ... at least this # of lines apart on average (rows of a table repeat too, but next to each other)
+MIN_LINES_BETWEEN_REPEATS = 15
+MAX_HEADER_CHARS = 120
+# Axis ticks are at least this # of evenly spaced integers (e.g. "0 20 40 60 80"), fewer being likely a table row
+MIN_AXIS_TICKS = 4
+
+DIGITS_REGEX = re.compile(r'\d+')
+BLANKS_REGEX = re.compile(r'[^\S\n]+')
+COMPOUND_REGEX = re.compile(r'\b[A-Za-z]+-[A-Za-z]+\b')
+HYPHEN_END_REGEX = re.compile(r'([A-Za-z]+)-$')
+WORD_START_REGEX = re.compile(r'^([a-z]+)')
+# Lines of integers only (lines with decimals, ± or % are values of a table, and are kept)
+AXIS_TICKS_REGEX = re.compile(r'^-?\d+(?:\s+-?\d+)+$')
+# Lines made of a single panel letter, e.g. "A", "(B)", "C."
+PANEL_LETTER_REGEX = re.compile(r'^\(?[A-Za-z]\)?\.?$')
+# A boilerplate paragraph ends with the line ending a sentence
+SENTENCE_END_REGEX = re.compile(r'[.!?]["\')\]]*$')
+BOILERPLATE_HEADING_REGEX = re.compile(
+    r'^(?:\d+\.?\s*)?(?:acknowledge?ments?|funding(?: information| sources?)?|financial support|'
+    r'conflicts? of interests?|competing interests?|declaration of interests?|disclosures?|'
+    r"author contributions?|authors' contributions|data availability(?: statement)?|ethics (?:statement|approval)|"
+    r'supplementary (?:materials?|data|information|figures?|tables?)|supporting information)'
+    r'\b\s*(?:[:.]\s*\S.*)?$', re.IGNORECASE)
+SECTION_HEADING_REGEX = re.compile(
+    r'^(?:\d+\.?\s*)?(?:abstract|introduction|background|(?:(?:materials|patients|subjects) and )?methods|results|'
+    r'discussion|conclusions?|references|figure legends)\s*:?$'
+    r'|^(?:fig(?:ure)?\.?|table)\s*\d', re.IGNORECASE)
+
+
+class TextNormalization(NamedTuple):
+    text: str
+    original_chars: int
+    normalized_chars: int
+    # # of characters removed by each step
+    removed: Dict[str, int]
+
+
+def __line_key(line: str) -> str:
+    # Running headers and footers differ only by their page number
+    return DIGITS_REGEX.sub('#', BLANKS_REGEX.sub(' ', line.lower()))
+
+
+def __is_header_key(key: str) -> bool:
+    if ' ' in key:
+        return True
+    # A single word is a header if it is a page number, or has no digits (e.g. "ARTICLE"),
+    # so that lines made of a variant alone (e.g. "c.70T>C") are never taken for headers
+    return '#' not in key or not re.search(r'[a-z]', key)
+
+
+def is_figure_noise(line: str) -> bool:
+    """
+    :param line: stripped line
+    :return: whether the line is text extracted from a figure: evenly spaced axis ticks, or a lone panel letter
+    """
+    if PANEL_LETTER_REGEX.match(line):
+        return True
+    if not AXIS_TICKS_REGEX.match(line):
+        return False
+    ticks = [int(tick) for tick in line.split()]
+    steps = {second - first for first, second in zip(ticks, ticks[1:])}
+    return len(ticks) >= MIN_AXIS_TICKS and len(steps) == 1 and 0 not in steps
+
+
+def find_repeated_lines(lines: List[str], min_repeats: int = DEFAULT_MIN_REPEATS) -> Set[str]:
+    """
+    Finds the running headers and footers, and page numbers, of a text: short lines repeated (digits aside)
+    at least `min_repeats` times across the text
+
+    :param lines: lines of the text
+    :param min_repeats: minimum # of occurrences of a header or footer
+    :return: keys of the repeated lines (see __line_key)
+    """
+    counts: Dict[str, List[int]] = {}
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if line and len(line) <= MAX_HEADER_CHARS:
+            # [count, first line, last line]
+            occurrences = counts.setdefault(__line_key(line), [0, i, i])
+            occurrences[0] += 1
+            occurrences[2] = i
+    return {
+        key for key, (count, first, last) in counts.items()
+        if count >= min_repeats and (last - first) / (count - 1) >= MIN_LINES_BETWEEN_REPEATS and __is_header_key(key)
+    }
+
+
+def normalize_text(
+        text: str,
+        steps: Optional[Iterable[str]] = None,
+        min_repeats: int = DEFAULT_MIN_REPEATS) -> TextNormalization:
+    """
+    Removes the noise of the text extracted from a PDF file, so that fewer tokens are sent with each prompt.
+
+    Repeated lines and hyphenated compounds are first counted, then lines are kept, rewritten or dropped
+    in a single pass: a word broken across a page is joined again once the footer and header between
+    its halves are dropped. A word broken with a hyphen is joined without it, unless the hyphenated
+    compound appears elsewhere in the text (e.g. "wild-type").
+
+    :param text: text extracted from a PDF file
+    :param steps: normalization steps to apply (by default, all of them)
+    :param min_repeats: minimum # of occurrences of a running header or footer
+    :return: normalized text, along with the # of characters removed by each step
+    """
+    steps = set(DEFAULT_STEPS if steps is None else steps)
+    lines = text.split('\n')
+    repeated = find_repeated_lines(lines, min_repeats) if STEP_HEADERS in steps else set()
+    compounds = {compound.lower() for compound in COMPOUND_REGEX.findall(text)} if STEP_DEHYPHENATE in steps else set()
+
+    removed = {step: 0 for step in STEPS}
+    output: List[str] = []
+    # Whether the line continues the paragraph of a boilerplate section being dropped
+    boilerplate = False
+    for line in lines:
+        stripped = line.strip()
+
+        if boilerplate and stripped and not SECTION_HEADING_REGEX.match(stripped):
+            boilerplate = not SENTENCE_END_REGEX.search(stripped)
+            removed[STEP_BOILERPLATE] += len(line) + 1
+            continue
+        if STEP_BOILERPLATE in steps and stripped and BOILERPLATE_HEADING_REGEX.match(stripped):
+            # The section is dropped up to the end of the paragraph starting with its heading
+            boilerplate = not SENTENCE_END_REGEX.search(stripped)
+            removed[STEP_BOILERPLATE] += len(line) + 1
+            continue
+        boilerplate = False
+        if stripped and __line_key(stripped) in repeated:
+            removed[STEP_HEADERS] += len(line) + 1
+            continue
+        if STEP_FIGURE_NOISE in steps and stripped and is_figure_noise(stripped):
+            removed[STEP_FIGURE_NOISE] += len(line) + 1
+            continue
+
+        if STEP_WHITESPACE in steps:
+            normalized = BLANKS_REGEX.sub(' ', stripped)
+            if not normalized and (not output or not output[-1]):
+                removed[STEP_WHITESPACE] += len(line) + 1
+                continue
+            removed[STEP_WHITESPACE] += len(line) - len(normalized)
+            line = normalized
+
+        if STEP_DEHYPHENATE in steps and output:
+            head = HYPHEN_END_REGEX.search(output[-1].rstrip())
+            tail = WORD_START_REGEX.match(line.lstrip())
+            if head and tail:
+                joined_chars = len(output[-1]) + 1 + len(line)
+                previous = output[-1].rstrip()
+                if f'{head.group(1)}-{tail.group(1)}'.lower() in compounds:
+                    output[-1] = previous + line.lstrip()
+                else:
+                    output[-1] = previous[:-1] + line.lstrip()
+                removed[STEP_DEHYPHENATE] += joined_chars - len(output[-1])
+                continue
+        output.append(line)
+
+    if STEP_WHITESPACE in steps:
+        while output and not output[-1]:
+            output.pop()
+            removed[STEP_WHITESPACE] += 1
+    normalized_text = '\n'.join(output)
+    return TextNormalization(normalized_text, len(text), len(normalized_text), removed)
@@ -0,0 +1,218 @@
+import json
+import math
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+try:
+    import tiktoken  # type: ignore[import-not-found]
+except ImportError:
+    tiktoken = None
+
+DEFAULT_DEPLOYMENT_CONFIG = 'configs/deployments.json'
+DEFAULT_DEPLOYMENT = 'default'
+
+# Tokens added by the chat format to every message, and to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+FALLBACK_ENCODING = 'cl100k_base'
+TRIM_MARKER = '\n[...]'
+
+POLICY_TRIM = 'trim'
+POLICY_WINDOW = 'window'
+POLICY_SKIP = 'skip'
+POLICIES = [POLICY_TRIM, POLICY_WINDOW, POLICY_SKIP]
+
+
+class ContextLimitExceeded(ValueError):
+    """
+    Raised when a request does not fit in the context window of the deployment
+    """
+    def __init__(self, tokens: int, budget: int):
+        super().__init__(f'Request of {tokens} tokens exceeds the prompt budget of {budget} tokens')
+        self.tokens: int = tokens
+        self.budget: int = budget
+
+
+class Deployment(NamedTuple):
+    name: str
+    model: str
+    context_limit: int
+    prompt_cost_per_1k: float
+    completion_cost_per_1k: float
+    latency_seconds: float
+    completion_tokens_per_second: float
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        :return: cost of a request in USD
+        """
+        return self.prompt_cost_per_1k * (prompt_tokens / 1000) + self.completion_cost_per_1k * (completion_tokens / 1000)
+
+    def duration(self, completion_tokens: int) -> float:
+        """
+        :return: expected # of seconds to complete a request
+        """
+        return self.latency_seconds + completion_tokens / self.completion_tokens_per_second
+
+
+def load_deployment(config_path: str, name: Optional[str]) -> Deployment:
+    """
+    Reads the model, context limit, pricing and throughput of a GPT deployment from the deployment config file,
+    falling back to its "default" entry for deployments not listed
+
+    :param config_path: location of the deployment config file (JSON)
+    :param name: name of the Azure OpenAI deployment
+    :return: deployment
+    """
+    with open(config_path, 'r') as fd:
+        data: Dict[str, Dict[str, Any]] = json.load(fd)
+
+    if name in data:
+        params = data[name]
+    else:
+        logging.warning(f"Deployment '{name}' not found in {config_path}, using the '{DEFAULT_DEPLOYMENT}' entry")
+        params = data[DEFAULT_DEPLOYMENT]
+    return Deployment(name=name or DEFAULT_DEPLOYMENT, **params)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Optional[Any]:
+    """
+    :return: tokenizer of the model (None if tiktoken is not installed, tokens being estimated as 4 characters each)
+    """
+    if tiktoken is None:
+        logging.warning(f'tiktoken is not installed: the tokens of {model} are estimated as 4 characters each '
+                        f'(pip install -r requirements.txt)')
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text: str, model: str) -> int:
+    """
+    Counts the tokens of a text with the tokenizer of the model (requires tiktoken),
+    or estimates them as 4 characters per token otherwise
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict], model: str) -> int:
+    """
+    Counts the prompt tokens of a chat completion request
+    """
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message['role'], model) + count_tokens(message['content'], model)
+        for message in messages) + TOKENS_PER_REPLY
+
+
+def truncate_text(text: str, max_tokens: int, model: str) -> str:
+    """
+    Truncates a text to at most the given # of tokens, cutting at its end
+    """
+    if max_tokens <= 0:
+        return ''
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def fit_messages(
+        messages: List[Dict],
+        budget: int,
+        policy: str,
+        model: str,
+        trimmable: Optional[str] = None) -> List[Dict]:
+    """
+    Fits a chat completion request in the prompt budget of the deployment (context limit - max tokens in response)
+
+    - trim: cuts the end of the trimmable text (e.g. publication) in the messages where it appears
+    - window: drops the oldest exchanges after the system message, then trims if the latest prompt still does not fit
+    - skip: raises ContextLimitExceeded
+
+    :param messages: system message, chat history and new prompt
+    :param budget: maximum # of prompt tokens
+    :param policy: trim, window or skip
+    :param model: model whose tokenizer is used
+    :param trimmable: text that can be cut to fit (the publication)
+    :return: messages to send (the given messages are not modified)
+    """
+    tokens = count_message_tokens(messages, model)
+    if tokens <= budget:
+        return messages
+    if policy == POLICY_SKIP:
+        raise ContextLimitExceeded(tokens, budget)
+
+    if policy == POLICY_WINDOW and len(messages) > 2:
+        kept = [messages[-1]]
+        for message in reversed(messages[1:-1]):
+            if count_message_tokens([messages[0], message] + kept, model) > budget:
+                break
+            kept.insert(0, message)
+        # Never start the history with an answer
+        while len(kept) > 1 and kept[0]['role'] == 'assistant':
+            kept.pop(0)
+        messages = [messages[0]] + kept
+        tokens = count_message_tokens(messages, model)
+        if tokens <= budget:
+            return messages
+
+    excess = tokens - budget
+    if trimmable and excess > 0:
+        occurrences = sum(message['content'].count(trimmable) for message in messages)
+        if occurrences:
+            # Trimming a token may save less than a token once merged with its neighbours, hence the margin
+            keep = count_tokens(trimmable, model) - math.ceil(excess / occurrences) - count_tokens(TRIM_MARKER, model) - 8
+            trimmed = truncate_text(trimmable, keep, model) + TRIM_MARKER
+            messages = [
+                {**message, 'content': message['content'].replace(trimmable, trimmed)} for message in messages]
+            tokens = count_message_tokens(messages, model)
+            if tokens <= budget:
+                return messages
+    raise ContextLimitExceeded(tokens, budget)
+
+
+class UsageProjection:
+    """
+    Accumulates the projected tokens, cost and duration of the requests of a dry run
+    """
+    def __init__(self, deployment: Deployment):
+        self.deployment: Deployment = deployment
+        self.requests: int = 0
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.cost: float = 0.0
+        self.seconds: float = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += self.deployment.cost(prompt_tokens, completion_tokens)
+        self.seconds += self.deployment.duration(completion_tokens)
+
+    def wall_time(
+            self,
+            concurrency: int = 1,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None) -> float:
+        """
+        Projects the wall time of a run: requests spread across concurrent publications,
+        but no faster than the rate limits allow
+
+        :return: # of seconds
+        """
+        seconds = self.seconds / max(concurrency, 1)
+        if requests_per_minute:
+            seconds = max(seconds, 60 * self.requests / requests_per_minute)
+        if tokens_per_minute:
+            seconds = max(seconds, 60 * (self.prompt_tokens + self.completion_tokens) / tokens_per_minute)
+        return seconds
@@ -0,0 +1,267 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from utils import file_utils
+from utils.extraction_cache import ExtractionCache, hash_file
+
+DEFAULT_INDEX_FILE = os.path.join('cache', 'variant_index.sqlite')
+
+# Revision of the tokenization: documents indexed with another revision are indexed again
+INDEX_REVISION = 3
+# Tokens are separated by whitespace, list punctuation, quotes, brackets, parentheses, slashes and hyphens, so that
+# variants written together (e.g. 'c.70T>C/p.Cys24Arg', '(c.70T>C)' or 'c.70T>C-induced') are found under each of
+# their aliases. Aliases are split the same way, and their tokens matched as phrases (e.g. 'p.(Met1?)' as 'p.'
+# followed by 'Met1?', or 'c.123-2A>G' as 'c.123' followed by '2A>G').
+TOKEN_REGEX = re.compile(r'[^\s,;\[\](){}/"\'“”‘’\-‐–]+')
+EDGE_PUNCTUATION = '.,;:'
+GENE_SYMBOL_REGEX = re.compile(r'[A-Z][A-Z0-9-]{1,9}')
+# HGVS reference sequence prefix (e.g. 'NM_000527.5:') and coordinate type prefix (e.g. 'c.', 'p.')
+REFERENCE_PREFIX_REGEX = re.compile(r'^[^:]+:')
+COORDINATE_PREFIX_REGEX = re.compile(r'^[cgmnopr]\.')
+
+
+class Posting(NamedTuple):
+    path: str
+    position: int
+    offset: int
+
+
+def normalize_term(token: str) -> str:
+    """
+    Normalizes a token for indexing and querying: lower-cased, without punctuation at its edges
+    (e.g. 'p.Met1?.' -> 'p.met1?')
+    """
+    return token.strip(EDGE_PUNCTUATION).lower()
+
+
+def is_indexed_token(token: str) -> bool:
+    """
+    Determines whether a token is worth indexing: variant-like tokens (containing a digit)
+    and gene-symbol-like tokens (upper-case letters and digits, e.g. LDLR)
+    """
+    return any(c.isdigit() for c in token) or GENE_SYMBOL_REGEX.fullmatch(token.strip(EDGE_PUNCTUATION)) is not None
+
+
+def expand_term(term: str) -> List[str]:
+    """
+    Expands a normalized term into the shorter forms it is also mentioned as, so that e.g.
+    'np_000518.1:p.m1?' is also found when looking up 'p.M1?' or 'M1?'
+    """
+    terms = [term]
+    without_reference = REFERENCE_PREFIX_REGEX.sub('', term)
+    if without_reference and without_reference != term:
+        terms.append(without_reference)
+    without_coordinate = COORDINATE_PREFIX_REGEX.sub('', without_reference)
+    if without_coordinate and without_coordinate != without_reference:
+        terms.append(without_coordinate)
+    return terms
+
+
+def tokenize(text: str, expand: bool = False) -> Iterator[Tuple[int, int, str]]:
+    """
+    Splits a text into tokens worth indexing
+
+    :param text: text to split
+    :param expand: if True, also yields the shorter forms of each term at the same position
+    :return: (position, offset, normalized term) of each token, where position counts all tokens
+    """
+    for position, match in enumerate(TOKEN_REGEX.finditer(text)):
+        token = match.group()
+        if is_indexed_token(token):
+            term = normalize_term(token)
+            if term:
+                for expanded_term in (expand_term(term) if expand else [term]):
+                    yield position, match.start(), expanded_term
+
+
+class VariantIndex:
+    """
+    Persistent inverted index of variant and gene mentions across PDF files, stored in SQLite.
+
+    Postings map each normalized term to (PDF file, token position, character offset). Terms are also
+    indexed without their reference sequence and coordinate type prefixes (e.g. 'NP_000518.1:p.' in
+    'NP_000518.1:p.(M1?)'), so that the shorter aliases of a variant are found as well.
+    Multi-token aliases (e.g. 'LDLR c.1A>C') are matched as phrases, using token positions.
+    Documents are re-indexed only when their size, modification time or extractor version changes
+    (or when the index was built with another revision of the tokenization).
+    """
+    def __init__(self, index_path: str = DEFAULT_INDEX_FILE, extraction_cache: Optional[ExtractionCache] = None):
+        self.index_path: str = index_path
+        self.extraction_cache: Optional[ExtractionCache] = extraction_cache
+        self.lock: threading.Lock = threading.Lock()
+
+        index_dir = os.path.dirname(index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(index_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS documents ('
+                ' id INTEGER PRIMARY KEY,'
+                ' path TEXT NOT NULL UNIQUE,'
+                ' sha256 TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' mtime REAL NOT NULL,'
+                ' extractor_version TEXT NOT NULL,'
+                ' indexed_at REAL NOT NULL)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS postings ('
+                ' term TEXT NOT NULL,'
+                ' document_id INTEGER NOT NULL,'
+                ' position INTEGER NOT NULL,'
+                ' offset INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS postings_term ON postings (term)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS postings_document ON postings (document_id)')
+            revision = self.connection.execute('PRAGMA user_version').fetchone()[0]
+            if revision != INDEX_REVISION:
+                logging.info(f'Variant index {index_path} built with tokenization revision {revision}: documents will be indexed again')
+                self.connection.execute('DELETE FROM postings')
+                self.connection.execute('DELETE FROM documents')
+                self.connection.execute(f'PRAGMA user_version = {INDEX_REVISION}')
+
+    def update(self, pdf_filepaths: Iterable[str], prune: bool = False) -> Dict[str, int]:
+        """
+        Indexes the given PDF files, skipping those unchanged since they were last indexed
+
+        :param pdf_filepaths: locations of PDF files
+        :param prune: if True, removes documents that are no longer among the given files
+        :return: # of documents indexed, unchanged, failed and removed
+        """
+        stats = {'indexed': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+        pdf_filepaths = [os.path.normpath(path) for path in dict.fromkeys(pdf_filepaths)]
+        for pdf_filepath in pdf_filepaths:
+            try:
+                if self.__update_document(pdf_filepath):
+                    stats['indexed'] += 1
+                else:
+                    stats['unchanged'] += 1
+            except Exception as ex:
+                logging.error(f'Failed to index {pdf_filepath}: {ex}')
+                stats['failed'] += 1
+
+        if prune:
+            known = set(pdf_filepaths)
+            for path in self.documents():
+                if path not in known:
+                    self.remove(path)
+                    stats['removed'] += 1
+        return stats
+
+    def remove(self, pdf_filepath: str) -> None:
+        """
+        Removes a document and its postings from the index
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT id FROM documents WHERE path = ?', (pdf_filepath,)).fetchone()
+            if row:
+                self.connection.execute('DELETE FROM postings WHERE document_id = ?', (row[0],))
+                self.connection.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+
+    def documents(self) -> List[str]:
+        """
+        :return: locations of the indexed PDF files
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT path FROM documents ORDER BY path')]
+
+    def is_indexed(self, pdf_filepath: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM documents WHERE path = ?', (os.path.normpath(pdf_filepath),)).fetchone()
+        return row is not None
+
+    def query(self, alias: str, pdf_filepath: Optional[str] = None) -> List[Posting]:
+        """
+        Finds the mentions of a variant alias or gene symbol
+
+        :param alias: variant alias or gene symbol (several tokens are matched as a phrase)
+        :param pdf_filepath: if specified, only searches this PDF file
+        :return: postings of the first token of each mention
+        """
+        terms = [(position, term) for position, _, term in tokenize(alias)]
+        if not terms:
+            return []
+
+        # Look up the postings of each token, then keep the mentions where all tokens
+        # appear at the same relative positions as in the alias
+        postings_per_term = [self.__postings(term, pdf_filepath) for _, term in terms]
+        first_position = terms[0][0]
+        candidates = postings_per_term[0]
+        for (position, _), postings in zip(terms[1:], postings_per_term[1:]):
+            shift = position - first_position
+            positions = {(posting.path, posting.position - shift) for posting in postings}
+            candidates = [posting for posting in candidates if (posting.path, posting.position) in positions]
+        return candidates
+
+    def count_mentions(self, aliases: Iterable[str], pdf_filepath: Optional[str] = None) -> Dict[str, int]:
+        """
+        Counts the mentions of any of the given aliases per PDF file
+
+        :param aliases: variant and its nomenclature aliases
+        :param pdf_filepath: if specified, only searches this PDF file
+        :return: # of mentions per PDF file (files without a mention are omitted)
+        """
+        offsets = defaultdict(set)
+        for alias in dict.fromkeys(aliases):
+            for posting in self.query(alias, pdf_filepath):
+                offsets[posting.path].add(posting.offset)
+        return {path: len(path_offsets) for path, path_offsets in offsets.items()}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def __postings(self, term: str, pdf_filepath: Optional[str]) -> List[Posting]:
+        sql = ('SELECT documents.path, postings.position, postings.offset FROM postings'
+               ' JOIN documents ON documents.id = postings.document_id WHERE postings.term = ?')
+        params: Tuple = (term,)
+        if pdf_filepath:
+            sql += ' AND documents.path = ?'
+            params = (term, os.path.normpath(pdf_filepath))
+        with self.lock:
+            return [Posting(*row) for row in self.connection.execute(sql, params)]
+
+    def __update_document(self, pdf_filepath: str) -> bool:
+        """
+        (Re-)indexes a PDF file if it changed since it was last indexed
+
+        :return: True if the document was (re-)indexed
+        """
+        stat = os.stat(pdf_filepath)
+        extractor_version = self.extraction_cache.extractor_version if self.extraction_cache else file_utils.EXTRACTOR_VERSION
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT id, sha256, size, mtime, extractor_version FROM documents WHERE path = ?', (pdf_filepath,)).fetchone()
+        if row and row[2] == stat.st_size and row[3] == stat.st_mtime and row[4] == extractor_version:
+            return False
+
+        content_hash = hash_file(pdf_filepath)
+        if row and row[1] == content_hash and row[4] == extractor_version:
+            # Touched but not modified
+            with self.lock, self.connection:
+                self.connection.execute('UPDATE documents SET mtime = ? WHERE id = ?', (stat.st_mtime, row[0]))
+            return False
+
+        logging.info(f'Indexing {pdf_filepath}')
+        if self.extraction_cache:
+            text = self.extraction_cache.get_or_extract(pdf_filepath)
+        else:
+            text = file_utils.convert_pdf_to_txt(pdf_filepath)
+
+        with self.lock, self.connection:
+            if row:
+                self.connection.execute('DELETE FROM postings WHERE document_id = ?', (row[0],))
+                self.connection.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+            cursor = self.connection.execute(
+                'INSERT INTO documents (path, sha256, size, mtime, extractor_version, indexed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (pdf_filepath, content_hash, stat.st_size, stat.st_mtime, extractor_version, time.time()))
+            document_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO postings (term, document_id, position, offset) VALUES (?, ?, ?, ?)',
+                ((term, document_id, position, offset) for position, offset, term in tokenize(text, expand=True)))
+        return True
@@ -1,5 +1,122 @@
-import re
-from typing import List, Optional
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class AliasMatch(NamedTuple):
+    alias: str
+    start: int
+    end: int
+
+
+class AliasScan(NamedTuple):
+    matches: List[AliasMatch]
+    counts: Dict[str, int]
+    longest: Optional[str]
+
+
+def lower_preserving_offsets(text: str) -> str:
+    """
+    Lower-cases a text while keeping every character at the same offset.
+    A few characters (e.g. 'İ') lower-case into several characters; only the first one is kept.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c.lower()[0] if c.lower() else c for c in text)
+
+
+class AliasMatcher:
+    """
+    Case-insensitive literal matcher of many variant aliases at once (Aho-Corasick automaton).
+
+    The automaton is built once per alias set, then scans a text in a single pass regardless of
+    the # of aliases, reporting every occurrence of every alias (including overlapping ones).
+    Aliases are matched literally, so characters such as '?', '(' or '.' have no special meaning.
+    """
+    def __init__(self, aliases: Iterable[str]):
+        # Aliases in input order, without duplicates and empty strings
+        self.aliases: List[str] = [alias for alias in dict.fromkeys(aliases) if alias]
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Aliases ending at each state, including those reached through failure links
+        self.output: List[List[int]] = [[]]
+
+        for index, alias in enumerate(self.aliases):
+            state = 0
+            for char in lower_preserving_offsets(alias):
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(index)
+
+        # Breadth-first computation of the failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find_all(self, text: str) -> List[AliasMatch]:
+        """
+        Finds all occurrences of the aliases in the text
+
+        :param text: text to search
+        :return: list of matches ordered by end offset
+        """
+        matches = []
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for position, char in enumerate(lower_preserving_offsets(text)):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                end = position + 1
+                for index in output[state]:
+                    alias = self.aliases[index]
+                    matches.append(AliasMatch(alias, end - len(alias), end))
+        return matches
+
+    def scan(self, text: str) -> AliasScan:
+        """
+        Scans the text once, and summarizes the occurrences of the aliases
+
+        :param text: text to search
+        :return: all matches, # of matches per alias, and the longest alias found
+                 (the earliest in the alias list among aliases of the same length)
+        """
+        matches = self.find_all(text)
+        counts: Dict[str, int] = {}
+        for match in matches:
+            counts[match.alias] = counts.get(match.alias, 0) + 1
+
+        longest = None
+        for alias in self.aliases:
+            if alias in counts and (longest is None or len(alias) > len(longest)):
+                longest = alias
+        return AliasScan(matches, counts, longest)
+
+
+@lru_cache(maxsize=256)
+def get_alias_matcher(aliases: Tuple[str, ...]) -> AliasMatcher:
+    """
+    Returns the matcher of the given alias set, built once and reused across calls
+    """
+    return AliasMatcher(aliases)
+
 
 def find_longest_matching_variant(text: str, variants: List[str]) -> Optional[str]:
     """
@@ -9,9 +126,4 @@ def find_longest_matching_variant(text: str, variants: List[str]) -> Optional[st
     :param text: text to search for a match
     :return: the longest variant found in the text (if exists)
     """
-    sorted_variants = sorted(variants, key=len, reverse=True)
-    for variant in sorted_variants:
-        if re.search(variant, text, re.IGNORECASE) is not None:
-            return variant
-        
-    return None
+    return get_alias_matcher(tuple(variants)).scan(text).longest
@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from utils.rate_limiter import RateLimiter, call_with_retries
+
+DEFAULT_BASE_URL = 'https://rest.variantvalidator.org'
+DEFAULT_CACHE_FILE = os.path.join('cache', 'variant_validator.sqlite')
+DEFAULT_FIXTURE_DIR = os.path.join('cache', 'variant_validator_fixtures')
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_WORKERS = 4
+# VariantValidator asks clients to stay under 2 requests per second
+DEFAULT_REQUESTS_PER_MINUTE = 120
+
+BACKEND_HTTP = 'http'
+BACKEND_FIXTURES = 'fixtures'
+BACKENDS = [BACKEND_HTTP, BACKEND_FIXTURES]
+
+
+class VariantQuery(NamedTuple):
+    build: str
+    transcript: str
+    cdna: str
+
+
+class VariantValidatorError(Exception):
+    """
+    Failed lookup, carrying the HTTP status and headers (if any) so that throttling and server errors are retried
+    """
+    def __init__(self, message: str, http_status: Optional[int] = None, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.http_status: Optional[int] = http_status
+        self.headers: Dict[str, str] = headers or {}
+
+
+class VariantValidatorBackend(ABC):
+    """
+    Source of VariantValidator responses
+    """
+    @abstractmethod
+    def fetch(self, query: VariantQuery) -> Dict[str, Any]:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class HttpBackend(VariantValidatorBackend):
+    """
+    Calls the VariantValidator REST API through a pooled session, optionally recording every response
+    as a fixture file (replayed offline by FixtureBackend)
+    """
+    def __init__(
+            self,
+            base_url: str = DEFAULT_BASE_URL,
+            timeout: float = DEFAULT_TIMEOUT_SECONDS,
+            pool_size: int = DEFAULT_WORKERS,
+            record_dir: Optional[str] = None):
+        self.base_url: str = base_url.rstrip('/')
+        self.timeout: float = timeout
+        self.record_dir: Optional[str] = record_dir
+        self.session: requests.Session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+
+    def fetch(self, query: VariantQuery) -> Dict[str, Any]:
+        url = (f'{self.base_url}/VariantValidator/variantvalidator/'
+               f'{query.build}/{query.transcript}:{query.cdna}/all?content-type=application/json')
+        logging.debug(f'Calling VariantValidator: {url}')
+        resp = self.session.get(url, timeout=self.timeout)
+        if resp.status_code != 200:
+            raise VariantValidatorError(
+                f'VariantValidator returned HTTP {resp.status_code} for {query}', resp.status_code, dict(resp.headers))
+        response = resp.json()
+        if self.record_dir:
+            with open(fixture_path(self.record_dir, query), 'w', encoding='utf-8') as fd:
+                json.dump(response, fd, indent=2)
+        return response
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class FixtureBackend(VariantValidatorBackend):
+    """
+    Replays recorded VariantValidator responses, one JSON file per query, to run offline
+    """
+    def __init__(self, fixture_dir: str = DEFAULT_FIXTURE_DIR):
+        self.fixture_dir: str = fixture_dir
+
+    def fetch(self, query: VariantQuery) -> Dict[str, Any]:
+        path = fixture_path(self.fixture_dir, query)
+        if not os.path.isfile(path):
+            raise VariantValidatorError(f'No recorded response for {query}: {path}')
+        with open(path, 'r', encoding='utf-8') as fd:
+            return json.load(fd)
+
+
+def fixture_path(fixture_dir: str, query: VariantQuery) -> str:
+    """
+    :return: location of the fixture file recording the response to a query
+    """
+    name = re.sub(r'[^\w.+-]', '_', f'{query.build}_{query.transcript}_{query.cdna}')
+    return os.path.join(fixture_dir, f'{name}.json')
+
+
+def create_backend(name: str, fixture_dir: str = DEFAULT_FIXTURE_DIR, **kwargs) -> VariantValidatorBackend:
+    """
+    Creates a VariantValidator backend
+
+    :param name: http or fixtures
+    :param fixture_dir: folder of recorded responses (fixtures backend)
+    :return: backend
+    """
+    if name == BACKEND_HTTP:
+        return HttpBackend(**kwargs)
+    elif name == BACKEND_FIXTURES:
+        return FixtureBackend(fixture_dir)
+    raise ValueError(f"Unsupported VariantValidator backend '{name}'")
+
+
+class VariantValidatorClient:
+    """
+    Looks up variants in VariantValidator, caching responses on disk (SQLite) by build, transcript and cDNA change,
+    so that each variant is only ever fetched once.
+
+    Lookups of a list of variants are resolved concurrently by a bounded pool of workers, paced by a rate limiter
+    shared across workers, and retried on throttling, server errors and connection errors.
+    """
+    def __init__(
+            self,
+            backend: Optional[VariantValidatorBackend] = None,
+            cache_path: Optional[str] = DEFAULT_CACHE_FILE,
+            workers: int = DEFAULT_WORKERS,
+            requests_per_minute: Optional[int] = DEFAULT_REQUESTS_PER_MINUTE,
+            max_retries: int = 5):
+        self.backend: VariantValidatorBackend = backend or HttpBackend(pool_size=workers)
+        self.workers: int = max(workers, 1)
+        self.max_retries: int = max_retries
+        self.rate_limiter: Optional[RateLimiter] = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self.connection: Optional[sqlite3.Connection] = None
+        if cache_path:
+            cache_dir = os.path.dirname(cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS responses ('
+                    ' build TEXT NOT NULL,'
+                    ' transcript TEXT NOT NULL,'
+                    ' cdna TEXT NOT NULL,'
+                    ' response TEXT NOT NULL,'
+                    ' fetched_at REAL NOT NULL,'
+                    ' PRIMARY KEY (build, transcript, cdna))')
+
+    def lookup(self, build: str, transcript: str, cdna: str) -> Dict[str, Any]:
+        """
+        Looks up a single variant
+
+        :param build: genome build (e.g. GRCh38)
+        :param transcript: transcript (e.g. NM_000527.5)
+        :param cdna: cDNA change (e.g. c.1A>C)
+        :return: VariantValidator response
+        """
+        query = VariantQuery(build, transcript, cdna)
+        cached = self.__get_cached(query)
+        if cached is not None:
+            return cached
+        return self.__fetch(query)
+
+    def lookup_many(self, queries: Iterable[VariantQuery]) -> Dict[VariantQuery, Any]:
+        """
+        Looks up a list of variants, fetching the ones not cached concurrently.
+        Failed lookups do not fail the others: the error is returned in place of the response.
+
+        :param queries: (build, transcript, cDNA change) of each variant
+        :return: VariantValidator response (or VariantValidatorError) by query
+        """
+        results: Dict[VariantQuery, Any] = {}
+        to_fetch: List[VariantQuery] = []
+        for query in dict.fromkeys(VariantQuery(*query) for query in queries):
+            cached = self.__get_cached(query)
+            if cached is not None:
+                results[query] = cached
+            else:
+                to_fetch.append(query)
+
+        if to_fetch:
+            logging.info(f'Fetching {len(to_fetch)} variants from VariantValidator ({len(results)} cached)')
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='variant_validator') as pool:
+                for query, result in zip(to_fetch, pool.map(self.__fetch_or_error, to_fetch)):
+                    results[query] = result
+        return results
+
+    def close(self) -> None:
+        self.backend.close()
+        if self.connection:
+            with self.lock:
+                self.connection.close()
+
+    def __fetch_or_error(self, query: VariantQuery) -> Any:
+        try:
+            return self.__fetch(query)
+        except Exception as ex:
+            logging.error(f'VariantValidator lookup failed for {query}: {ex}')
+            return ex if isinstance(ex, VariantValidatorError) else VariantValidatorError(str(ex))
+
+    def __fetch(self, query: VariantQuery) -> Dict[str, Any]:
+        def fetch() -> Dict[str, Any]:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(0)
+            return self.backend.fetch(query)
+
+        response = call_with_retries(fetch, self.max_retries, self.rate_limiter)
+        if self.connection:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO responses (build, transcript, cdna, response, fetched_at) VALUES (?, ?, ?, ?, ?)',
+                    (query.build, query.transcript, query.cdna, json.dumps(response), time.time()))
+        return response
+
+    def __get_cached(self, query: VariantQuery) -> Optional[Dict[str, Any]]:
+        if not self.connection:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT response FROM responses WHERE build = ? AND transcript = ? AND cdna = ?', query).fetchone()
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]) if row else None